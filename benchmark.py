@@ -0,0 +1,233 @@
+'''
+Hover-latency benchmark of dash_plot_spectra, dash_plot_images and of
+dash_plot showing both (--app panels).
+
+Builds the apps with synthetic catalogs and sends synthetic hoverData (and
+color-coding changes) through the Dash request handler of the Flask test
+client, so the numbers include Dash's own overhead and JSON encoding but no
+network. For every callback (and, in clientside mode, the data routes) it
+reports the p50/p99 latency, the mean response size (as sent and gzipped)
+and the peak memory allocated while serving the requests, followed by the
+total number of bytes sent per hover.
+
+    python benchmark.py --points 10000 100000 1000000 --features 4000 --zoom 3
+    python benchmark.py --app images --points 100000 --image-pixels 128 --image-format png
+    python benchmark.py --app panels --points 100000 --features 4000 --image-pixels 64
+'''
+import argparse
+import gzip
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def synthetic_spectra(n_points, n_features=4000, n_spectra=1, n_zoom=2, n_properties=4, seed=0):
+    '''Arguments of dash_plot_spectra for a random catalog.'''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(3600., 9800., n_features)
+    zoom = {f'line {l}': rng.uniform(4000., 9000., n_points) for l in range(n_zoom)}
+    return dict(
+        x={'x': rng.normal(size=n_points)},
+        y={'y': rng.normal(size=n_points)},
+        color_code={'c': rng.random(n_points), 'd': rng.random(n_points)},
+        properties={f'p{i}': rng.normal(size=n_points) for i in range(n_properties)},
+        spectra=[rng.normal(size=(n_points, n_features)).astype(np.float32) for i in range(n_spectra)],
+        wavelength=[wavelength] * n_spectra,
+        spec_colors=['white', 'red', 'green', 'blue'][:n_spectra],
+        spec_names=[str(i) for i in range(n_spectra)],
+        zoom=zoom if n_zoom else None,
+        zoom_windows=[50.] * n_zoom,
+        zoom_extras=[{'z': rng.random(n_points)} for l in range(n_zoom)] if n_zoom else None,
+    )
+
+
+def synthetic_images(n_points, n_pixels=64, n_images=1, n_properties=4, seed=0):
+    '''Arguments of dash_plot_images for a random catalog.'''
+    rng = np.random.default_rng(seed)
+    return dict(
+        x={'x': rng.normal(size=n_points)},
+        y={'y': rng.normal(size=n_points)},
+        color_code={'c': rng.random(n_points), 'd': rng.random(n_points)},
+        properties={f'p{i}': rng.normal(size=n_points) for i in range(n_properties)},
+        images=[rng.random((n_points, n_pixels, n_pixels), dtype=np.float32) for i in range(n_images)],
+        image_labels=[f'image {i}' for i in range(n_images)],
+    )
+
+
+def hover_data(x, y, ind):
+    '''hoverData of the 2D plane when galaxy ind is hovered.'''
+    return {'points': [{'curveNumber': 0, 'pointNumber': int(ind), 'pointIndex': int(ind),
+                        'x': float(x[ind]), 'y': float(y[ind]), 'customdata': int(ind)}]}
+
+
+def _outputs(callback):
+    outputs = callback['output']
+    if isinstance(outputs, list):
+        return [{'id': output.component_id, 'property': output.component_property} for output in outputs]
+    return {'id': outputs.component_id, 'property': outputs.component_property}
+
+
+def benchmark_app(app, x, y, n_hovers=200, colors=(), x_labels=(), seed=0):
+    '''
+    Time the callbacks of app with n_hovers random hovers, a change of
+    color coding per element of colors and a change of x axis per element
+    of x_labels.
+
+    Output
+    ------
+
+    Returns {name: {'calls', 'p50_ms', 'p99_ms', 'mean_bytes',
+    'mean_gzip_bytes'}} and the peak memory allocated while serving, in
+    bytes. Responses the app compressed itself (compress=True) are counted
+    as sent.
+    '''
+    client = app.server.test_client()
+    client.environ_base['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    client.get('/')
+    rng = np.random.default_rng(seed)
+    hovered = rng.integers(len(x), size=n_hovers)
+
+    # Inputs and states that don't change keep their initial value.
+    initial = {}
+    for component in app.layout._traverse():
+        for prop in ('value', 'data'):
+            if isinstance(getattr(component, 'id', None), str) and hasattr(component, prop):
+                initial[f'{component.id}.{prop}'] = getattr(component, prop)
+
+    requests = []
+    for output, callback in app.callback_map.items():
+        if 'callback' not in callback:
+            # Clientside callbacks run in the browser.
+            continue
+        inputs = [f"{i['id']}.{i['property']}" for i in callback['inputs']]
+        name = callback['callback'].__name__
+        if '2d-scatter.hoverData' in inputs:
+            changes = [('2d-scatter.hoverData', hover_data(x, y, ind)) for ind in hovered]
+        elif 'hover-point.data' in inputs:
+            # Debounced hover (hover_debounce)
+            changes = [('hover-point.data', {'hoverData': hover_data(x, y, ind), 'seq': seq,
+                                             'session': 'benchmark'})
+                       for seq, ind in enumerate(hovered)]
+        elif 'color coding.value' in inputs:
+            changes = ([('color coding.value', color) for color in colors] +
+                       [('x axis.value', label) for label in x_labels])
+        else:
+            continue
+        for k, (changed, value) in enumerate(changes):
+            values = dict(initial, **{changed: value})
+            body = {'output': output, 'outputs': _outputs(callback), 'changedPropIds': [changed],
+                    'inputs': [dict(i, value=values.get(f"{i['id']}.{i['property']}"))
+                               for i in callback['inputs']],
+                    'state': [dict(i, value=values.get(f"{i['id']}.{i['property']}"))
+                              for i in callback['state']]}
+            label = name if 'hover' in changed else f"{name}[{changed.split('.')[0]}]"
+            requests.append((k, label, 'post', '/_dash-update-component', json.dumps(body)))
+
+    urls = app.server.url_map.bind('localhost')
+    for rule in app.server.url_map.iter_rules():
+        if rule.endpoint.startswith('binary_') or rule.endpoint == 'images':
+            for k, ind in enumerate(hovered):
+                values = {key: value for key, value in {'ind': int(ind), 'i': 0, 'level': 0}.items()
+                          if key in rule.arguments}
+                requests.append((k, rule.endpoint, 'get', urls.build(rule.endpoint, values), None))
+    # All the requests of a hover are sent before those of the next one, as
+    # the browser would.
+    requests.sort(key=lambda request: request[0])
+
+    timings = {}
+    tracemalloc.start()
+    for k, name, method, url, body in requests:
+        start = time.perf_counter()
+        if method == 'post':
+            response = client.post(url, data=body, content_type='application/json')
+        else:
+            response = client.get(url)
+        seconds = time.perf_counter() - start
+        if response.status_code not in (200, 204):
+            raise RuntimeError(f'{name} failed with status {response.status_code}')
+        size = gzip_size = len(response.data)
+        if 'Content-Encoding' not in response.headers:
+            gzip_size = len(gzip.compress(response.data, 6))
+        timings.setdefault(name, []).append((seconds, size, gzip_size))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results = {}
+    for name, values in timings.items():
+        values = np.array(values)
+        p50, p99 = np.percentile(values[:, 0], [50, 99]) * 1e3
+        results[name] = {'calls': len(values), 'p50_ms': float(p50), 'p99_ms': float(p99),
+                         'mean_bytes': float(values[:, 1].mean()),
+                         'mean_gzip_bytes': float(values[:, 2].mean())}
+    return results, peak
+
+
+def bytes_per_hover(results, n_hovers):
+    '''Bytes sent (and gzipped) per hover, over all the hover callbacks and routes.'''
+    # Callbacks triggered by anything but a hover are labelled name[trigger].
+    hover = [result for name, result in results.items() if '[' not in name]
+    return (sum(result['calls'] * result['mean_bytes'] for result in hover) / n_hovers,
+            sum(result['calls'] * result['mean_gzip_bytes'] for result in hover) / n_hovers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hover-latency benchmark of the Dash apps.')
+    parser.add_argument('--app', choices=['spectra', 'images', 'panels'], default='spectra')
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--features', type=int, nargs='+', default=[4000],
+                        help='wavelength points per spectrum')
+    parser.add_argument('--spectra', type=int, default=1, help='spectra per object')
+    parser.add_argument('--zoom', type=int, default=2, help='number of zoom windows')
+    parser.add_argument('--image-pixels', type=int, default=64)
+    parser.add_argument('--images', type=int, default=1, help='images per object')
+    parser.add_argument('--hovers', type=int, default=200)
+    parser.add_argument('--clientside', action='store_true')
+    parser.add_argument('--max-points', type=int, default=None)
+    parser.add_argument('--density-bins', type=int, default=None)
+    parser.add_argument('--image-format', default=None)
+    parser.add_argument('--hover-debounce', type=float, default=None)
+    parser.add_argument('--compress', action='store_true', help='requires flask-compress')
+    args = parser.parse_args()
+
+    print(f"{'callback':<32}{'points':>10}{'size':>8}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'bytes':>12}{'gzip':>12}{'peak MB':>10}{'build s':>10}")
+    sizes = [args.image_pixels] if args.app == 'images' else args.features
+    for n_points in args.points:
+        for size in sizes:
+            start = time.perf_counter()
+            options = dict(clientside=args.clientside, max_points=args.max_points,
+                           density_bins=args.density_bins, hover_debounce=args.hover_debounce,
+                           compress=args.compress)
+            if args.app == 'spectra':
+                from dash_script import dash_plot_spectra
+                kwargs = synthetic_spectra(n_points, size, args.spectra, args.zoom)
+                app = dash_plot_spectra(**kwargs, **options)
+            elif args.app == 'images':
+                from dash_script_images import dash_plot_images
+                kwargs = synthetic_images(n_points, size, args.images)
+                app = dash_plot_images(**kwargs, **options, image_format=args.image_format)
+            else:
+                from dash_app import dash_plot
+                kwargs = synthetic_spectra(n_points, size, args.spectra, args.zoom)
+                images = synthetic_images(n_points, args.image_pixels, args.images)
+                kwargs.update(images=images['images'], image_labels=images['image_labels'])
+                app = dash_plot(**kwargs, **options, image_format=args.image_format)
+            build = time.perf_counter() - start
+
+            x, y = list(kwargs['x'].values())[0], list(kwargs['y'].values())[0]
+            results, peak = benchmark_app(app, x, y, args.hovers,
+                                          colors=list(kwargs['color_code'])[::-1] * 5,
+                                          x_labels=list(kwargs['properties'])[::-1] * 5)
+            for name, result in results.items():
+                print(f"{name:<32}{n_points:>10}{size:>8}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                      f"{result['mean_bytes']:>12.0f}{result['mean_gzip_bytes']:>12.0f}"
+                      f"{peak / 2**20:>10.1f}{build:>10.2f}")
+            per_hover, per_hover_gzip = bytes_per_hover(results, args.hovers)
+            print(f"{'bytes per hover':<32}{n_points:>10}{size:>8}{'':>20}"
+                  f"{per_hover:>12.0f}{per_hover_gzip:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
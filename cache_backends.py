@@ -0,0 +1,272 @@
+'''
+Caches of hover updates shared by the processes of a server.
+
+Every server process keeps the updates of recently hovered galaxies in its
+own memory (figure_cache.LRUCache). With several worker processes, or
+several machines, a galaxy hovered in one of them is built again by the
+next one that gets a hover of it. A shared cache behind the in-memory ones
+(cache=... in dash_plot_spectra and dash_app.dash_plot, --cache in
+serve.py) is read on a miss and written whenever an update is built, so
+every update is built once for all of them:
+
+    FileCache    a directory, e.g. on a local disk shared by the workers of
+                 one machine or on a network file system.
+    RedisCache   a Redis server (or anything speaking its protocol), shared
+                 by every machine that can reach it.
+
+Both store the same values as the in-memory cache: the JSON of the Patch
+updates, or the clientside payloads. Their keys only name a galaxy, so the
+apps keep the entries of different catalogs, and of different options, apart
+with a namespace: the fingerprint of the catalog in serve.py, or else a
+fingerprint of the arguments the updates are built from (see fingerprint).
+'''
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+from figure_cache import storage_key
+from spectra_store import SpectraStore
+
+logger = logging.getLogger(__name__)
+
+
+def write_file(path, data):
+    '''
+    Write data to path through a temporary file of its own, renamed once
+    written, so that no process reads a half-written file and threads
+    writing the same path don't get in each other's way. Failed writes are
+    logged and skipped: the files only save work.
+    '''
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    except OSError:
+        logger.warning('Writing %s failed', path, exc_info=True)
+
+
+class FileCache:
+    '''
+    Cache with one file per entry in a directory.
+
+    Files are written with write_file, so processes never read a
+    half-written entry and threads writing the same entry (a hover and a
+    prefetch) don't get in each other's way. Like RedisCache, failed writes
+    are logged and skipped. Entries are never removed (there is at most one
+    per galaxy and kind of update); clear() removes them all.
+
+    Input
+    -----
+
+    directory: String
+               Created if needed.
+    '''
+
+    writable = True
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def namespaced(self, namespace):
+        '''The cache of the entries under namespace, in a subdirectory.'''
+        return FileCache(os.path.join(self.directory, namespace))
+
+    def _path(self, key):
+        return os.path.join(self.directory, *storage_key(key).split('/'))
+
+    def get(self, key, default=None):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return default
+
+    def put(self, key, value):
+        path = self._path(key)
+        if isinstance(value, str):
+            value = value.encode()
+        write_file(path, value)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return sum(len(files) for _, _, files in os.walk(self.directory))
+
+    def clear(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+
+class RedisCache:
+    '''
+    Cache in a Redis server.
+
+    A shared cache only saves work, so if the server can't be reached the
+    error is logged and the entry treated as missing.
+
+    Input
+    -----
+
+    client: redis.Redis
+            Any object with the get, set, exists, scan_iter and delete
+            methods of redis.Redis, e.g. fakeredis.FakeRedis in tests.
+
+    prefix: String. Default='dash_spectra:'
+            Prepended to the keys, so that several catalogs can share a
+            server.
+
+    ttl: Integer. Default=None
+         Seconds after which entries expire. None keeps them until Redis
+         evicts them (see its maxmemory-policy).
+    '''
+
+    writable = True
+
+    def __init__(self, client, prefix='dash_spectra:', ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        '''RedisCache of a redis:// URL. Requires redis-py (pip install redis).'''
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def namespaced(self, namespace):
+        '''The cache of the entries under namespace, with a longer prefix.'''
+        return RedisCache(self.client, f'{self.prefix}{namespace}:', self.ttl)
+
+    def _name(self, key):
+        return self.prefix + storage_key(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self.client.get(self._name(key))
+        except Exception:
+            logger.warning('Reading %s from Redis failed', self._name(key), exc_info=True)
+            return default
+        return default if value is None else value
+
+    def put(self, key, value):
+        try:
+            self.client.set(self._name(key), value, ex=self.ttl)
+        except Exception:
+            logger.warning('Writing %s to Redis failed', self._name(key), exc_info=True)
+
+    def __contains__(self, key):
+        try:
+            return bool(self.client.exists(self._name(key)))
+        except Exception:
+            logger.warning('Reading %s from Redis failed', self._name(key), exc_info=True)
+            return False
+
+    def clear(self):
+        for name in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(name)
+
+
+def open_cache(cache, namespace=None):
+    '''
+    Return cache as a shared cache: a redis:// (or rediss://, unix://) URL
+    gives a RedisCache, any other string a FileCache of that directory, and
+    caches are used as they are.
+
+    namespace (e.g. the fingerprint of a catalog, see serve.py) separates
+    the entries of different catalogs or versions of a catalog in the same
+    directory or Redis server. Caches without a namespaced method (any
+    object with get and put) are returned as they are.
+    '''
+    if cache is None:
+        return None
+    if isinstance(cache, str):
+        if cache.startswith(('redis://', 'rediss://', 'unix://')):
+            cache = RedisCache.from_url(cache)
+        else:
+            cache = FileCache(cache)
+    if namespace and hasattr(cache, 'namespaced'):
+        return cache.namespaced(namespace)
+    return cache
+
+
+def _file_stamp(value):
+    '''
+    Path, size and modification time of the file behind value: a file name,
+    a np.memmap of a whole file (or of the part after its offset) or an h5py
+    Dataset. None for anything else.
+    '''
+    if isinstance(value, (str, os.PathLike)):
+        filename = value
+    elif isinstance(value, np.memmap):
+        # Slices of a memory map keep its filename and offset, so only the
+        # map itself stands for the file.
+        filename = value.filename if isinstance(value.base, mmap.mmap) else None
+    else:
+        filename = getattr(getattr(value, 'file', None), 'filename', None)
+    if not isinstance(filename, (str, os.PathLike)) or not os.path.isfile(filename):
+        return None
+    stat = os.stat(filename)
+    return (f'{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}:'
+            f'{getattr(value, "offset", 0)}:{getattr(value, "name", "")}')
+
+
+def fingerprint(value, chunk_size=4096):
+    '''
+    Hash of the arrays (or SpectraStores), dictionaries, lists and plain
+    values in value, e.g. the arguments the hover updates of an app are
+    built from.
+
+    Arrays in memory are hashed whole, chunk_size rows at a time. Arrays
+    read from a file (memory maps, h5py Datasets) and strings naming a file
+    are hashed by the path, size and modification time of the file instead,
+    so that large catalogs on disk are not read at start up and a file
+    saved again gets a new hash.
+    '''
+    digest = hashlib.sha1()
+
+    def update(value):
+        stamp = _file_stamp(value)
+        if stamp is not None:
+            digest.update(f'{type(value).__name__}{stamp}'.encode())
+            if hasattr(value, 'shape'):
+                digest.update(f'{tuple(value.shape)}{value.dtype}'.encode())
+        elif isinstance(value, SpectraStore):
+            digest.update(type(value).__name__.encode())
+            update(value.data)
+            update(getattr(value, 'scale', None))
+            update(getattr(value, 'offset', None))
+        elif hasattr(value, 'shape') and len(value.shape) > 0:
+            digest.update(f'{type(value).__name__}{tuple(value.shape)}{value.dtype}'.encode())
+            for start in range(0, len(value), chunk_size):
+                rows = np.asarray(value[start:start + chunk_size])
+                if rows.dtype.hasobject:
+                    update(rows.tolist())
+                else:
+                    digest.update(np.ascontiguousarray(rows).tobytes())
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                digest.update(repr(key).encode())
+                update(item)
+        elif isinstance(value, (list, tuple)):
+            digest.update(f'[{len(value)}'.encode())
+            for item in value:
+                update(item)
+        else:
+            digest.update(repr(value).encode())
+
+    update(value)
+    return digest.hexdigest()
@@ -0,0 +1,497 @@
+'''
+On-disk catalog layout read by the production server (serve.py).
+
+A catalog is a directory holding the arguments of dash_plot_spectra,
+dash_plot_images or dash_plot (spectra and images together): every array is stored as its own .npy file and everything
+else in catalog.json, together with which app to build. Arrays are
+memory-mapped when the catalog is loaded, so server processes that load the
+same catalog share one copy of the data through the page cache.
+
+Rows (new galaxies) are appended with append_catalog, which grows the .npy
+files in place and records the number of rows in rows.json. Running apps
+pick them up through a CatalogWatcher (the refresh argument of the apps,
+--refresh in serve.py).
+'''
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from spectra_store import QUANTIZED_DTYPES, QuantizedSpectraStore, SpectraStore, quantize_rows
+
+MANIFEST = 'catalog.json'
+ROWS = 'rows.json'
+APPS = ('spectra', 'images', 'panels')
+# Arguments of the apps with one row per galaxy, which rows are appended to.
+PER_GALAXY = ('x', 'y', 'color_code', 'properties', 'spectra', 'images', 'y_max', 'y_min',
+              'zoom', 'zoom_extras', 'downsample')
+
+
+def _save(value, directory, name, chunk_size):
+    '''Write the arrays in value to directory and return its JSON description.'''
+    if isinstance(value, QuantizedSpectraStore):
+        # Saved as it is stored, without dequantizing.
+        return {'__quantized__': [_save(array, directory, f'{name}.{part}', chunk_size)
+                                  for part, array in [('codes', value.data), ('scale', value.scale),
+                                                      ('offset', value.offset)]]}
+    if isinstance(value, SpectraStore) or isinstance(value, np.ndarray):
+        filename = name + '.npy'
+        shape, dtype = tuple(value.shape), value.dtype
+        array = np.lib.format.open_memmap(os.path.join(directory, filename), mode='w+',
+                                          dtype=dtype, shape=shape)
+        if isinstance(value, SpectraStore):
+            for start, block in value.iter_chunks(chunk_size):
+                array[start:start + len(block)] = block
+        else:
+            array[...] = value
+        array.flush()
+        return {'__npy__': filename}
+    if isinstance(value, dict):
+        return {'__dict__': [[key, _save(item, directory, f'{name}.{i}', chunk_size)]
+                             for i, (key, item) in enumerate(value.items())]}
+    if isinstance(value, (list, tuple)):
+        return [_save(item, directory, f'{name}.{i}', chunk_size) for i, item in enumerate(value)]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _load(value, directory, mmap_mode, n_points=None):
+    '''Read the arrays described by value, keeping their first n_points rows if given.'''
+    if isinstance(value, dict) and '__npy__' in value:
+        array = np.load(os.path.join(directory, value['__npy__']), mmap_mode=mmap_mode)
+        return array if n_points is None else array[:n_points]
+    if isinstance(value, dict) and '__dict__' in value:
+        return {key: _load(item, directory, mmap_mode, n_points) for key, item in value['__dict__']}
+    if isinstance(value, dict) and '__quantized__' in value:
+        return QuantizedSpectraStore(*[_load(item, directory, mmap_mode, n_points)
+                                       for item in value['__quantized__']])
+    if isinstance(value, list):
+        return [_load(item, directory, mmap_mode, n_points) for item in value]
+    return value
+
+
+def _load_kwargs(path, kwargs, mmap_mode):
+    # Rows of an append that didn't finish are past the committed size.
+    n_points = _committed_size(path)
+    return {key: _load(value, path, mmap_mode, n_points if key in PER_GALAXY else None)
+            for key, value in kwargs.items()}
+
+
+def _read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def _write_json(path, value):
+    '''Write a JSON file under a temporary name and rename it, so readers never see half of it.'''
+    with open(path + f'.{os.getpid()}', 'w') as f:
+        json.dump(value, f, indent=1)
+    os.replace(path + f'.{os.getpid()}', path)
+
+
+def save_catalog(path, app='spectra', chunk_size=4096, **kwargs):
+    '''
+    Save the arguments of dash_plot_spectra (app='spectra'),
+    dash_plot_images (app='images') or dash_app.dash_plot (app='panels') as
+    a catalog directory.
+
+    Arrays (including SpectraStores, copied chunk by chunk), and dictionaries
+    and lists of them, are written as .npy files. Other arguments have to be
+    JSON-serializable. Dictionary keys keep their order.
+
+    Example
+    -------
+
+    save_catalog('sdss_catalog', x={'n2_ha': n2_ha}, y={'o3_hb': o3_hb},
+                 spectra=[spectra], wavelength=[wavelength])
+    '''
+    if app not in APPS:
+        raise ValueError(f'app should be one of {APPS}, got {app}')
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, ROWS)):
+        os.remove(os.path.join(path, ROWS))
+    manifest = {'app': app,
+                'kwargs': {key: _save(value, path, key, chunk_size) for key, value in kwargs.items()}}
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def load_catalog(path, mmap_mode='r'):
+    '''
+    Load a catalog saved with save_catalog.
+
+    Output
+    ------
+
+    Returns (app, kwargs): the name of the app and its arguments, with every
+    array memory-mapped (or read into memory with mmap_mode=None).
+    '''
+    manifest = _read_manifest(path)
+    return manifest['app'], _load_kwargs(path, manifest['kwargs'], mmap_mode)
+
+
+def _committed_size(path):
+    '''The number of galaxies recorded by append_catalog, None if it never ran.'''
+    try:
+        with open(os.path.join(path, ROWS)) as f:
+            return json.load(f)['n_points']
+    except FileNotFoundError:
+        return None
+
+
+def catalog_size(path):
+    '''
+    Number of galaxies in a catalog: the rows committed by the last
+    append_catalog, or else the length of the first x column.
+    '''
+    n_points = _committed_size(path)
+    if n_points is None:
+        x = _read_manifest(path)['kwargs']['x']
+        n_points = _npy_header(os.path.join(path, x['__dict__'][0][1]['__npy__']))[0][0]
+    return n_points
+
+
+def _npy_header(filename):
+    '''(shape, fortran_order, dtype, offset of the data) of a .npy file.'''
+    with open(filename, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        return shape, fortran_order, dtype, f.tell()
+
+
+def _appended(value, rows, directory, name):
+    '''
+    The (file, rows) to append for the rows of the argument name, checked
+    against the arrays described by value (an entry of catalog.json).
+    Arguments that aren't arrays in the catalog take no rows.
+    '''
+    if isinstance(value, dict) and '__npy__' in value:
+        filename = os.path.join(directory, value['__npy__'])
+        shape, _, dtype, _ = _npy_header(filename)
+        if rows is None:
+            raise ValueError(f'The catalog has rows of {name}, which are missing')
+        rows = rows[:] if isinstance(rows, SpectraStore) else np.asarray(rows)
+        if rows.shape[1:] != shape[1:]:
+            raise ValueError(f'Rows of {name} should have the shape (N, {", ".join(map(str, shape[1:]))}), '
+                             f'got {rows.shape}')
+        return [(filename, np.ascontiguousarray(rows, dtype=dtype))]
+    if isinstance(value, dict) and '__dict__' in value:
+        keys = [key for key, _ in value['__dict__']]
+        if not isinstance(rows, dict) or sorted(rows) != sorted(keys):
+            raise ValueError(f'{name} should have the keys {keys}')
+        return [appended for key, item in value['__dict__']
+                for appended in _appended(item, rows[key], directory, f'{name}[{key!r}]')]
+    if isinstance(value, dict) and '__quantized__' in value:
+        codes = value['__quantized__'][0]
+        dtype = _npy_header(os.path.join(directory, codes['__npy__']))[2]
+        if rows is None:
+            raise ValueError(f'The catalog has rows of {name}, which are missing')
+        # Rows are quantized like the catalog, row by row.
+        rows = rows[:] if isinstance(rows, SpectraStore) else rows
+        return [appended for item, part in zip(value['__quantized__'], quantize_rows(rows, dtype))
+                for appended in _appended(item, part, directory, name)]
+    if isinstance(value, list):
+        if not isinstance(rows, (list, tuple)) or len(rows) != len(value):
+            raise ValueError(f'{name} should be a list of {len(value)} arrays')
+        return [appended for i, (item, part) in enumerate(zip(value, rows))
+                for appended in _appended(item, part, directory, f'{name}[{i}]')]
+    return []
+
+
+def _append_npy(filename, rows, n_points):
+    '''
+    Append rows after the first n_points rows of a .npy file, in place: the
+    rows are written at the end and the shape in the header updated, which
+    fits since numpy pads headers for the shape to grow. Anything after the
+    first n_points rows, e.g. rows of an interrupted append, is dropped.
+    Arrays whose header doesn't fit, or stored in Fortran order, are
+    rewritten instead.
+    '''
+    shape, fortran_order, dtype, offset = _npy_header(filename)
+    shape = (n_points + len(rows),) + tuple(shape[1:])
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+    if fortran_order or len(header.getvalue()) != offset:
+        array = np.concatenate([np.load(filename, mmap_mode='r')[:n_points], rows])
+        np.save(filename + f'.{os.getpid()}.npy', array)
+        os.replace(filename + f'.{os.getpid()}.npy', filename)
+        return
+    with open(filename, 'r+b') as f:
+        f.truncate(offset + n_points * dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64)))
+        f.seek(0, os.SEEK_END)
+        f.write(rows.data)
+        f.seek(0)
+        f.write(header.getvalue())
+
+
+def append_catalog(path, metadata=None, **rows):
+    '''
+    Append galaxies to a catalog saved with save_catalog or CatalogWriter,
+    e.g. the observations of the last night, without rewriting it.
+
+    Input
+    -----
+
+    path: String
+          The catalog directory.
+
+    metadata: Python dictionary. Default=None
+              The rows of the metadata columns, if the catalog has any.
+
+    **rows: The new rows of every per-galaxy argument of the app stored as
+            arrays in the catalog (x, y, color_code, spectra, images, ...),
+            with the same structure as when it was saved: e.g.
+            x={'mass': mass} for the new masses. Spectra of quantized
+            catalogs are quantized here.
+
+    Every .npy file is extended in place, so apps serving the catalog keep
+    their memory maps; the new rows count once rows.json is written, last,
+    so readers see either all of them or none. Apps serving the catalog with
+    refresh=CatalogWatcher(path) show them without a restart. Per-galaxy
+    values the apps compute (y ranges from y_range_percentiles,
+    downsample='lttb') are computed by the apps for the new rows only.
+
+    Example
+    -------
+
+    append_catalog('sdss_catalog', x={'n2_ha': new_n2_ha}, y={'o3_hb': new_o3_hb},
+                   spectra=[new_spectra])
+
+    Output
+    ------
+
+    Returns the number of galaxies in the catalog.
+    '''
+    manifest = _read_manifest(path)
+    stored = {key: value for key, value in manifest['kwargs'].items() if key in PER_GALAXY}
+    unknown = [key for key in rows if key not in stored]
+    if unknown:
+        raise ValueError(f'The catalog has no per-galaxy arrays {unknown}')
+    appended = [item for key, value in stored.items() for item in _appended(value, rows.get(key), path, key)]
+    if manifest.get('metadata'):
+        appended += _appended({'__dict__': list(manifest['metadata'].items())}, metadata, path, 'metadata')
+    lengths = {len(array) for _, array in appended}
+    if len(lengths) != 1:
+        raise ValueError('Every argument should have the same number of new rows')
+
+    n_points = catalog_size(path)
+    for filename, array in appended:
+        _append_npy(filename, array, n_points)
+    n_points += lengths.pop()
+    _write_json(os.path.join(path, ROWS), {'n_points': n_points})
+    return n_points
+
+
+class CatalogWatcher:
+    '''
+    Watches a catalog for rows appended with append_catalog, for the refresh
+    argument of the apps (see dash_app.dash_plot).
+
+    Calling it returns the arguments of the app, loaded as by load_catalog,
+    when rows were appended since the last call, and None otherwise, which
+    only takes a stat of rows.json.
+
+    Input
+    -----
+
+    path: String
+          The catalog directory.
+
+    mmap_mode: String. Default='r'
+               As in load_catalog.
+
+    n_points: Integer. Default=None
+              Number of galaxies the app was built with. The size of the
+              catalog when the watcher is created by default, so create it
+              before loading the catalog.
+    '''
+
+    def __init__(self, path, mmap_mode='r', n_points=None):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.stamp = self._stamp()
+        self.n_points = catalog_size(path) if n_points is None else n_points
+        self.lock = threading.Lock()
+
+    def _stamp(self):
+        try:
+            return os.stat(os.path.join(self.path, ROWS)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def __call__(self):
+        with self.lock:
+            stamp = self._stamp()
+            if stamp == self.stamp:
+                return None
+            self.stamp = stamp
+            n_points = catalog_size(self.path)
+            if n_points <= self.n_points:
+                return None
+            self.n_points = n_points
+            return load_catalog(self.path, self.mmap_mode)[1]
+
+
+class CatalogWriter:
+    '''
+    Write a catalog piece by piece, for catalogs too large to hold in
+    memory (see loaders.py).
+
+    Arrays are created as memory-mapped .npy files of their final size and
+    filled by the caller, e.g. a chunk of rows at a time. catalog.json is
+    only written by close(), so an interrupted write never leaves a catalog
+    that looks complete.
+
+    Example
+    -------
+
+    with CatalogWriter('desi_catalog', n_points) as writer:
+        mass = writer.column('x', 'mass')
+        flux = writer.spectra(n_features, wavelength)
+        for start, stop in chunks:
+            mass[start:stop] = ...
+            flux[start:stop] = ...
+    '''
+
+    def __init__(self, path, n_points, app='spectra'):
+        if app not in APPS:
+            raise ValueError(f'app should be one of {APPS}, got {app}')
+        os.makedirs(path, exist_ok=True)
+        # The arrays of an older catalog in the same directory are about to
+        # be overwritten, so it must not be loadable anymore.
+        for name in (MANIFEST, ROWS):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        self.path = path
+        self.n_points = n_points
+        self.app = app
+        self.kwargs = {}
+        self.metadata = {}
+        self.arrays = []
+
+    def _create(self, filename, shape, dtype):
+        array = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='w+',
+                                          dtype=dtype, shape=shape)
+        self.arrays.append(array)
+        return array
+
+    def column(self, key, label, dtype=np.float64):
+        '''
+        A (N_points) array stored as kwargs[key][label], e.g.
+        column('x', 'mass') or column('color_code', 'redshift').
+        '''
+        entries = self.kwargs.setdefault(key, {'__dict__': []})['__dict__']
+        filename = f'{key}.{len(entries)}.npy'
+        entries.append([label, {'__npy__': filename}])
+        return self._create(filename, (self.n_points,), dtype)
+
+    def metadata_column(self, label, dtype=np.float64):
+        '''
+        A (N_points) array stored with the catalog but not passed to the
+        app, e.g. object ids. Read back with load_metadata.
+        '''
+        filename = f'metadata.{len(self.metadata)}.npy'
+        self.metadata[label] = {'__npy__': filename}
+        return self._create(filename, (self.n_points,), dtype)
+
+    def spectra(self, n_features, wavelength, dtype=np.float32):
+        '''
+        A (N_points, n_features) array appended to the spectra, with its
+        wavelength grid appended to the wavelengths.
+
+        With dtype np.int16 or np.float16 the spectra are quantized (see
+        spectra_store.quantize_rows) as rows are assigned, and a
+        QuantizedSpectraStore is returned instead of an array.
+        '''
+        i = len(self.kwargs.setdefault('spectra', []))
+        self.kwargs.setdefault('wavelength', []).append(
+            _save(np.asarray(wavelength), self.path, f'wavelength.{i}', 4096))
+        if np.dtype(dtype) in QUANTIZED_DTYPES:
+            parts = [('codes', dtype, (self.n_points, n_features)),
+                     ('scale', np.float64, (self.n_points,)),
+                     ('offset', np.float64, (self.n_points,))]
+            self.kwargs['spectra'].append({'__quantized__': [{'__npy__': f'spectra.{i}.{part}.npy'}
+                                                             for part, _, _ in parts]})
+            return QuantizedSpectraStore(*[self._create(f'spectra.{i}.{part}.npy', shape, part_dtype)
+                                           for part, part_dtype, shape in parts])
+        self.kwargs['spectra'].append({'__npy__': f'spectra.{i}.npy'})
+        return self._create(f'spectra.{i}.npy', (self.n_points, n_features), dtype)
+
+    def images(self, shape, dtype=np.float32):
+        '''A (N_points, *shape) array appended to the images.'''
+        i = len(self.kwargs.setdefault('images', []))
+        self.kwargs['images'].append({'__npy__': f'images.{i}.npy'})
+        return self._create(f'images.{i}.npy', (self.n_points, *shape), dtype)
+
+    def set(self, key, value):
+        '''Any other argument of the app, as in save_catalog.'''
+        self.kwargs[key] = _save(value, self.path, key, 4096)
+
+    def close(self):
+        for array in self.arrays:
+            array.flush()
+        manifest = {'app': self.app, 'kwargs': self.kwargs, 'metadata': self.metadata}
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+
+
+def load_metadata(path, mmap_mode='r'):
+    '''The metadata columns of a catalog written with CatalogWriter.'''
+    n_points = _committed_size(path)
+    return {key: _load(value, path, mmap_mode, n_points)
+            for key, value in _read_manifest(path).get('metadata', {}).items()}
+
+
+def share_catalog(path, shm_dir='/dev/shm'):
+    '''
+    Copy a catalog into shared memory (a tmpfs such as /dev/shm) unless it
+    is there already, and return the path of the copy.
+
+    Memory-mapping a catalog anywhere already shares its pages between
+    processes; a copy in shared memory also keeps every page resident, so
+    no hover ever waits for the disk.
+
+    Copies are named after the catalog's path, fingerprint and number of
+    appended rows, so catalogs with the same name in different directories
+    get copies of their own, and a catalog saved or appended to again is
+    copied again (replacing its old copies).
+    '''
+    from figure_store import catalog_fingerprint
+
+    path = os.path.abspath(path)
+    if path.startswith(os.path.abspath(shm_dir) + os.sep):
+        return path
+    prefix = f'dash_spectra_{os.path.basename(path)}_{hashlib.sha1(path.encode()).hexdigest()[:8]}_'
+    version = f'{catalog_fingerprint(path)[:16]}_{_committed_size(path) or 0}'
+    target = os.path.join(shm_dir, prefix + version)
+    if not os.path.exists(os.path.join(target, MANIFEST)):
+        # Copy under a temporary name so that a half-copied catalog is never
+        # used by another process.
+        partial = target + f'.{os.getpid()}'
+        shutil.copytree(path, partial)
+        try:
+            os.rename(partial, target)
+        except OSError:
+            # Another process finished its copy first.
+            shutil.rmtree(partial)
+        # Older copies of the catalog (partial copies have a dot in their name).
+        for name in os.listdir(shm_dir):
+            if name.startswith(prefix) and name[len(prefix):] != version and '.' not in name[len(prefix):]:
+                shutil.rmtree(os.path.join(shm_dir, name), ignore_errors=True)
+    return target
@@ -0,0 +1,323 @@
+'''
+Helpers for the clientside hover mode of the apps (see dash_app.py).
+
+In this mode the figures are sent to the browser once. On hover the browser
+fetches the arrays of the hovered point, for all the panels at once, as raw
+float32 bytes from a Flask route and updates the trace data in place with
+Plotly.update, without a Dash callback round-trip or a figure being rebuilt
+on the server.
+
+Binary payload layout (little endian):
+    uint32 length of the JSON header in bytes
+    JSON header, padded with spaces to a multiple of 4 bytes
+    float32 arrays, one after the other
+'''
+import base64
+import json
+import struct
+
+import numpy as np
+from flask import Response
+
+
+def pack_arrays(arrays, header=None):
+    '''
+    Pack a list of arrays and a JSON-serializable header into the binary
+    payload read by the clientside callbacks.
+
+    The shapes of the arrays are added to the header under 'shapes'.
+    '''
+    arrays = [np.asarray(array, dtype='<f4') for array in arrays]
+    header = dict(header or {})
+    header['shapes'] = [list(array.shape) for array in arrays]
+    text = json.dumps(header).encode()
+    text += b' ' * (-len(text) % 4)
+    return b''.join([struct.pack('<I', len(text)), text] + [array.tobytes() for array in arrays])
+
+
+def register_binary_route(app, name, pack):
+    '''
+    Add a route to the Flask server of app that returns pack(ind) as
+    application/octet-stream.
+
+    Output
+    ------
+
+    Returns the URL prefix the browser should fetch; the point index is
+    appended to it.
+    '''
+    rule = f'_binary/{name}/'
+
+    def serve(ind):
+        return Response(pack(ind), mimetype='application/octet-stream',
+                        headers={'Cache-Control': 'public, max-age=3600'})
+
+    app.server.add_url_rule(app.config.routes_pathname_prefix + rule + '<int:ind>',
+                            endpoint=f'binary_{name}', view_func=serve)
+    return app.config.requests_pathname_prefix + rule
+
+
+# Shared by the callbacks below: the index of the hovered galaxy and a helper
+# returning the Plotly div of a dcc.Graph.
+_INDEX_JS = '''
+    if (!hoverData) {
+        return window.dash_clientside.no_update;
+    }
+    // Decimated scatter plots and density views keep the index of the
+    // galaxy in customdata.
+    const point = hoverData.points[0];
+    const ind = point.customdata >= 0 ? point.customdata : point.pointIndex;
+    if (ind === undefined) {
+        return window.dash_clientside.no_update;
+    }
+
+    function graph(id) {
+        return document.getElementById(id).querySelector('.js-plotly-plot');
+    }
+'''
+
+# Fetches and unpacks the payload of a point, keeps the last few hundred in
+# memory and drops points that the cursor has already moved away from,
+# before fetching them (after the debounce delay) or after.
+_FETCH_JS = _INDEX_JS + '''
+    const state = window[STATE] = window[STATE] ||
+        {latest: null, cache: new Map(), session: Math.random().toString(36).slice(2)};
+    state.latest = ind;
+
+    function unpack(buffer) {
+        const length = new DataView(buffer).getUint32(0, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, length)));
+        const arrays = [];
+        let offset = 4 + length;
+        for (const shape of header.shapes) {
+            const size = shape.reduce((a, b) => a * b, 1);
+            arrays.push({shape: shape, data: new Float32Array(buffer, offset, size)});
+            offset += 4 * size;
+        }
+        return {header: header, arrays: arrays};
+    }
+
+    let payload;
+    if (state.cache.has(ind)) {
+        payload = Promise.resolve(state.cache.get(ind));
+    } else {
+        // Wait for the cursor to rest for DEBOUNCE ms before fetching, so
+        // that sweeping over the plot doesn't fetch every point on the way.
+        const wait = DEBOUNCE > 0 ? new Promise(resolve => setTimeout(resolve, DEBOUNCE)) : Promise.resolve();
+        payload = wait.then(function() {
+            if (state.latest !== ind) {
+                return null;
+            }
+            if (URL === null) {
+                // Nothing to fetch, e.g. only encoded cutouts are shown.
+                return {header: {}, arrays: []};
+            }
+            // The axes shown tell the server which neighbours to prefetch,
+            // and the session whose latest hover they are for.
+            return fetch(URL + ind + '?x=' + encodeURIComponent(xLabel) + '&y=' + encodeURIComponent(yLabel),
+                         {headers: {'X-Hover-Session': state.session}})
+                .then(response => response.arrayBuffer())
+                .then(function(buffer) {
+                    const unpacked = unpack(buffer);
+                    state.cache.set(ind, unpacked);
+                    if (state.cache.size > 512) {
+                        state.cache.delete(state.cache.keys().next().value);
+                    }
+                    return unpacked;
+                });
+        });
+    }
+'''
+
+# The payload holds the flux of every spectrum in the main spectrum plot,
+# each preceded by its wavelengths when the spectra are downsampled (the
+# plotted wavelengths then differ per galaxy), then the flux inside every
+# zoom window, whose wavelengths are sliced from the grids sent once with
+# this callback, and last the pixels of every image. Encoded cutouts (see
+# image_cache.py) are plain image URLs instead, which the browser fetches
+# and caches itself.
+_PANELS_JS = '''
+function(hoverData, xLabel, yLabel) {
+FETCH
+    return payload.then(function(p) {
+        if (state.latest !== ind) {
+            return window.dash_clientside.no_update;
+        }
+        if (!state.wavelengths) {
+            state.wavelengths = WAVELENGTHS.map(function(encoded) {
+                const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+                return new Float32Array(bytes.buffer);
+            });
+        }
+        const n = p.header.n_spectra || 0;
+        const traces = [...Array(n).keys()];
+        let next = 0;
+        if (SPECTRUM) {
+            const update = {y: []};
+            if (p.header.overview_x) {
+                update.x = [];
+            }
+            traces.forEach(function() {
+                if (p.header.overview_x) {
+                    update.x.push(p.arrays[next++].data);
+                }
+                update.y.push(p.arrays[next++].data);
+            });
+            const layout = {};
+            if (p.header.y_range) {
+                layout['yaxis.range'] = p.header.y_range;
+            }
+            Plotly.update(graph('spectrum'), update, layout, traces);
+        }
+        ZOOM_IDS.forEach(function(id, l) {
+            const update = {x: [], y: []};
+            traces.forEach(function(i) {
+                const flux = p.arrays[next++].data;
+                const start = p.header.zoom_starts[l][i];
+                update.x.push(state.wavelengths[i].subarray(start, start + flux.length));
+                update.y.push(flux);
+            });
+            const center = p.header.zoom_centers[l];
+            Plotly.update(graph(id), update, {
+                'xaxis.range': [center - ZOOM_WINDOWS[l], center + ZOOM_WINDOWS[l]],
+                'shapes[0].x0': center,
+                'shapes[0].x1': center,
+                'title.text': p.header.zoom_titles[l]
+            }, traces);
+        });
+
+        const images = p.arrays.slice(next);
+        IMAGE_IDS.forEach(function(id, i) {
+            if (SOURCES !== null) {
+                Plotly.restyle(graph(id), {source: [SOURCES[i][0] + ind + SOURCES[i][1]]}, [0]);
+                return;
+            }
+            const [height, width] = images[i].shape;
+            const data = images[i].data;
+            const rows = [];
+            for (let r = 0; r < height; r++) {
+                rows.push(data.subarray(r * width, (r + 1) * width));
+            }
+            Plotly.restyle(graph(id), {z: [rows]}, [0]);
+        });
+        return ind;
+    });
+}
+'''
+
+# Debounced hover for the server-side callbacks: the hovered point is only
+# passed on (to a dcc.Store the callbacks listen to) once the cursor has
+# rested on it for DEBOUNCE ms. Every message carries a sequence number and
+# a per-window session id, so the server can drop superseded requests (see
+# throttle.py).
+_DEBOUNCE_JS = '''
+function(hoverData) {
+    if (!hoverData) {
+        return window.dash_clientside.no_update;
+    }
+    const state = window.dashHoverDebounce = window.dashHoverDebounce ||
+        {seq: 0, session: Math.random().toString(36).slice(2)};
+    const seq = ++state.seq;
+    // Only the fields used to find the hovered galaxy are sent.
+    const points = hoverData.points.map(p => ({curveNumber: p.curveNumber, pointIndex: p.pointIndex,
+                                               x: p.x, y: p.y, customdata: p.customdata}));
+    const wait = DEBOUNCE > 0 ? new Promise(resolve => setTimeout(resolve, DEBOUNCE)) : Promise.resolve();
+    return wait.then(function() {
+        if (seq !== state.seq) {
+            return window.dash_clientside.no_update;
+        }
+        return {hoverData: {points: points}, seq: seq, session: state.session};
+    });
+}
+'''
+
+
+# Stacked spectra of a selection (see stacking.py), sent through a
+# dcc.Store and swapped into the stack traces of every panel, which leaves
+# the hovered spectra alone.
+_STACK_JS = '''
+function(panels) {
+    if (!panels) {
+        return window.dash_clientside.no_update;
+    }
+    function graph(id) {
+        return document.getElementById(id).querySelector('.js-plotly-plot');
+    }
+    GRAPH_IDS.forEach(function(id, k) {
+        const panel = panels[k];
+        const layout = panel.title === undefined ? {} : {'title.text': panel.title};
+        Plotly.update(graph(id), {x: panel.x, y: panel.y}, layout, panel.traces);
+    });
+    return panels.length;
+}
+'''
+
+
+def _fetch_js(url, state, debounce):
+    return (_FETCH_JS.replace('URL', json.dumps(url)).replace('STATE', json.dumps(state))
+            .replace('DEBOUNCE', json.dumps(debounce or 0)))
+
+
+def panels_hover_js(url, spectrum=False, zoom_ids=(), zoom_windows=(), wavelength=(), image_ids=(),
+                    image_sources=None, debounce=None):
+    '''
+    JavaScript of the clientside hover callback of the apps, which updates
+    every panel from a single fetch of url + ind (see dash_app.py). Its
+    inputs are the hoverData of the 2D plane and the columns on its x and y
+    axes, which are sent along as the query parameters x and y.
+
+    Input
+    -----
+
+    url: String
+         URL prefix of the binary payloads, None if there is nothing to
+         fetch (only encoded cutouts are shown).
+
+    spectrum: Boolean
+              Whether there is a spectrum plot (graph id 'spectrum').
+
+    zoom_ids, zoom_windows: Lists
+                            Graph ids and half widths of the zoom plots.
+
+    wavelength: List of 1D arrays
+                The wavelength grid of every spectrum, sent once with the
+                callback when there are zoom plots, whose wavelengths are
+                sliced from it (see SpectrumPanels.arrays).
+
+    image_ids: List
+               Graph ids of the image plots.
+
+    image_sources: List of (start, end) pairs. Default=None
+                   URL of the encoded cutout ind of every image, start + ind
+                   + end, instead of pixels in the payload.
+
+    debounce: Float. Default=None
+              Time in ms the cursor has to rest on a point before it is
+              fetched.
+    '''
+    sources = None if image_sources is None else [list(source) for source in image_sources]
+    wavelengths = [] if not zoom_ids else [base64.b64encode(np.asarray(grid, dtype='<f4').tobytes()).decode()
+                                           for grid in wavelength]
+    return (_PANELS_JS.replace('FETCH', _fetch_js(url, 'dashPanelsHover', debounce))
+            .replace('SPECTRUM', json.dumps(bool(spectrum)))
+            .replace('ZOOM_IDS', json.dumps(list(zoom_ids)))
+            .replace('ZOOM_WINDOWS', json.dumps([float(w) for w in zoom_windows]))
+            .replace('WAVELENGTHS', json.dumps(wavelengths))
+            .replace('IMAGE_IDS', json.dumps(list(image_ids)))
+            .replace('SOURCES', json.dumps(sources)))
+
+
+def debounce_hover_js(debounce):
+    '''
+    JavaScript of the clientside callback that passes hoverData on to a
+    dcc.Store once the cursor has rested on a point for debounce ms.
+    '''
+    return _DEBOUNCE_JS.replace('DEBOUNCE', json.dumps(debounce or 0))
+
+
+def stack_js(graph_ids):
+    '''
+    JavaScript of the clientside callback that draws the stacked spectra of
+    a selection in the graphs graph_ids (the spectrum and zoom plots).
+    '''
+    return _STACK_JS.replace('GRAPH_IDS', json.dumps(list(graph_ids)))
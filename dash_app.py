@@ -0,0 +1,444 @@
+'''
+The app factory behind dash_plot_spectra and dash_plot_images.
+
+dash_plot shows the 2D plane of a catalog with any combination of panels:
+the spectrum plot and the zoom plots (spectrum_panels.py) and the image
+plots (image_panels.py). All of them read the same catalog arrays, and a
+hover updates every panel from a single request: one callback with an
+output per panel or, in clientside mode, one fetch of a binary payload
+holding the arrays of all of them.
+
+Galaxies appended to the catalog are added to a running app with
+app.extend_catalog, or found by the refresh callable (e.g. a
+catalog.CatalogWatcher); pages showing the app get them within
+refresh_interval seconds.
+'''
+import threading
+
+from dash import html, dcc, Input, Output, State, Dash, Patch, ctx
+from dash.exceptions import PreventUpdate
+from flask import abort, request
+import plotly.graph_objects as go
+import plotly
+
+# The modules of the optional panels and features are imported where they
+# are used, so that an app only loads what it shows.
+from figure_cache import LRUCache, cached_json, warm_cache
+from galaxy_plane import GalaxyPlanes
+from property_table import PropertyTable
+from theme import dark_theme
+
+
+def dash_plot(x=None, y=None, xlim=None, ylim=None, color_code=None, cmap='Tealgrn_r',
+              marker_size=None, properties=None, additional_lines=None,
+              spectra=None, spec_colors=plotly.colors.DEFAULT_PLOTLY_COLORS, spec_names=['0'],
+              wavelength=None, y_max=None, y_min=None, zoom=None, zoom_windows=None,
+              zoom_extras=None, downsample=None, downsample_points=2000, y_range_percentiles=None,
+              quantize=None, stack=False, stack_percentiles=(16, 84), stack_sample=1000,
+              images=None, cmap_images='inferno', image_labels=None, image_format=None,
+              image_size=None, image_cache_dir=None, image_urls=False,
+              cache_size=256, cache=None, cache_namespace=None, figure_store=None, clientside=False,
+              webgl_threshold=100000,
+              max_points=None, density_bins=None, hover_debounce=None, prefetch=0,
+              prefetch_workers=2, compress=False, refresh=None, refresh_interval=None, instrument=False,
+              color_menu=False):
+    '''
+    Plotting function that uses Dash to plot galaxies in a 2d plane of
+    properties and shows their spectra and images by hovering over the
+    points.
+
+    Input
+    -----
+
+    Takes the arguments of dash_plot_spectra and of dash_plot_images (see
+    their documentation), except for:
+
+    cmap: String. Default='Tealgrn_r'
+          The color map of the 2D plane (cmap_plot of dash_plot_images).
+
+    marker_size: Integer. Default=None
+                 The size of the markers in the 2D plane. None leaves it to
+                 Plotly.
+
+    spectra: List of 2D arrays (N_points, N_features). Default=None
+             Shows the spectrum plot, and the zoom plots with zoom. None
+             shows no spectra.
+
+    images: List of 3D arrays (N_points, N_pixel, N_pixel). Default=None
+            Shows an image plot per element, below the spectra. None shows
+            no images.
+
+    cache_size: Integer. Default=256
+                Number of hovered points whose spectrum and zoom updates are
+                kept in memory. In clientside mode the whole payload is kept,
+                including the pixels of the images, if there are spectra.
+
+    refresh: Callable. Default=None
+             Returns the per-galaxy arguments with rows appended (see
+             app.extend_catalog below) when the catalog grew and None
+             otherwise, e.g. catalog.CatalogWatcher(path). Called every
+             refresh_interval and when a galaxy the app doesn't know yet is
+             hovered (pages served by another process may show it already).
+
+    refresh_interval: Float. Default=None
+                      Seconds between the checks for new galaxies made by
+                      every open page. New galaxies are sent as a Patch of
+                      the 2D plane. None makes no checks.
+
+    cache_namespace: String. Default=None
+                     Keeps the entries of this app apart from those of other
+                     apps in the shared cache. By default a fingerprint of
+                     the spectra, the images and the options the updates
+                     depend on (see cache_backends.fingerprint); serve.py
+                     uses the fingerprint of the catalog.
+
+    color_menu: Boolean. Default=False
+                Show the color coding menu even when color_code has a
+                single key, as dash_plot_images does. Other menus with a
+                single choice are hidden.
+
+    With both spectra and images, e.g. from a catalog saved with
+    save_catalog(path, app='panels', ...), one hover reads the row of the
+    hovered galaxy in every array and updates all the panels at once.
+
+    Output
+    ------
+
+    Returns a Dash app. app.extend_catalog(**kwargs) adds galaxies to it:
+    kwargs are the per-galaxy arguments (x, y, color_code, properties,
+    spectra, y_max, y_min, zoom, zoom_extras, downsample, images) with the
+    new rows after the current ones, as given when the app was built. Only
+    the new rows are processed, and cached updates stay valid.
+    '''
+    app = Dash(__name__, external_stylesheets=[dark_theme()], compress=compress)
+    stores = []
+    if figure_store is not None:
+        from figure_store import open_figure_store
+        stores.append(open_figure_store(figure_store))
+    if cache is not None:
+        from cache_backends import fingerprint, open_cache
+        if cache_namespace is None:
+            # Everything the cached updates are built from, so that apps
+            # sharing a cache never get each other's updates.
+            cache_namespace = fingerprint(dict(
+                spectra=spectra, wavelength=wavelength, y_max=y_max, y_min=y_min, zoom=zoom,
+                zoom_windows=zoom_windows, zoom_extras=zoom_extras, downsample=downsample,
+                downsample_points=downsample_points, y_range_percentiles=y_range_percentiles,
+                quantize=quantize, images=images, image_format=image_format, clientside=clientside))[:16]
+        stores.append(open_cache(cache, cache_namespace))
+    app.figure_cache = LRUCache(cache_size, store=stores)
+
+    spectrum_panels = None
+    if spectra is not None:
+        from spectrum_panels import SpectrumPanels
+        spectrum_panels = SpectrumPanels(
+            spectra, wavelength, spec_colors, spec_names, y_max=y_max, y_min=y_min, zoom=zoom,
+            zoom_windows=zoom_windows, zoom_extras=zoom_extras, downsample=downsample,
+            downsample_points=downsample_points, y_range_percentiles=y_range_percentiles,
+            quantize=quantize, stack=stack, stack_percentiles=stack_percentiles,
+            stack_sample=stack_sample)
+        app.stacker = spectrum_panels.stacker
+    image_panels = None
+    if images is not None:
+        from image_panels import ImagePanels
+        image_panels = ImagePanels(images, image_labels, cmap_images, image_format,
+                                   image_size=image_size, image_cache_dir=image_cache_dir)
+        app.image_cache = image_panels.image_cache
+        if image_urls or clientside:
+            # known is defined below, once the table is.
+            image_panels.register_route(app, lambda ind: known(ind))
+    panels = [panel for panel in (spectrum_panels, image_panels) if panel is not None]
+    graph_ids = [graph_id for panel in panels for graph_id in panel.graph_ids]
+
+    table = PropertyTable(x, y, color_code, properties)
+    x_label, y_label, color_label = table.x_labels[0], table.y_labels[0], table.color_labels[0]
+    planes = GalaxyPlanes(table, x_label, y_label, xlim=xlim, ylim=ylim,
+                          webgl_threshold=webgl_threshold, max_points=max_points,
+                          density_bins=density_bins)
+    plane = planes.initial
+    app.spatial_index = plane.index
+
+    fig = go.Figure()
+    marker = None if marker_size is None else dict(size=marker_size)
+    trace0 = plane.trace(table[color_label], cmap, color_label, marker=marker)
+    fig.add_trace(trace0)
+
+    fig.update_xaxes(title=x_label, range=xlim)
+    fig.update_yaxes(title=y_label, range=ylim)
+    fig.update_layout(width=750, height=650, font=dict(size=30))
+
+    if additional_lines is not None:
+        for i, additional_line in enumerate(additional_lines):
+            trace1 = go.Scatter(
+                x=additional_line['x'],
+                y=additional_line['y'],
+                marker_color=additional_line['color'],
+                line_dash='solid' if additional_line['line_dash'] is None else additional_line['line_dash'],
+                name=additional_line['name'],
+                line=dict(width=10 if additional_line['line_width'] is None else additional_line['line_width'])
+            )
+            fig.add_trace(trace1)
+
+    def graph(graph_id, figure):
+        return dcc.Graph(id=graph_id, figure=figure, style={'display': 'inline-block'}, mathjax=True)
+
+    scatter = graph('2d-scatter', fig)
+
+    # The panels are drawn once here. On hover only their data is swapped,
+    # either with Patch updates or, in clientside mode, in the browser
+    # (see clientside.py). The spectrum plot sits next to the 2D plane,
+    # the zoom plots and the images each have a row below.
+    rows = [[scatter]]
+    if spectrum_panels is not None:
+        rows[0].append(graph('spectrum', spectrum_panels.spectrum_figure(0)))
+        if spectrum_panels.zoom_labels:
+            rows.append([graph(label, figure) for label, figure in
+                         zip(spectrum_panels.zoom_labels, spectrum_panels.zoom_figures(0))])
+    if image_panels is not None:
+        rows.append([graph(label, figure) for label, figure in
+                     zip(image_panels.graph_ids, image_panels.figures(0))])
+    catalog_size = dcc.Store(id='catalog-size', data=len(table))
+    menus = table.dropdowns(shown=['color coding'] if color_menu else [])
+    app.layout = html.Div([menus, html.Div(rows[0])] +
+                          [html.Div(html.Div(row)) for row in rows[1:]] +
+                          [dcc.Store(id='plane-view'), catalog_size])
+
+    # The arrays of the panels are extended before the table and the planes,
+    # so hovers only reach new galaxies once everything is in place.
+    refresh_lock = threading.RLock()
+
+    def extend_catalog(**kwargs):
+        with refresh_lock:
+            if len(next(iter(kwargs['x'].values()))) <= len(table):
+                return
+            if spectrum_panels is not None:
+                spectrum_panels.extend(kwargs['spectra'], **{
+                    key: kwargs.get(key) for key in ('y_max', 'y_min', 'zoom', 'zoom_extras', 'downsample')})
+            if image_panels is not None:
+                image_panels.extend(kwargs['images'])
+            table.extend(kwargs['x'], kwargs['y'], kwargs.get('color_code'), kwargs.get('properties'))
+            planes.extend()
+            app.spatial_index = planes.initial.index
+
+            # Pages loaded from now on get the new galaxies with the layout.
+            trace = planes.initial.trace(table[color_label], cmap, color_label, marker=marker)
+            scatter.figure = go.Figure([trace, *scatter.figure.data[1:]], scatter.figure.layout)
+            catalog_size.data = len(table)
+
+    def check_catalog():
+        if refresh is not None:
+            with refresh_lock:
+                kwargs = refresh()
+                if kwargs is not None:
+                    extend_catalog(**kwargs)
+
+    def known(ind):
+        '''Whether galaxy ind is in the catalog, checking for new galaxies if not.'''
+        if ind >= len(table):
+            check_catalog()
+        return ind < len(table)
+
+    app.extend_catalog = extend_catalog
+
+    if spectrum_panels is not None and stack:
+        selection = dict(selected_data=Input('2d-scatter', 'selectedData'),
+                         x_label=State('x axis', 'value'), y_label=State('y axis', 'value'))
+        stack_ids = spectrum_panels.graph_ids
+
+        if clientside:
+            from clientside import stack_js
+            # Patching the figures would undo the hover updates made in the
+            # browser, so the stack is drawn there too.
+            app.layout.children += [dcc.Store(id='stack'), dcc.Store(id='clientside-stack')]
+            app.clientside_callback(stack_js(stack_ids), Output('clientside-stack', 'data'),
+                                    Input('stack', 'data'))
+
+            @app.callback(
+                output=Output('stack', 'data'), inputs=selection, prevent_initial_call=True)
+            def update_stack(selected_data, x_label, y_label):
+                return spectrum_panels.stack_panels(planes.plane(x_label, y_label).selected(selected_data))
+        else:
+            @app.callback(
+                output=[Output(graph_id, 'figure', allow_duplicate=True) for graph_id in stack_ids],
+                inputs=selection, prevent_initial_call=True)
+            def update_stack(selected_data, x_label, y_label):
+                stacked = spectrum_panels.stack_panels(planes.plane(x_label, y_label).selected(selected_data))
+                patches = []
+                for panel in stacked:
+                    patch = Patch()
+                    for trace, x, y in zip(panel['traces'], panel['x'], panel['y']):
+                        patch['data'][trace]['x'] = x
+                        patch['data'][trace]['y'] = y
+                    if 'title' in panel:
+                        patch['layout']['title']['text'] = panel['title']
+                    patches.append(patch)
+                return patches
+
+    def start_prefetcher(warm):
+        if not prefetch or spectrum_panels is None:
+            return None
+        from prefetch import Prefetcher
+        app.prefetcher = Prefetcher(
+            warm, lambda ind, plane=None: (plane or planes.initial).neighbours(ind, prefetch + 1),
+            prefetch_workers)
+        return app.prefetcher
+
+    # What figure_store.py precomputes, under the cache keys used below.
+    # Only the spectra are cached: cutouts are either read as they are or
+    # encoded once by their own cache (image_cache.py).
+    app.figure_builders = {}
+
+    if clientside and panels:
+        from clientside import pack_arrays, panels_hover_js, register_binary_route
+
+        def pack_point(ind):
+            header, arrays = {}, []
+            if spectrum_panels is not None:
+                header, arrays = spectrum_panels.arrays(ind)
+            if image_panels is not None:
+                arrays = arrays + image_panels.arrays(ind)
+            return pack_arrays(arrays, header)
+
+        url = None
+        if spectrum_panels is not None:
+            def warm_payload(ind):
+                if ('binary', ind) not in app.figure_cache:
+                    app.figure_cache.put(('binary', ind), pack_point(ind))
+
+            prefetcher = start_prefetcher(warm_payload)
+            app.figure_builders['binary'] = pack_point
+
+            def hovered_point(ind):
+                if not known(ind):
+                    abort(404)
+                payload = app.figure_cache.get(('binary', ind))
+                if payload is None:
+                    payload = pack_point(ind)
+                    app.figure_cache.put(('binary', ind), payload)
+                if prefetcher is not None:
+                    # The neighbours in the plane the browser shows, whose
+                    # axes it sends along. Requests without them (e.g. from
+                    # loadtest.py) get the initial plane, and requests with
+                    # unknown axes no prefetching. The session of the
+                    # browser window comes in a header, leaving the URLs
+                    # cacheable by everyone.
+                    x_label = request.args.get('x', planes.x_label)
+                    y_label = request.args.get('y', planes.y_label)
+                    if x_label in table.x_labels and y_label in table.y_labels:
+                        prefetcher.after(ind, planes.plane(x_label, y_label),
+                                         session=request.headers.get('X-Hover-Session'))
+                return payload
+
+            url = register_binary_route(app, 'panels', hovered_point)
+        elif image_panels.sources() is None:
+            def hovered_point(ind):
+                if not known(ind):
+                    abort(404)
+                return pack_point(ind)
+
+            url = register_binary_route(app, 'panels', hovered_point)
+
+        app.layout.children.append(dcc.Store(id='clientside-hover'))
+        app.clientside_callback(
+            panels_hover_js(url, spectrum=spectrum_panels is not None,
+                            zoom_ids=[] if spectrum_panels is None else spectrum_panels.zoom_labels,
+                            zoom_windows=[] if spectrum_panels is None else spectrum_panels.zoom_windows or [],
+                            wavelength=[] if spectrum_panels is None else spectrum_panels.wavelength,
+                            image_ids=[] if image_panels is None else image_panels.graph_ids,
+                            image_sources=None if image_panels is None else image_panels.sources(),
+                            debounce=hover_debounce),
+            Output('clientside-hover', 'data'),
+            Input('2d-scatter', 'hoverData'), State('x axis', 'value'), State('y axis', 'value'))
+    elif panels:
+        from throttle import HoverCoalescer
+        hover_input = Input('2d-scatter', 'hoverData')
+        if hover_debounce is not None:
+            from clientside import debounce_hover_js
+            app.layout.children.append(dcc.Store(id='hover-point'))
+            app.clientside_callback(debounce_hover_js(hover_debounce),
+                                    Output('hover-point', 'data'), hover_input)
+            hover_input = Input('hover-point', 'data')
+        coalescer = HoverCoalescer()
+
+        if spectrum_panels is not None:
+            app.figure_builders['spectrum'] = spectrum_panels.spectrum_patch
+            if spectrum_panels.zoom_labels:
+                app.figure_builders['zoom'] = spectrum_panels.zoom_patches
+
+        def warm_figures(ind):
+            for kind, build in app.figure_builders.items():
+                warm_cache(app.figure_cache, (kind, ind), lambda: build(ind))
+
+        prefetcher = start_prefetcher(warm_figures)
+
+        def panel_updates(ind):
+            '''The updates of every panel, in the order of graph_ids.'''
+            updates = []
+            for kind, build in app.figure_builders.items():
+                update = cached_json(app.figure_cache, (kind, ind), lambda: build(ind))
+                updates += update if kind == 'zoom' else [update]
+            if image_panels is not None:
+                updates += image_panels.patches(ind)
+            return updates
+
+        # One callback updates every panel, so a hover is a single request
+        # that finds the hovered galaxy once. The hovered plane depends on
+        # the columns on the axes.
+        @app.callback(
+            [Output(graph_id, 'figure') for graph_id in graph_ids],
+            hover_input, State('x axis', 'value'), State('y axis', 'value'),
+            prevent_initial_call=True)
+        def update_panels(hover, x_label, y_label):
+            hovered_plane = planes.plane(x_label, y_label)
+            ind = hovered_plane.hover_index(coalescer.begin(hover))
+            if not known(ind):
+                raise PreventUpdate
+            updates = panel_updates(ind)
+            if prefetcher is not None:
+                # Debounced hovers carry the session of their browser window.
+                prefetcher.after(ind, hovered_plane, session=(hover or {}).get('session'))
+            coalescer.finish(hover)
+            return updates
+
+    plane_inputs = dict(x_label=Input('x axis', 'value'), y_label=Input('y axis', 'value'),
+                        color_label=Input('color coding', 'value'))
+    if plane.decimated:
+        plane_inputs['relayout_data'] = Input('2d-scatter', 'relayoutData')
+
+    @app.callback(
+        output=[Output('2d-scatter', 'figure'), Output('plane-view', 'data')],
+        inputs=plane_inputs,
+        state=dict(view=State('plane-view', 'data')),
+        prevent_initial_call=True)
+    def update_plane(x_label, y_label, color_label, view, relayout_data=None):
+        patch = Patch()
+        view = planes.update(patch, ctx.triggered_id, x_label, y_label, color_label,
+                             relayout_data, view)
+        if additional_lines is not None and ctx.triggered_id in ('x axis', 'y axis'):
+            # The additional lines are drawn in the initial axes.
+            for i in range(len(additional_lines)):
+                patch['data'][i + 1]['visible'] = [x_label, y_label] == [planes.x_label, planes.y_label]
+        return patch, view
+
+    if refresh_interval is not None:
+        app.layout.children.append(dcc.Interval(id='catalog-refresh', interval=refresh_interval * 1000))
+
+        # Typed arrays can't be extended by a Patch, so the columns shown
+        # are sent again (or the view's subsample of decimated planes).
+        @app.callback(
+            output=[Output('2d-scatter', 'figure', allow_duplicate=True), Output('catalog-size', 'data')],
+            inputs=Input('catalog-refresh', 'n_intervals'),
+            state=[State('catalog-size', 'data'), State('x axis', 'value'), State('y axis', 'value'),
+                   State('color coding', 'value'), State('plane-view', 'data')],
+            prevent_initial_call=True)
+        def refresh_plane(n_intervals, size, x_label, y_label, color_label, view):
+            check_catalog()
+            if len(table) <= size:
+                raise PreventUpdate
+            return planes.redraw(Patch(), x_label, y_label, color_label, view), len(table)
+
+    if instrument:
+        from instrumentation import instrument_app
+        instrument_app(app)
+
+    return app
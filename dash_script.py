@@ -1,18 +1,19 @@
-import numpy as np
-from dash import html, dcc, Input, Output, Dash
-import plotly.graph_objects as go
 import plotly
-from dash_bootstrap_templates import load_figure_template
-import dash_bootstrap_components as dbc
 
-load_figure_template(["darkly"])
+from dash_app import dash_plot
 
 
 def dash_plot_spectra(x=None, y=None, xlim=None, ylim=None, color_code=None,
                       cmap='Tealgrn_r', spectra=None, spec_colors=plotly.colors.DEFAULT_PLOTLY_COLORS,
                       spec_names=['0'], wavelength=None, additional_lines=None,
                       masking=False, mask_ind=0, y_max=None, y_min=None,
-                      zoom=None, zoom_windows=None, zoom_extras=None, zoom_extras_pos=None):
+                      zoom=None, zoom_windows=None, zoom_extras=None, zoom_extras_pos=None,
+                      cache_size=256, clientside=False, webgl_threshold=100000, max_points=None,
+                      density_bins=None, downsample=None, downsample_points=2000,
+                      y_range_percentiles=None, quantize=None, hover_debounce=None, prefetch=0,
+                      prefetch_workers=2, properties=None, stack=False, stack_percentiles=(16, 84),
+                      stack_sample=1000, cache=None, cache_namespace=None, figure_store=None, compress=False, refresh=None,
+                      refresh_interval=None, instrument=False):
     '''
     Plotting function that uses Dash to plot galaxies in a 2d plane of
     properties and shows their spectra by hovering over the points.
@@ -35,6 +36,9 @@ def dash_plot_spectra(x=None, y=None, xlim=None, ylim=None, color_code=None,
                 Array values to color code the points in the 2D plane.
                 The keys are the labels for the color-coding.
 
+                When x, y or color_code have several keys, they can be
+                chosen from dropdown menus above the plot.
+
     cmap: String. Default is 'viridis'
           The color map used to color-code the x,y points with color_code
           values.
@@ -45,6 +49,10 @@ def dash_plot_spectra(x=None, y=None, xlim=None, ylim=None, color_code=None,
              that contains the first spectrum for every object (N_points)
              as a function of wavelnegth (N_features).
              So (N_points, N_features) = (number of galaxies, length of wavelength grid).
+             Large catalogs don't have to be loaded into memory: every element
+             can also be a SpectraStore (see spectra_store.py) or a path to a
+             .npy, .npz, HDF5 or zarr file, in which case only the row of the
+             hovered point is read from disk.
 
     wavelengths: List of 1D arrays(N_features).
                  The wavelength grid corresponding to the spectra.
@@ -90,6 +98,153 @@ def dash_plot_spectra(x=None, y=None, xlim=None, ylim=None, color_code=None,
     y_min: List of 1D arrays (N_points).
            Minimum flux value for each spectrum.
            Used to set the y-axis range of the spectrum plot.
+
+    cache_size: Integer. Default=256
+                Number of hovered points whose spectrum and zoom updates
+                (or clientside payloads) are kept in memory, so hovering
+                over them again doesn't rebuild them. 0 disables the cache. Hits and misses can be
+                checked with app.figure_cache.info().
+
+    cache: String or cache. Default=None
+           A cache shared by all the server processes, behind the
+           in-memory one of every process: a redis:// URL, a directory or
+           a cache of cache_backends.py. Read on a miss and written
+           whenever an update is built, so that every galaxy is only built
+           once by any of the processes. None keeps each process' cache to
+           itself.
+
+    cache_namespace: String. Default=None
+                     Keeps the entries of this app apart from those of other
+                     apps sharing the cache. By default a fingerprint of the
+                     spectra and of the options the updates depend on.
+
+    figure_store: String. Default=None
+                  SQLite file of the hover updates of every galaxy,
+                  precomputed with figure_store.py for the same arguments,
+                  read when a galaxy isn't in the cache. Serves the first
+                  hover of every galaxy as fast as a cached one, in every
+                  server process.
+
+    clientside: Boolean. Default=False
+                Update the spectrum and zoom plots in the browser instead of
+                in a Python callback. The figures are sent once and on hover
+                only the spectra of the hovered point are fetched, as float32
+                bytes, and swapped into the existing traces.
+
+    webgl_threshold: Integer. Default=100000
+                     The 2D plane is drawn with WebGL (go.Scattergl) instead
+                     of SVG when there are more points than this.
+
+    max_points: Integer. Default=None
+                Maximum number of points drawn in the 2D plane. With more
+                galaxies than this a subsample is drawn that keeps every
+                region of the plane covered, and zooming in adds the points
+                of the zoomed region. Hovering always shows the spectrum of
+                the right galaxy. None draws every point.
+
+    density_bins: Integer. Default=None
+                  Draw the 2D plane as a density_bins x density_bins image of
+                  the mean color_code value instead of drawing the points,
+                  for catalogs too large for max_points. The image is
+                  recomputed for the zoomed region, and hovering over a bin
+                  shows the spectrum of the galaxy nearest to it.
+
+    downsample: String or list of 2D arrays. Default=None
+                Downsample the spectra in the main spectrum plot to
+                downsample_points points, keeping their shape:
+                'lttb' (Largest-Triangle-Three-Buckets) or 'minmax' (min/max
+                envelope). Computed for every spectrum when the app is built;
+                for large catalogs it can be precomputed with
+                downsample.downsample_spectra and the list of index arrays
+                (one per spectrum, e.g. memory-mapped .npy files) passed
+                instead. The zoom plots always show the full resolution
+                spectrum inside their window. None shows every point.
+
+    downsample_points: Integer. Default=2000
+                       Number of points kept by downsample, about the width
+                       of the spectrum plot in pixels.
+
+    y_range_percentiles: tuple (low, high). Default=None
+                         If y_max and y_min are not given, compute them from
+                         these percentiles of the flux of every object (over
+                         all its spectra), e.g. (0.5, 99.5), so that the
+                         y-axis isn't stretched by bad pixels. Done once for
+                         the whole catalog when the app is built, see
+                         preprocessing.flux_ranges. None lets Plotly choose
+                         the range.
+
+    quantize: String. Default=None
+              Hold the spectra in memory as 16-bit codes with a scale and
+              an offset per spectrum, 'int16' or 'float16', a quarter of the
+              memory of float64 spectra. Only the rows that are shown are
+              converted back, with an error far below what can be seen on
+              the plots (see spectra_store.quantize_spectra, which can also
+              quantize catalogs to disk). None keeps the spectra as they
+              are.
+
+    hover_debounce: Float. Default=None
+                    Only update the plots once the cursor has rested on a
+                    point for this many milliseconds (e.g. 50), so sweeping
+                    over the 2D plane doesn't queue an update for every point
+                    on the way. Updates that are superseded by a newer hover
+                    while waiting on the server are dropped. None updates on
+                    every hover event.
+
+    prefetch: Integer. Default=0
+              After a hover, build the updates of this many nearest
+              neighbours (in the 2D plane) of the hovered galaxy in
+              background threads and keep them in the cache, since the
+              cursor usually moves on to one of them. Keep cache_size well
+              above it. 0 disables prefetching.
+
+    prefetch_workers: Integer. Default=2
+                      Number of prefetching threads.
+
+    properties: Dictionary of arrays, pandas DataFrame or pyarrow Table.
+                Default=None
+                A table of galaxy properties (one row per galaxy). Every
+                numeric column is offered in the dropdown menus of the x
+                axis, the y axis and the color coding, after the keys of x,
+                y and color_code. Switching only sends the column that
+                changed, encoded as float32 (see property_table.py).
+
+    stack: Boolean. Default=False
+           Selecting galaxies in the 2D plane with the box or lasso tool
+           shows the mean, the median and a percentile band of their spectra
+           in the spectrum and zoom plots, next to the hovered spectrum.
+           Computed in a chunked pass over the selected rows; reselecting
+           about the same galaxies only reads the ones that changed. See
+           stacking.py. Not available with density_bins.
+
+    stack_percentiles: tuple (low, high). Default=(16, 84)
+                       Percentiles of the band of the stacked spectra.
+
+    stack_sample: Integer. Default=1000
+                  Maximum number of selected galaxies the median and the
+                  band are computed from (the mean uses all of them).
+
+    compress: Boolean. Default=False
+              Compress the responses of the server with gzip, which
+              roughly halves the size of every hover update. Requires
+              flask-compress (pip install "dash[compress]").
+
+    refresh: Callable. Default=None
+             Returns the arguments of the app with rows appended when the
+             catalog grew and None otherwise, e.g. a
+             catalog.CatalogWatcher of a catalog extended with
+             catalog.append_catalog. See dash_app.dash_plot.
+
+    refresh_interval: Float. Default=None
+                      Seconds between the checks for new galaxies made by
+                      every open page, which get them as a Patch of the 2D
+                      plane. None makes no checks. Galaxies can also be
+                      added with app.extend_catalog.
+
+    instrument: Boolean. Default=False
+                Log the wall time and response size of every callback (and
+                of the clientside data routes), see instrumentation.py. The
+                measurements are also kept in app.callback_stats.
+
     Output
     ------
     
@@ -97,126 +252,16 @@ def dash_plot_spectra(x=None, y=None, xlim=None, ylim=None, color_code=None,
     
     '''
         
-    app = Dash(__name__, external_stylesheets=[dbc.themes.DARKLY])
-
-    if color_code is None:
-        color_code = {'same for all': np.ones(len(list(x.values())))}
-
-    fig = go.Figure()
-    trace0 = go.Scatter(
-        x=list(x.values())[0], y=list(y.values())[0],
-        mode='markers',
-        name='galaxies',
-        marker=dict(
-            color=list(color_code.values())[0],
-            colorscale=cmap,
-            colorbar=dict(
-                title=list(color_code.keys())[0], orientation='h'
-            )
-        )
-    )
-    fig.add_trace(trace0)
-
-    fig.update_xaxes(title=list(x.keys())[0], range=xlim)
-    fig.update_yaxes(title=list(y.keys())[0], range=ylim)
-    fig.update_layout(width=750, height=650, font=dict(size=30))
-
-    if additional_lines is not None:
-        for i, additional_line in enumerate(additional_lines):
-            trace1 = go.Scatter(
-                x=additional_line['x'],
-                y=additional_line['y'],
-                marker_color=additional_line['color'],
-                line_dash='solid' if additional_line['line_dash'] is None else additional_line['line_dash'],
-                name=additional_line['name'],
-                line=dict(width=10 if additional_line['line_width'] is None else additional_line['line_width'])
-            )
-            fig.add_trace(trace1)
-
-    if zoom is not None:
-        app.layout = html.Div([
-            html.Div([
-                dcc.Graph(id='2d-scatter', figure=fig,
-                          style={'display': 'inline-block'}, mathjax=True),
-                dcc.Graph(id='spectrum',
-                          style={'display': 'inline-block'}, mathjax=True)
-            ]),
-            html.Div(html.Div([
-                dcc.Graph(id=list(zoom.keys())[l],
-                          style={'display': 'inline-block'}, mathjax=True)
-                          for l in range(len(list(zoom.keys())))
-                    ])
-                )    
-            ]
-        )
-    else:
-        app.layout = html.Div([html.Div([
-                dcc.Graph(id='2d-scatter', figure=fig,
-                          style={'display': 'inline-block'}, mathjax=True),
-                dcc.Graph(id='spectrum',
-                          style={'display': 'inline-block'}, mathjax=True)
-            ])
-        ])
-
-    def create_spectrum(ind, y_range=False):
-        fig = go.Figure()
-        for i in range(len(spectra)):
-            trace = go.Scatter(x=wavelength[i], y=spectra[i][ind], mode='lines',
-                               marker=dict(color=spec_colors[i]), name=spec_names[i])
-            fig.add_trace(trace)
-
-        fig.update_xaxes(title='Rest-Frame Wavelength (A)')
-        fig.update_yaxes(title='flux')
-        fig.update_layout(width=2000, height=650, font=dict(size=30))
-        fig.update_layout(title='Spectrum vs Wavelength', title_x=0.5)
-
-        if y_range:
-            if y_max is not None:
-                fig.update_layout(yaxis_range=[y_min[ind], y_max[ind]])
-
-        return fig
-
-    @app.callback(
-        Output('spectrum', 'figure'),
-        Input('2d-scatter', 'hoverData'))
-    def update_spectrum(hov_data):
-        if hov_data is None:
-            ind = 0
-        else:
-            ind = hov_data['points'][0]['pointIndex']
-        return create_spectrum(ind, y_range=True)
-        
-    if zoom is not None:
-        @app.callback(
-            [Output(list(zoom.keys())[l], 'figure') for l in range(len(list(zoom.keys())))],
-            Input('2d-scatter', 'hoverData'))
-        def update_lines(hov_data):
-            if hov_data is None:
-                ind = 0
-            else:
-                ind = hov_data['points'][0]['pointIndex']
-            figs = []
-
-            for l in range(len(list(zoom.keys()))):
-                fig0 = create_spectrum(ind)
-                fig0.update_xaxes(title='Wavelength (A)',
-                                  range=[list(zoom.values())[l][ind]-zoom_windows[l],
-                                         list(zoom.values())[l][ind]+zoom_windows[l]
-                                         ]
-                                  )
-                fig0.update_layout(width=687.5, height=650, font=dict(size=30),
-                                   showlegend=False)
-                fig0.add_vline(x=list(zoom.values())[l][ind])
-                fig0.update_layout(title=list(zoom.keys())[l], title_x=0.5)
-                figs.append(fig0)
-
-                if zoom_extras is not None:
-                    string = ''
-                    for j in range(len(list(zoom_extras[l].keys()))):
-                        string += list(zoom_extras[l].keys())[j] +\
-                                  f' {list(zoom_extras[l].values())[j][ind]:.2f} <br>'
-                    fig0.update_layout(title=string, title_x=0.5)
-
-            return figs
-
-    return app
+    return dash_plot(
+        x=x, y=y, xlim=xlim, ylim=ylim, color_code=color_code, cmap=cmap, properties=properties,
+        additional_lines=additional_lines, spectra=spectra, spec_colors=spec_colors,
+        spec_names=spec_names, wavelength=wavelength, y_max=y_max, y_min=y_min, zoom=zoom,
+        zoom_windows=zoom_windows, zoom_extras=zoom_extras, downsample=downsample,
+        downsample_points=downsample_points, y_range_percentiles=y_range_percentiles,
+        quantize=quantize, stack=stack, stack_percentiles=stack_percentiles,
+        stack_sample=stack_sample, cache_size=cache_size, cache=cache, cache_namespace=cache_namespace,
+        figure_store=figure_store,
+        clientside=clientside, webgl_threshold=webgl_threshold, max_points=max_points,
+        density_bins=density_bins, hover_debounce=hover_debounce, prefetch=prefetch,
+        prefetch_workers=prefetch_workers, compress=compress, refresh=refresh,
+        refresh_interval=refresh_interval, instrument=instrument)
@@ -1,18 +1,14 @@
-import numpy as np
-from dash import html, dcc, Input, Output, Dash
-import plotly.graph_objects as go
-import plotly
-import plotly.express as px
-from dash_bootstrap_templates import load_figure_template
-import dash_bootstrap_components as dbc
-
-load_figure_template(["darkly"])
+from dash_app import dash_plot
 
 
 def dash_plot_images(x=None, y=None, xlim=None, ylim=None, color_code=None,
                      cmap_plot='Viridis', marker_size=10,
                      images=None, cmap_images='inferno',
-                     image_labels=None):
+                     image_labels=None, clientside=False, webgl_threshold=100000,
+                     max_points=None, density_bins=None, image_format=None, image_size=None,
+                     image_cache_dir=None, image_urls=False, hover_debounce=None,
+                     properties=None, compress=False, refresh=None, refresh_interval=None,
+                     instrument=False):
     '''
     Plotting function that uses Dash to plot galaxies in a 2d plane of properties and shows their spectra by hovering over the points.
     
@@ -32,6 +28,9 @@ def dash_plot_images(x=None, y=None, xlim=None, ylim=None, color_code=None,
     color_code: Python dictionary
                 Array values to color code the points in the 2D plane.
                 The keys are the labels for the color-coding. Shows up in a dropdown menu.
+
+                When x or y have several keys, they can be chosen from
+                dropdown menus too.
           
     cmap_plot: String. Default is 'Viridis'
                The color map used to color-code the x,y points with color_code values.
@@ -49,100 +48,100 @@ def dash_plot_images(x=None, y=None, xlim=None, ylim=None, color_code=None,
     image_labels: List of strings
                   A list that contains labels for images to be used for axis titles.
                   The list should be the same size as images list.
+
+    clientside: Boolean. Default=False
+                Update the images in the browser instead of in a Python
+                callback. The figures are sent once and on hover only the
+                pixels of the hovered point are fetched, as float32 bytes,
+                and swapped into the existing heatmaps.
+
+    webgl_threshold: Integer. Default=100000
+                     The 2D plane is drawn with WebGL (go.Scattergl) instead
+                     of SVG when there are more points than this.
+
+    max_points: Integer. Default=None
+                Maximum number of points drawn in the 2D plane. With more
+                galaxies than this a subsample is drawn that keeps every
+                region of the plane covered, and zooming in adds the points
+                of the zoomed region. Hovering always shows the images of
+                the right galaxy. None draws every point.
+
+    density_bins: Integer. Default=None
+                  Draw the 2D plane as a density_bins x density_bins image of
+                  the mean color_code value instead of drawing the points,
+                  for catalogs too large for max_points. The image is
+                  recomputed for the zoomed region, and hovering over a bin
+                  shows the images of the galaxy nearest to it.
+
+    image_format: String. Default=None
+                  Send the images as colormapped 'png' or 'webp' (requires
+                  Pillow) files instead of arrays of pixel values, which is
+                  much smaller. Each cutout is encoded once and then cached
+                  (see image_cache.py). Shown without a colorbar.
+                  None sends the pixel values.
+
+    image_size: Integer. Default=None
+                Size of the image plots in pixels. With image_format, large
+                cutouts are sent at the lowest resolution that still has
+                this many pixels. None always sends the full resolution.
+
+    image_cache_dir: String. Default=None
+                     Directory where encoded cutouts are also stored, so
+                     they are reused after a restart and by other server
+                     processes.
+
+    image_urls: Boolean. Default=False
+                With image_format, point the images to URLs served by the
+                app instead of embedding them in the callback response, so
+                the browser caches them. Always done in clientside mode.
+
+    hover_debounce: Float. Default=None
+                    Only update the images once the cursor has rested on a
+                    point for this many milliseconds (e.g. 50), so sweeping
+                    over the 2D plane doesn't queue an update for every point
+                    on the way. Updates that are superseded by a newer hover
+                    while waiting on the server are dropped. None updates on
+                    every hover event.
+
+    properties: Dictionary of arrays, pandas DataFrame or pyarrow Table.
+                Default=None
+                A table of galaxy properties (one row per galaxy). Every
+                numeric column is offered in the dropdown menus of the x
+                axis, the y axis and the color coding, after the keys of x,
+                y and color_code. Switching only sends the column that
+                changed, encoded as float32 (see property_table.py).
+
+    compress: Boolean. Default=False
+              Compress the responses of the server with gzip. Requires
+              flask-compress (pip install "dash[compress]").
+
+    refresh: Callable. Default=None
+             Returns the arguments of the app with rows appended when the
+             catalog grew and None otherwise, e.g. a
+             catalog.CatalogWatcher of a catalog extended with
+             catalog.append_catalog. See dash_app.dash_plot.
+
+    refresh_interval: Float. Default=None
+                      Seconds between the checks for new galaxies made by
+                      every open page, which get them as a Patch of the 2D
+                      plane. None makes no checks. Galaxies can also be
+                      added with app.extend_catalog.
+
+    instrument: Boolean. Default=False
+                Log the wall time and response size of every callback (and
+                of the clientside data routes), see instrumentation.py. The
+                measurements are also kept in app.callback_stats.
     
     Output
     ------
     Returns a Dash app
     '''
     
-    app = Dash(__name__, external_stylesheets=[dbc.themes.DARKLY])
-
-    if color_code is None:
-        color_code = {'same for all': np.ones(len(list(x.values())))}
-
-    fig = go.Figure()
-    trace0 = go.Scatter(
-        x=list(x.values())[0], y=list(y.values())[0],
-        mode='markers',
-        name='galaxies',
-        marker=dict(
-            size=marker_size,  # Change this value to adjust marker size
-            color=list(color_code.values())[0],
-            colorscale=cmap_plot,
-            colorbar=dict(
-                title=list(color_code.keys())[0], orientation='h'
-            )
-        )
-    )
-    fig.add_trace(trace0)
-
-    fig.update_xaxes(title=list(x.keys())[0], range=xlim)
-    fig.update_yaxes(title=list(y.keys())[0], range=ylim)
-    fig.update_layout(width=750, height=650, font=dict(size=30))
-
-
-    app.layout = html.Div([
-        html.Div([
-            dcc.Dropdown(
-                options=[{'label': html.Span(k, style={'color': 'white'}), 'value': k} for k in color_code.keys()],
-                value=list(color_code.keys())[0],
-                id='color coding',
-                style={'width': '50%', 'backgroundColor': '#2a2a2a'}
-            )
-        ]),
-        html.Div([
-            dcc.Graph(id='2d-scatter', figure=fig,
-                      style={'display': 'inline-block'}, mathjax=True)
-        ]),
-        html.Div(
-            html.Div(
-                [dcc.Graph(id=image_labels[l], style={'display':'inline-block'}, mathjax=True) for l in range(len(images))]
-            )
-        )
-    ])
-
-    def create_images(ind):
-        figs = []
-        for i in range(len(images)):
-            fig0 = px.imshow(images[i][ind,:,:], color_continuous_scale=cmap_images)
-            #fig0.update_layout(title=str(ind), font=dict(size=30), title_x=0.5)
-            figs.append(fig0)
-        return figs
-
-    @app.callback(
-        [Output(image_labels[l], 'figure') for l in range(len(images))],
-        Input('2d-scatter', 'hoverData')
-    )
-    def update_spectrum(hov_data):
-        if hov_data is None:
-            ind = 0
-        else:
-            ind = hov_data['points'][0]['pointIndex']
-        return create_images(ind)
-
-    @app.callback(
-        Output('2d-scatter', 'figure'),
-        Input('color coding', 'value')
-    )
-    def update_color_coding(color):
-        fig = go.Figure()
-        trace0 = go.Scatter(
-            x=list(x.values())[0], y=list(y.values())[0],
-            mode='markers',
-            name='galaxies',
-            marker=dict(
-                size=marker_size,  # Change this value to adjust marker size
-                color=list(color_code[color]),
-                colorscale=cmap_plot,
-                colorbar=dict(
-                    title=color, orientation='h'
-                )
-            )
-        )
-        fig.add_trace(trace0)
-        
-        return fig
-
-    return app
-
-    
+    return dash_plot(
+        x=x, y=y, xlim=xlim, ylim=ylim, color_code=color_code, cmap=cmap_plot,
+        marker_size=marker_size, properties=properties, images=images, cmap_images=cmap_images,
+        image_labels=image_labels, image_format=image_format, image_size=image_size,
+        image_cache_dir=image_cache_dir, image_urls=image_urls, clientside=clientside,
+        webgl_threshold=webgl_threshold, max_points=max_points, density_bins=density_bins,
+        hover_debounce=hover_debounce, compress=compress, refresh=refresh,
+        refresh_interval=refresh_interval, instrument=instrument, color_menu=True)
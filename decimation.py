@@ -0,0 +1,253 @@
+import copy
+
+import numpy as np
+
+
+class LevelOfDetail:
+    '''
+    Level-of-detail subsampling of a 2D scatter plot.
+
+    Only up to max_points of the points inside the current view are drawn.
+    Every occupied cell of a bins x bins grid over the view keeps at least
+    one point, so sparse regions and outliers stay visible, and the rest is
+    filled with a fixed random ranking of the points. Zooming in therefore
+    refines the plot (more points of the same region appear) without the
+    points already shown jumping around.
+
+    Input
+    -----
+
+    x, y: 1D arrays (N_points)
+          Coordinates of the points.
+
+    max_points: Integer
+                Maximum number of points drawn at once.
+
+    bins: Integer. Default=128
+          Number of grid cells along each axis of the view.
+
+    seed: Integer. Default=0
+          Seed of the random ranking of the points.
+    '''
+
+    def __init__(self, x, y, max_points, bins=128, seed=0):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        # Points are stored in the order of their random rank, so the first
+        # points of any subset are the ones to keep.
+        self.rng = np.random.default_rng(seed)
+        self.order = self.rng.permutation(len(x))
+        self.x = x[self.order]
+        self.y = y[self.order]
+        self.max_points = max_points
+        self.bins = bins
+
+    def __len__(self):
+        return len(self.order)
+
+    def extended(self, x, y):
+        '''
+        Copy of the subsampling with the points x, y appended (their indices
+        follow the current ones). The new points get random ranks among the
+        current ones, whose relative ranking is kept, so the plot of a view
+        only changes where new points get drawn.
+        '''
+        n, n_new = len(self.order), len(x)
+        slots = np.zeros(n + n_new, dtype=bool)
+        slots[self.rng.choice(n + n_new, n_new, replace=False)] = True
+        new = n + self.rng.permutation(n_new)
+
+        lod = copy.copy(self)
+        lod.order = np.empty(n + n_new, dtype=self.order.dtype)
+        lod.order[~slots], lod.order[slots] = self.order, new
+        lod.x = np.empty(n + n_new)
+        lod.x[~slots], lod.x[slots] = self.x, np.asarray(x, dtype=float)[new - n]
+        lod.y = np.empty(n + n_new)
+        lod.y[~slots], lod.y[slots] = self.y, np.asarray(y, dtype=float)[new - n]
+        return lod
+
+    def indices(self, x_range=None, y_range=None):
+        '''
+        Original indices of the points to draw inside the view
+        x_range=(xmin, xmax), y_range=(ymin, ymax). None means the axis
+        is not restricted.
+        '''
+        mask = np.isfinite(self.x) & np.isfinite(self.y)
+        if x_range is not None:
+            mask &= (self.x >= min(x_range)) & (self.x <= max(x_range))
+        if y_range is not None:
+            mask &= (self.y >= min(y_range)) & (self.y <= max(y_range))
+        visible = np.flatnonzero(mask)
+        if len(visible) <= self.max_points:
+            return np.sort(self.order[visible])
+
+        xv, yv = self.x[visible], self.y[visible]
+        cell_x = _cell(xv, self.bins)
+        cell_y = _cell(yv, self.bins)
+        # np.unique returns the first occurrence of every cell, which is the
+        # best ranked point in it since visible is in rank order.
+        _, first = np.unique(cell_x * self.bins + cell_y, return_index=True)
+        first.sort()
+        if len(first) >= self.max_points:
+            keep = first[:self.max_points]
+        else:
+            rest = np.ones(len(visible), dtype=bool)
+            rest[first] = False
+            keep = np.concatenate([first, np.flatnonzero(rest)[:self.max_points - len(first)]])
+        return np.sort(self.order[visible[keep]])
+
+
+def _cell(values, bins):
+    low, high = values.min(), values.max()
+    if high == low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / (high - low) * bins).astype(np.int64), bins - 1)
+
+
+def density_view(x, y, color, bins, x_range=None, y_range=None):
+    '''
+    Bin the points inside a view into a bins x bins image, like datashader.
+
+    Input
+    -----
+
+    x, y, color: 1D arrays (N_points)
+                 Coordinates and color-coding values of the points.
+
+    bins: Integer
+          Number of bins along each axis.
+
+    x_range, y_range: (min, max). Default=None
+                      The view. None uses the range of the data.
+
+    Output
+    ------
+
+    Returns a dictionary with
+    x, y: 1D arrays (bins). Bin centers.
+    z: 2D array (bins, bins). Mean color value of the points in every bin
+       (NaN for empty bins), indexed as z[y, x] like go.Heatmap.
+    count: 2D array (bins, bins). Number of points in every bin.
+    customdata: 2D array (bins, bins). Index of the galaxy closest to the
+                center of every bin, -1 for empty bins.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    color = np.asarray(color, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x_range = (np.min(x[finite]), np.max(x[finite])) if x_range is None else sorted(x_range)
+    y_range = (np.min(y[finite]), np.max(y[finite])) if y_range is None else sorted(y_range)
+    x_edges = np.linspace(x_range[0], x_range[1], bins + 1)
+    y_edges = np.linspace(y_range[0], y_range[1], bins + 1)
+
+    inside = np.flatnonzero(finite & (x >= x_edges[0]) & (x <= x_edges[-1]) &
+                            (y >= y_edges[0]) & (y <= y_edges[-1]))
+    i = np.clip(np.searchsorted(x_edges, x[inside], side='right') - 1, 0, bins - 1)
+    j = np.clip(np.searchsorted(y_edges, y[inside], side='right') - 1, 0, bins - 1)
+    cell = j * bins + i
+
+    count = np.bincount(cell, minlength=bins**2)
+    total = np.bincount(cell, weights=color[inside], minlength=bins**2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(count > 0, total / count, np.nan)
+
+    # Closest galaxy to the center of every bin: sort by cell, then by the
+    # distance to the center (in units of the bin size), and take the first
+    # galaxy of every cell.
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    distance = (((x[inside] - x_centers[i]) / (x_edges[1] - x_edges[0]))**2 +
+                ((y[inside] - y_centers[j]) / (y_edges[1] - y_edges[0]))**2)
+    order = np.lexsort((distance, cell))
+    cells, first = np.unique(cell[order], return_index=True)
+    customdata = np.full(bins**2, -1, dtype=np.int64)
+    customdata[cells] = inside[order[first]]
+
+    return dict(x=x_centers, y=y_centers, z=z.reshape(bins, bins),
+                count=count.reshape(bins, bins), customdata=customdata.reshape(bins, bins))
+
+
+def view_ranges(relayout_data, x_range=None, y_range=None):
+    '''
+    Axis ranges of a plot after a zoom or pan, read from the relayoutData of
+    a dcc.Graph.
+
+    x_range and y_range are the ranges used when an axis is reset with
+    autorange or relayout_data doesn't mention it.
+
+    Output
+    ------
+
+    Returns (x_range, y_range)
+    '''
+    ranges = {'xaxis': x_range, 'yaxis': y_range}
+    for axis in ranges:
+        if not relayout_data:
+            continue
+        if f'{axis}.range[0]' in relayout_data and f'{axis}.range[1]' in relayout_data:
+            ranges[axis] = (relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]'])
+        elif f'{axis}.range' in relayout_data:
+            ranges[axis] = tuple(relayout_data[f'{axis}.range'])
+    return ranges['xaxis'], ranges['yaxis']
+
+
+def hover_index(hov_data, index=None):
+    '''
+    Index of the hovered (or clicked) galaxy.
+
+    Decimated scatter plots and density views store the index of the galaxy
+    of every drawn point or bin in customdata. Without it the pointIndex of
+    the galaxies trace is used. Any other point (e.g. on one of the
+    additional lines) is resolved to the galaxy nearest to its coordinates
+    with index, a spatial_index.GridIndex, when one is given.
+    '''
+    point = hov_data['points'][0]
+    if point.get('customdata', -1) >= 0:
+        return point['customdata']
+    if index is not None and (point.get('curveNumber', 0) != 0 or 'pointIndex' not in point):
+        return index.nearest(point['x'], point['y'])
+    return point['pointIndex']
+
+
+def _in_polygon(x, y, polygon_x, polygon_y):
+    '''Even-odd rule test of the points (x, y) against a polygon.'''
+    inside = np.zeros(len(x), dtype=bool)
+    j = len(polygon_x) - 1
+    for i in range(len(polygon_x)):
+        xi, yi, xj, yj = polygon_x[i], polygon_y[i], polygon_x[j], polygon_y[j]
+        crosses = (yi > y) != (yj > y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            inside ^= crosses & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+        j = i
+    return inside
+
+
+def selected_indices(selected_data, x, y):
+    '''
+    Indices of the galaxies inside a box or lasso selection, read from the
+    selectedData of a dcc.Graph.
+
+    The shape of the selection is used rather than its points, so that
+    decimated plots select every galaxy inside it and not only the drawn
+    ones. Selections without a shape (e.g. of clicked points) fall back to
+    the points, as in hover_index.
+    '''
+    if not selected_data:
+        return np.zeros(0, dtype=np.int64)
+    if selected_data.get('range') or selected_data.get('lassoPoints'):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if selected_data.get('range'):
+            x_range, y_range = selected_data['range']['x'], selected_data['range']['y']
+        else:
+            polygon_x = np.asarray(selected_data['lassoPoints']['x'], dtype=float)
+            polygon_y = np.asarray(selected_data['lassoPoints']['y'], dtype=float)
+            x_range, y_range = (polygon_x.min(), polygon_x.max()), (polygon_y.min(), polygon_y.max())
+        candidates = np.flatnonzero((x >= min(x_range)) & (x <= max(x_range)) &
+                                    (y >= min(y_range)) & (y <= max(y_range)))
+        if selected_data.get('range'):
+            return candidates
+        return candidates[_in_polygon(x[candidates], y[candidates], polygon_x, polygon_y)]
+    points = [point for point in selected_data.get('points', []) if point.get('curveNumber', 0) == 0]
+    return np.array([point['customdata'] if point.get('customdata', -1) >= 0 else point['pointIndex']
+                     for point in points], dtype=np.int64)
@@ -0,0 +1,184 @@
+'''
+Shape-preserving downsampling of spectra for display.
+
+A spectrum plot a couple of thousand pixels wide can't show more points
+than it has pixels, so the overview panel only needs a subset of the
+wavelength grid. The functions here pick that subset for every spectrum of
+a catalog at once, so that emission lines and other narrow features survive
+the downsampling:
+
+- lttb: Largest-Triangle-Three-Buckets, which keeps the points that define
+  the visual shape of the curve.
+- minmax: the minimum and maximum of every bucket (a min/max envelope),
+  which keeps every peak and trough.
+
+Both return indices into the wavelength grid, one row per spectrum, so that
+the downsampled spectrum of object ind is wavelength[index[ind]],
+spectrum[ind][index[ind]].
+'''
+import numpy as np
+
+from spectra_store import as_spectra_store
+
+
+def _bucket_edges(n_features, n_buckets):
+    '''Edges of n_buckets buckets over the points between the first and last one.'''
+    return np.linspace(1, n_features - 1, n_buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x, y, n_out):
+    '''
+    Largest-Triangle-Three-Buckets downsampling of many curves sharing the
+    same x grid.
+
+    Input
+    -----
+
+    x: 1D array (N_features)
+       The shared x grid (e.g. wavelength).
+
+    y: 2D array (N_rows, N_features)
+       The curves.
+
+    n_out: Integer
+           Number of points to keep per curve (at least 3). The first and
+           last points are always kept.
+
+    Output
+    ------
+
+    Returns a 2D array (N_rows, n_out) of indices into x, increasing along
+    every row.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_rows, n_features = y.shape
+    if n_out >= n_features:
+        return np.broadcast_to(np.arange(n_features), (n_rows, n_features)).copy()
+    if n_out < 3:
+        raise ValueError('n_out should be at least 3')
+
+    edges = _bucket_edges(n_features, n_out - 2)
+    rows = np.arange(n_rows)
+    index = np.empty((n_rows, n_out), dtype=np.int64)
+    index[:, 0] = 0
+    index[:, -1] = n_features - 1
+
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        # Average point of the next bucket (the last point after the last bucket).
+        if b + 1 < n_out - 2:
+            next_x = x[edges[b + 1]:edges[b + 2]].mean()
+            next_y = y[:, edges[b + 1]:edges[b + 2]].mean(axis=1)
+        else:
+            next_x, next_y = x[-1], y[:, -1]
+
+        previous = index[:, b]
+        previous_x, previous_y = x[previous], y[rows, previous]
+        # Twice the area of the triangle (previous point, candidate, next average).
+        area = np.abs((previous_x - next_x)[..., None] * (y[:, start:stop] - previous_y[:, None]) -
+                      (previous_x[:, None] - x[start:stop]) * (next_y - previous_y)[:, None])
+        index[:, b + 1] = start + np.argmax(np.nan_to_num(area, nan=-1), axis=1)
+
+    return index
+
+
+def minmax_indices(y, n_out):
+    '''
+    Min/max envelope downsampling: the positions of the minimum and maximum
+    of every one of n_out // 2 buckets, plus the first and last points.
+
+    Input
+    -----
+
+    y: 2D array (N_rows, N_features)
+
+    n_out: Integer
+           Number of points to keep per curve.
+
+    Output
+    ------
+
+    Returns a 2D array (N_rows, n_out) of indices, increasing along every
+    row.
+    '''
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_rows, n_features = y.shape
+    if n_out >= n_features:
+        return np.broadcast_to(np.arange(n_features), (n_rows, n_features)).copy()
+    if n_out < 4:
+        raise ValueError('n_out should be at least 4')
+
+    n_buckets = (n_out - 2) // 2
+    edges = _bucket_edges(n_features, n_buckets)
+    index = np.empty((n_rows, 2 + 2 * n_buckets), dtype=np.int64)
+    index[:, 0] = 0
+    index[:, -1] = n_features - 1
+    missing = np.isnan(y)
+    for b in range(n_buckets):
+        start, stop = edges[b], edges[b + 1]
+        bucket, bucket_missing = y[:, start:stop], missing[:, start:stop]
+        low = start + np.argmin(np.where(bucket_missing, np.inf, bucket), axis=1)
+        high = start + np.argmax(np.where(bucket_missing, -np.inf, bucket), axis=1)
+        index[:, 1 + 2 * b] = np.minimum(low, high)
+        index[:, 2 + 2 * b] = np.maximum(low, high)
+    return index
+
+
+def downsample_spectra(spectra, wavelength, n_out=2000, method='lttb', chunk_size=4096, path=None):
+    '''
+    Indices of the downsampled spectra of a whole catalog, computed in one
+    chunked pass so that catalogs larger than memory can be processed.
+
+    Input
+    -----
+
+    spectra: 2D array (N_points, N_features), SpectraStore or path
+             The spectra (see spectra_store.py).
+
+    wavelength: 1D array (N_features)
+                The wavelength grid of the spectra.
+
+    n_out: Integer. Default=2000
+           Number of points kept per spectrum, e.g. the width of the
+           spectrum plot in pixels.
+
+    method: String. Default='lttb'
+            'lttb' or 'minmax'.
+
+    chunk_size: Integer. Default=4096
+                Number of spectra processed at once.
+
+    path: String. Default=None
+          .npy file to write the indices to (memory-mapped while writing).
+          The indices are kept in memory if None.
+
+    Output
+    ------
+
+    Returns a 2D array (N_points, n_out) of indices into wavelength, as
+    uint16 when the wavelength grid is short enough and int32 otherwise.
+    '''
+    if method not in ('lttb', 'minmax'):
+        raise ValueError(f"method should be 'lttb' or 'minmax', got {method}")
+    spectra = as_spectra_store(spectra)
+    n_points, n_features = spectra.shape
+    n_kept = min(n_out, n_features)
+    if method == 'minmax' and n_kept < n_features:
+        n_kept = 2 + 2 * ((n_out - 2) // 2)
+    dtype = np.uint16 if n_features <= np.iinfo(np.uint16).max else np.int32
+
+    if path is None:
+        index = np.empty((n_points, n_kept), dtype=dtype)
+    else:
+        index = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_points, n_kept))
+
+    for start, block in spectra.iter_chunks(chunk_size):
+        if method == 'lttb':
+            index[start:start + len(block)] = lttb_indices(wavelength, block, n_out)
+        else:
+            index[start:start + len(block)] = minmax_indices(block, n_out)
+
+    if path is not None:
+        index.flush()
+    return index
@@ -0,0 +1,26 @@
+'''
+Compact encoding of arrays sent to the browser.
+
+Plotly.js accepts "typed array specs", {'dtype': 'f4', 'bdata': <base64>},
+wherever it takes an array of numbers. Plotly encodes the arrays of whole
+figures like this, but the values of a dash.Patch are sent as JSON lists;
+wrapping them with typed_array sends 4 bytes per float32 value (about 5.3
+once base64 encoded) instead of up to 20 characters per number.
+'''
+import base64
+
+import numpy as np
+
+DTYPES = {'f4': np.float32, 'f8': np.float64, 'i4': np.int32, 'u2': np.uint16, 'u1': np.uint8}
+
+
+def typed_array(values, dtype='f4'):
+    '''
+    The Plotly typed array spec of values, converted to dtype ('f4', 'f8',
+    'i4', 'u2' or 'u1'). 2D arrays (e.g. heatmap z) keep their shape.
+    '''
+    values = np.ascontiguousarray(values, dtype=np.dtype(DTYPES[dtype]).newbyteorder('<'))
+    spec = {'dtype': dtype, 'bdata': base64.b64encode(values.tobytes()).decode()}
+    if values.ndim > 1:
+        spec['shape'] = ', '.join(str(n) for n in values.shape)
+    return spec
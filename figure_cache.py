@@ -0,0 +1,135 @@
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+from plotly.io.json import to_json_plotly
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def storage_key(key):
+    '''Cache keys are tuples like ('spectrum', ind); stores keep them as 'spectrum/ind'.'''
+    return '/'.join(str(part) for part in key)
+
+
+class LRUCache:
+    '''
+    Bounded least-recently-used cache with hit/miss counters.
+
+    Used by the Dash apps to keep the serialized figure updates of recently
+    hovered points, so re-hovering a galaxy skips building them again.
+    Safe to use from the threads of a threaded Flask server.
+
+    Input
+    -----
+
+    maxsize: Integer. Default=256
+             Maximum number of entries. The least recently used entry is
+             dropped when the cache is full. 0 disables the in-memory
+             cache (stores are still used).
+
+    store: Store or list of stores. Default=None
+           Larger caches behind this one, looked up in order on a miss:
+           a FigureStore of precomputed entries (see figure_store.py), or a
+           cache shared by all server processes (see cache_backends.py).
+           Entries found there count as hits. Entries put in this cache
+           are also written to the stores that are writable.
+    '''
+
+    def __init__(self, maxsize=256, store=None):
+        if maxsize < 0:
+            raise ValueError('maxsize should be >= 0')
+        self.maxsize = maxsize
+        if store is None:
+            store = []
+        self.stores = list(store) if isinstance(store, (list, tuple)) else [store]
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+        value = None
+        for store in self.stores:
+            value = store.get(key)
+            if value is not None:
+                break
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def _remember(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def put(self, key, value):
+        self._remember(key, value)
+        for store in self.stores:
+            if getattr(store, 'writable', False):
+                store.put(key, value)
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def clear(self):
+        '''Empty the in-memory cache and reset the counters (stores are left alone).'''
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._data:
+                return True
+        return any(key in store for store in self.stores)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def items(self):
+        '''Snapshot of the in-memory entries, least recently used first.'''
+        with self._lock:
+            return list(self._data.items())
+
+
+def cached_json(cache, key, create):
+    '''
+    Return the callback output stored in cache under key, building it with
+    create() and storing its JSON on a miss.
+
+    create can return anything Dash can send as a callback output, e.g. a
+    go.Figure, a dash.Patch or a list of them. The output is returned
+    decoded from JSON, which Dash sends on as it is.
+    '''
+    payload = cache.get(key)
+    if payload is None:
+        payload = to_json_plotly(create())
+        cache.put(key, payload)
+    return json.loads(payload)
+
+
+def warm_cache(cache, key, create):
+    '''
+    Store the JSON of create() in cache under key unless it is there
+    already, as cached_json would on a miss. Used to fill the cache ahead of
+    hovers, so it doesn't count as a hit or a miss.
+    '''
+    if key not in cache:
+        cache.put(key, to_json_plotly(create()))
@@ -0,0 +1,216 @@
+'''
+Persistent store of precomputed hover updates.
+
+For a fixed catalog the update sent when a galaxy is hovered (the spectrum
+and zoom patches, or the binary payload in clientside mode) never changes.
+precompute_figures builds them for every galaxy of a catalog once, in
+parallel worker processes, and writes them to an SQLite file. Apps given
+that file (figure_store=...) serve hovers from it, so the first hover of a
+galaxy after a restart is as fast as a cached one, in every worker process.
+
+From the command line:
+
+    python figure_store.py sdss_catalog sdss_figures.sqlite --workers 8
+    python serve.py sdss_catalog --figure-store sdss_figures.sqlite
+
+The store remembers which catalog it was computed for, and serve.create_app
+refuses a store computed for a different version of the catalog.
+'''
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from plotly.io.json import to_json_plotly
+
+from catalog import MANIFEST
+from figure_cache import storage_key
+
+
+def catalog_fingerprint(path):
+    '''
+    Hash of the manifest of a catalog, which changes whenever it is saved
+    again. Appending rows (catalog.append_catalog) leaves the manifest and
+    the updates of the existing galaxies as they are, so a store stays
+    valid and precompute only adds the new galaxies.
+    '''
+    with open(os.path.join(path, MANIFEST), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class FigureStore:
+    '''
+    SQLite key-value store of hover updates, read by the figure cache of the
+    apps (see figure_cache.LRUCache) on a miss.
+
+    Values are the JSON strings stored by figure_cache.cached_json or the
+    bytes of the clientside payloads. Every thread and process opens its own
+    connection, so a store opened before gunicorn forks its workers can be
+    used by all of them.
+
+    Input
+    -----
+
+    path: String
+          The SQLite file.
+
+    readonly: Boolean. Default=True
+              Open for reading only; the file has to exist.
+    '''
+
+    def __init__(self, path, readonly=True):
+        if readonly and not os.path.exists(path):
+            raise FileNotFoundError(f'No figure store at {path}')
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            with self._connection() as connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS payloads (key TEXT PRIMARY KEY, value BLOB)')
+                connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            if self.readonly:
+                connection = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True)
+            else:
+                connection = sqlite3.connect(self.path)
+                # Lets apps read the store while it is being written.
+                connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            'SELECT value FROM payloads WHERE key = ?', (storage_key(key),)).fetchone()
+        return default if row is None else row[0]
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        with self._connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO payloads VALUES (?, ?)',
+                                   [(storage_key(key), value) for key, value in items])
+
+    def __contains__(self, key):
+        return self._connection().execute(
+            'SELECT 1 FROM payloads WHERE key = ?', (storage_key(key),)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM payloads').fetchone()[0]
+
+    def keys(self):
+        '''The stored keys, as 'kind/ind' strings.'''
+        return {row[0] for row in self._connection().execute('SELECT key FROM payloads')}
+
+    def meta(self, key, default=None):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+
+def open_figure_store(store):
+    '''Return store as a FigureStore: paths are opened read-only, stores returned as they are.'''
+    if store is None or isinstance(store, FigureStore):
+        return store
+    return FigureStore(store)
+
+
+# The app of a precompute worker process, built once per process.
+_worker_app = None
+
+
+def _start_worker(path):
+    global _worker_app
+    from serve import create_app
+    _worker_app = create_app(path)
+
+
+def _render(indices):
+    '''The hover updates of galaxies indices, as (key, value) pairs.'''
+    items = []
+    for kind, build in _worker_app.figure_builders.items():
+        for ind in indices:
+            value = build(ind)
+            items.append(((kind, ind), value if isinstance(value, bytes) else to_json_plotly(value)))
+    return items
+
+
+def precompute_figures(path, store_path, workers=None, chunk_size=256, log_every=10000):
+    '''
+    Build the hover updates of every galaxy of a catalog and write them to a
+    figure store.
+
+    Input
+    -----
+
+    path: String
+          Directory saved with catalog.save_catalog, with spectra: only the
+          updates of the spectrum and zoom plots are precomputed.
+
+    store_path: String
+                The SQLite file, created if needed. Galaxies already in it
+                are not built again, so an interrupted run can be resumed.
+
+    workers: Integer. Default=None
+             Number of worker processes, one per core by default. Every
+             worker builds the app of the catalog once.
+
+    chunk_size: Integer. Default=256
+                Number of galaxies sent to a worker at once.
+
+    log_every: Integer. Default=10000
+               Print the progress every this many galaxies.
+
+    Output
+    ------
+
+    Returns the number of galaxies built.
+    '''
+    from catalog import load_catalog
+
+    _, kwargs = load_catalog(path)
+    if kwargs.get('spectra') is None:
+        raise ValueError(f'{path} has no spectra, whose hover updates are the only ones precomputed')
+
+    store = FigureStore(store_path, readonly=False)
+    fingerprint = catalog_fingerprint(path)
+    if store.meta('catalog') not in (None, fingerprint):
+        raise ValueError(f'{store_path} was computed for another version of {path}')
+    store.set_meta('catalog', fingerprint)
+
+    n_points = len(next(iter(kwargs['x'].values())))
+    # Every chunk is written in one transaction, so a galaxy with any
+    # update stored has all of them.
+    stored = store.keys()
+    todo = [ind for ind in range(n_points)
+            if storage_key(('spectrum', ind)) not in stored and storage_key(('binary', ind)) not in stored]
+    chunks = [todo[start:start + chunk_size] for start in range(0, len(todo), chunk_size)]
+
+    start, done = time.perf_counter(), 0
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(path,)) as executor:
+        for chunk, items in zip(chunks, executor.map(_render, chunks)):
+            store.put_many(items)
+            previous, done = done, done + len(chunk)
+            if log_every and done // log_every > previous // log_every:
+                print(f'{done}/{len(todo)} galaxies, {time.perf_counter() - start:.0f} s', flush=True)
+    return len(todo)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the hover updates of a catalog into a figure store.')
+    parser.add_argument('catalog', help='directory saved with catalog.save_catalog')
+    parser.add_argument('store', help='SQLite file to write')
+    parser.add_argument('--workers', type=int, default=None, help='default: number of cores')
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+    n = precompute_figures(args.catalog, args.store, args.workers, args.chunk_size)
+    print(f'Built the hover updates of {n} galaxies')
@@ -0,0 +1,320 @@
+import copy
+import threading
+
+import numpy as np
+import plotly.graph_objects as go
+from dash.exceptions import PreventUpdate
+
+from decimation import LevelOfDetail, density_view, hover_index, selected_indices, view_ranges
+from encoding import typed_array
+from figure_cache import LRUCache
+from spatial_index import GridIndex
+
+
+class GalaxyPlane:
+    '''
+    The galaxies trace of the 2D plane shared by dash_plot_spectra and
+    dash_plot_images.
+
+    Depending on the size of the catalog the galaxies are drawn as an SVG
+    scatter plot, a WebGL scatter plot, a level-of-detail subsample or a
+    binned density image, and the views after zooming are recomputed from
+    the relayoutData of the plot. Hovered points are mapped back to the
+    index of the galaxy in the catalog in every case.
+
+    Input
+    -----
+
+    x, y: 1D arrays (N_points)
+          Coordinates of the galaxies.
+
+    xlim, ylim: list or tuple (min, max). Default=None
+                Initial view.
+
+    webgl_threshold: Integer. Default=100000
+                     Use go.Scattergl above this number of points.
+
+    max_points: Integer. Default=None
+                Draw a level-of-detail subsample of at most this many points.
+
+    density_bins: Integer. Default=None
+                  Draw a density_bins x density_bins image of the mean
+                  color-coding value instead of the points.
+    '''
+
+    def __init__(self, x, y, xlim=None, ylim=None, webgl_threshold=100000,
+                 max_points=None, density_bins=None):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.xlim = xlim
+        self.ylim = ylim
+        self.density_bins = density_bins
+        self.scatter = go.Scattergl if len(self.x) > webgl_threshold else go.Scatter
+
+        self.lod = None
+        if density_bins is None and max_points is not None and len(self.x) > max_points:
+            self.lod = LevelOfDetail(self.x, self.y, max_points)
+
+        # Decimated and binned views don't have one drawn point per galaxy,
+        # so hovered coordinates are resolved with a spatial index.
+        self.index = None
+        if self.lod is not None or density_bins is not None:
+            self.index = GridIndex(self.x, self.y)
+        self._neighbour_index = self.index
+        self._lock = threading.Lock()
+
+    @property
+    def decimated(self):
+        return self.lod is not None or self.density_bins is not None
+
+    def view(self, relayout_data=None):
+        return view_ranges(relayout_data, self.xlim, self.ylim)
+
+    def is_view_change(self, relayout_data):
+        '''Whether relayout_data is a zoom or pan (and not e.g. an autosize).'''
+        return bool(relayout_data) and any(key.startswith(('xaxis', 'yaxis')) for key in relayout_data)
+
+    def data(self, color, relayout_data=None):
+        '''
+        Trace properties of the galaxies in the view: x, y, customdata and the
+        color-coding values (under 'color').
+        '''
+        color = np.asarray(color)
+        if self.density_bins is not None:
+            binned = density_view(self.x, self.y, color, self.density_bins, *self.view(relayout_data))
+            return dict(x=binned['x'], y=binned['y'], color=binned['z'], customdata=binned['customdata'])
+        if self.lod is None:
+            return dict(x=self.x, y=self.y, color=color, customdata=None)
+        shown = self.lod.indices(*self.view(relayout_data))
+        return dict(x=self.x[shown], y=self.y[shown], color=color[shown], customdata=shown)
+
+    def trace(self, color, colorscale, colorbar_title, marker=None):
+        '''The galaxies trace of the initial figure.'''
+        data = self.data(color)
+        # float32 like the patches, which halves the size of the figure.
+        for key in ('x', 'y', 'color'):
+            data[key] = np.asarray(data[key], dtype=np.float32)
+        colorbar = dict(title=colorbar_title, orientation='h')
+        if self.density_bins is not None:
+            return go.Heatmap(x=data['x'], y=data['y'], z=data['color'],
+                              customdata=data['customdata'], name='galaxies',
+                              colorscale=colorscale, colorbar=colorbar, hoverongaps=False)
+        return self.scatter(
+            x=data['x'], y=data['y'],
+            customdata=data['customdata'],
+            mode='markers',
+            name='galaxies',
+            marker=dict(
+                color=data['color'],
+                colorscale=colorscale,
+                colorbar=colorbar,
+                **(marker or {})
+            )
+        )
+
+    def patch(self, patch, color, relayout_data=None, positions=True):
+        '''
+        Fill a dash.Patch of the plane's figure with the galaxies in the view.
+        positions=False only updates the colors, which is enough when the
+        view didn't change.
+        '''
+        data = self.data(color, relayout_data)
+        trace = patch['data'][0]
+        if positions:
+            trace['x'] = typed_array(data['x'])
+            trace['y'] = typed_array(data['y'])
+            if data['customdata'] is not None:
+                trace['customdata'] = typed_array(data['customdata'], 'i4')
+        if self.density_bins is not None:
+            trace['z'] = typed_array(data['color'])
+        else:
+            trace['marker']['color'] = typed_array(data['color'])
+        return patch
+
+    def colorbar_title(self, patch, title):
+        '''Set the colorbar title in a dash.Patch of the plane's figure.'''
+        if self.density_bins is not None:
+            patch['data'][0]['colorbar']['title']['text'] = title
+        else:
+            patch['data'][0]['marker']['colorbar']['title']['text'] = title
+        return patch
+
+    def hover_index(self, hov_data):
+        '''Index in the catalog of the hovered or clicked galaxy.'''
+        return hover_index(hov_data, self.index)
+
+    def selected(self, selected_data):
+        '''Indices in the catalog of the galaxies inside a box or lasso selection.'''
+        return selected_indices(selected_data, self.x, self.y)
+
+    def extended(self, x, y):
+        '''
+        Copy of the plane with the points x, y: the current points followed
+        by new ones, e.g. rows appended to the catalog. The level of detail
+        and the spatial indexes are extended rather than rebuilt (indexes
+        are rebuilt once they were built for less than half of the points),
+        and the kind of plot stays the same.
+        '''
+        x, y = np.asarray(x), np.asarray(y)
+        n = len(self.x)
+        if len(x) == n:
+            return self
+        plane = copy.copy(self)
+        plane.x, plane.y = x, y
+        if self.lod is not None:
+            plane.lod = self.lod.extended(x[n:], y[n:])
+
+        def extend(index):
+            if index is None:
+                return None
+            if 2 * (index.n_added + len(x) - n) > len(x):
+                return GridIndex(x, y)
+            return index.extended(x[n:], y[n:], n)
+
+        plane.index = extend(self.index)
+        plane._neighbour_index = plane.index if self._neighbour_index is self.index else extend(
+            self._neighbour_index)
+        plane._lock = threading.Lock()
+        return plane
+
+    def neighbours(self, ind, k):
+        '''The k galaxies closest to galaxy ind in this plane (ind included).'''
+        with self._lock:
+            if self._neighbour_index is None:
+                self._neighbour_index = GridIndex(self.x, self.y)
+        return self._neighbour_index.nearest_k(self.x[ind], self.y[ind], k)
+
+
+class GalaxyPlanes:
+    '''
+    The GalaxyPlane of every pair of columns of a PropertyTable shown on the
+    axes, built the first time the pair is shown, and the updates of the
+    plane's figure when the axes, the color coding or the view change.
+
+    Input
+    -----
+
+    table: PropertyTable
+
+    x_label, y_label: Strings
+                      Columns shown initially, with the view xlim, ylim.
+
+    max_planes: Integer. Default=8
+                Number of planes kept. Decimated and binned planes hold a
+                spatial index each, so this bounds their memory.
+
+    **options: Arguments of GalaxyPlane.
+    '''
+
+    def __init__(self, table, x_label, y_label, xlim=None, ylim=None, max_planes=8, **options):
+        self.table = table
+        self.x_label = x_label
+        self.y_label = y_label
+        self.xlim = xlim
+        self.ylim = ylim
+        self.options = options
+        self.planes = LRUCache(max_planes)
+        self.lock = threading.Lock()
+        self.initial = self.plane()
+
+    def plane(self, x_label=None, y_label=None):
+        '''The plane of x_label and y_label (by default the initial ones).'''
+        key = (x_label or self.x_label, y_label or self.y_label)
+        plane = self.planes.get(key)
+        if plane is None:
+            with self.lock:
+                plane = self.planes.get(key)
+                if plane is None:
+                    plane = GalaxyPlane(self.table[key[0]], self.table[key[1]],
+                                        self.limits('x', key[0]), self.limits('y', key[1]),
+                                        **self.options)
+                    self.planes.put(key, plane)
+        return plane
+
+    def extend(self):
+        '''
+        Extend the planes built so far to the rows appended to the table
+        (see PropertyTable.extend). Hovers running meanwhile keep using the
+        planes they got.
+        '''
+        with self.lock:
+            for key, plane in self.planes.items():
+                self.planes.put(key, plane.extended(self.table[key[0]], self.table[key[1]]))
+            self.initial = self.planes.get((self.x_label, self.y_label)) or self.initial.extended(
+                self.table[self.x_label], self.table[self.y_label])
+
+    def limits(self, axis, label):
+        '''xlim and ylim only apply to the initial columns.'''
+        if axis == 'x':
+            return self.xlim if label == self.x_label else None
+        return self.ylim if label == self.y_label else None
+
+    def update(self, patch, trigger, x_label, y_label, color_label, relayout_data=None, view=None):
+        '''
+        Fill a dash.Patch of the plane's figure after a change of trigger:
+        'x axis', 'y axis', 'color coding' (the dropdown menus of the
+        PropertyTable) or '2d-scatter' (the view of a decimated plane).
+
+        Only the changed column is sent, except for decimated planes, whose
+        subsample depends on both axes and the view.
+
+        view is what the previous update returned: the relayoutData of the
+        current axes, so that recoloring a decimated plane keeps its view.
+
+        Output
+        ------
+
+        Returns the view to pass to the next update.
+        '''
+        plane = self.plane(x_label, y_label)
+        axes = [x_label, y_label]
+        if view is None or view['axes'] != axes:
+            view = {'axes': axes, 'relayout': None}
+        color = self.table[color_label]
+
+        if trigger == '2d-scatter':
+            if not plane.decimated or not plane.is_view_change(relayout_data):
+                raise PreventUpdate
+            plane.patch(patch, color, relayout_data)
+            return {'axes': axes, 'relayout': relayout_data}
+
+        if trigger in ('x axis', 'y axis'):
+            axis, label = ('x', x_label) if trigger == 'x axis' else ('y', y_label)
+            layout_axis = patch['layout'][axis + 'axis']
+            layout_axis['title']['text'] = label
+            limits = self.limits(axis, label)
+            if limits is None:
+                layout_axis['autorange'] = True
+            else:
+                layout_axis['autorange'] = False
+                layout_axis['range'] = limits
+            if plane.decimated:
+                plane.patch(patch, color)
+            else:
+                patch['data'][0][axis] = self.table.encoded(label)
+            return view
+
+        if plane.decimated:
+            plane.patch(patch, color, view['relayout'], positions=False)
+        else:
+            patch['data'][0]['marker']['color'] = self.table.encoded(color_label)
+        plane.colorbar_title(patch, color_label)
+        return view
+
+    def redraw(self, patch, x_label, y_label, color_label, view=None):
+        '''
+        Fill a dash.Patch of the plane's figure with all the galaxies of the
+        columns shown, after rows were appended to the table. view is as in
+        update, so that decimated planes keep their view.
+        '''
+        plane = self.plane(x_label, y_label)
+        if plane.decimated:
+            relayout_data = None
+            if view is not None and view['axes'] == [x_label, y_label]:
+                relayout_data = view['relayout']
+            return plane.patch(patch, self.table[color_label], relayout_data)
+        trace = patch['data'][0]
+        trace['x'] = self.table.encoded(x_label)
+        trace['y'] = self.table.encoded(y_label)
+        trace['marker']['color'] = self.table.encoded(color_label)
+        return patch
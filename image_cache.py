@@ -0,0 +1,250 @@
+'''
+Colormapped, compressed image cutouts for dash_plot_images.
+
+Instead of sending every pixel of a cutout as a JSON float and colormapping
+it in the browser, cutouts are colormapped and encoded as PNG (or WebP)
+once, kept in memory and optionally on disk, and shown with go.Image.
+Large cutouts are also available at lower resolutions (a pyramid where
+every level halves the size), so the app can send only as many pixels as
+the plot shows.
+'''
+import base64
+import os
+import struct
+import zlib
+
+import numpy as np
+import plotly.colors
+from flask import Response, abort
+
+from cache_backends import fingerprint, write_file
+from figure_cache import LRUCache
+
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+
+def colormap_lut(cmap, n=256):
+    '''
+    Lookup table of a Plotly colorscale (a name like 'inferno' or
+    'Viridis_r', or a list of [value, color] pairs).
+
+    Output
+    ------
+
+    Returns a (n, 3) uint8 array of RGB colors.
+    '''
+    colorscale = plotly.colors.get_colorscale(cmap) if isinstance(cmap, str) else cmap
+    colors = plotly.colors.sample_colorscale(colorscale, list(np.linspace(0, 1, n)))
+    return np.array([plotly.colors.unlabel_rgb(color) for color in colors]).round().astype(np.uint8)
+
+
+def colorize(image, lut, zmin=None, zmax=None):
+    '''
+    Map a 2D image to RGB with a lookup table. The color range is the range
+    of the image (like px.imshow) unless zmin/zmax are given; non-finite
+    pixels get the lowest color.
+    '''
+    image = np.asarray(image, dtype=np.float64)
+    finite = np.isfinite(image)
+    if zmin is None:
+        zmin = image[finite].min() if finite.any() else 0.
+    if zmax is None:
+        zmax = image[finite].max() if finite.any() else 1.
+    scale = (len(lut) - 1) / (zmax - zmin) if zmax > zmin else 0.
+    level = np.clip(np.where(finite, (image - zmin) * scale, 0), 0, len(lut) - 1)
+    return lut[level.astype(np.intp)]
+
+
+def downscale(image, factor):
+    '''Average blocks of factor x factor pixels (the edges are cropped).'''
+    if factor == 1:
+        return image
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape(height, factor, width, factor, *image.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+
+def encode_png(rgb):
+    '''Encode an (height, width, 3) uint8 array as PNG bytes.'''
+    height, width = rgb.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # Every row starts with filter type 0 (None).
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8),
+                           np.ascontiguousarray(rgb, dtype=np.uint8).reshape(height, 3 * width)], axis=1)
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+def encode_webp(rgb, quality=90):
+    '''Encode an (height, width, 3) uint8 array as WebP bytes. Requires Pillow.'''
+    import io
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(rgb, dtype=np.uint8), 'RGB').save(buffer, 'WEBP', quality=quality)
+    return buffer.getvalue()
+
+
+class ImageCache:
+    '''
+    Encoded image cutouts, created on first use and cached.
+
+    Input
+    -----
+
+    images: List of 3D arrays (N_points, N_pixel, N_pixel)
+            The cutouts, as in dash_plot_images. Memory-mapped arrays work.
+
+    cmap: String. Default='inferno'
+          Plotly colorscale used for the cutouts.
+
+    image_format: String. Default='png'
+                  'png' or 'webp' (requires Pillow).
+
+    cache_size: Integer. Default=1024
+                Number of encoded cutouts kept in memory.
+
+    cache_dir: String. Default=None
+               Directory where encoded cutouts are also written, so that
+               they survive restarts and are shared by server processes.
+               They go in a subdirectory named after a fingerprint of the
+               images and the colorscale, so apps sharing cache_dir never
+               serve each other's cutouts.
+
+    min_size: Integer. Default=64
+              The pyramid stops halving the cutouts below this size.
+
+    levels: List of Integers. Default=None
+            The pyramid level used for every image (see level_for). Only
+            these are served by register_route and written to cache_dir.
+            None allows every level of the pyramid.
+    '''
+
+    def __init__(self, images, cmap='inferno', image_format='png', cache_size=1024,
+                 cache_dir=None, min_size=64, levels=None):
+        if image_format not in MIME_TYPES:
+            raise ValueError(f"image_format should be 'png' or 'webp', got {image_format}")
+        self.images = images
+        self.lut = colormap_lut(cmap)
+        self.image_format = image_format
+        self.cache = LRUCache(cache_size)
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            # Taken once: rows appended later (see ImagePanels.extend) leave
+            # the cutouts already written as they are.
+            self.cache_dir = os.path.join(cache_dir, fingerprint(dict(images=images, lut=self.lut))[:16])
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.min_size = min_size
+        self.levels = levels
+
+    def n_levels(self, i):
+        '''Number of resolutions of image i, level 0 being the full one.'''
+        size = min(self.images[i].shape[1:3])
+        levels = 1
+        while size // 2 >= self.min_size:
+            size //= 2
+            levels += 1
+        return levels
+
+    def level_for(self, i, display_size=None):
+        '''
+        Lowest resolution of image i that still has at least display_size
+        pixels along its longest side. None gives the full resolution.
+        '''
+        if display_size is None:
+            return 0
+        size = max(self.images[i].shape[1:3])
+        level = 0
+        while level + 1 < self.n_levels(i) and size // 2**(level + 1) >= display_size:
+            level += 1
+        return level
+
+    def has_level(self, i, level):
+        '''Whether level is one of the pyramid levels used for image i.'''
+        if self.levels is None:
+            return 0 <= level < self.n_levels(i)
+        return level == self.levels[i]
+
+    def encode(self, i, ind, level=0):
+        '''Colormap and encode cutout ind of image i at a pyramid level.'''
+        image = np.asarray(self.images[i][ind])
+        rgb = colorize(downscale(image, 2**level), self.lut)
+        if self.image_format == 'webp':
+            return encode_webp(rgb)
+        return encode_png(rgb)
+
+    def get(self, i, ind, level=0):
+        '''Encoded bytes of cutout ind of image i, from the cache if possible.'''
+        key = (i, int(ind), level)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        path = None
+        if self.cache_dir is not None and self.has_level(i, level):
+            path = os.path.join(self.cache_dir, f'{i}_{int(ind)}_{level}.{self.image_format}')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+        if data is None:
+            data = self.encode(i, ind, level)
+            if path is not None:
+                write_file(path, data)
+        self.cache.put(key, data)
+        return data
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.image_format]
+
+    def data_uri(self, i, ind, level=0):
+        '''The encoded cutout as a data URI, usable as go.Image(source=...).'''
+        return f'data:{self.mime_type};base64,' + base64.b64encode(self.get(i, ind, level)).decode()
+
+    def register_route(self, app, known=None):
+        '''
+        Serve the cutouts from the Flask server of app, so that the browser
+        can fetch and cache them as ordinary images.
+
+        Requests for images, levels (see has_level) or galaxies that don't
+        exist get a 404. known(ind), if given, says whether galaxy ind
+        exists instead of the length of the images, e.g. to check for rows
+        appended to the catalog first.
+
+        Output
+        ------
+
+        Returns the URL prefix of the cutouts, see url.
+        '''
+        rule = '_images/'
+
+        def serve(i, level, ind):
+            if i >= len(self.images) or not self.has_level(i, level):
+                abort(404)
+            if not (ind < len(self.images[i]) if known is None else known(ind)):
+                abort(404)
+            return Response(self.get(i, ind, level), mimetype=self.mime_type,
+                            headers={'Cache-Control': 'public, max-age=86400'})
+
+        app.server.add_url_rule(
+            app.config.routes_pathname_prefix + rule + f'<int:i>/<int:level>/<int:ind>.{self.image_format}',
+            endpoint='images', view_func=serve)
+        return app.config.requests_pathname_prefix + rule
+
+    def url_parts(self, prefix, i, level=0):
+        '''
+        The URL of cutout ind of image i served by register_route is
+        start + str(ind) + end; returns (start, end).
+        '''
+        return f'{prefix}{i}/{level}/', f'.{self.image_format}'
+
+    def url(self, prefix, i, ind, level=0):
+        '''URL of a cutout served by register_route.'''
+        start, end = self.url_parts(prefix, i, level)
+        return f'{start}{int(ind)}{end}'
@@ -0,0 +1,103 @@
+'''
+The image plots of the apps (see dash_app.py).
+
+ImagePanels builds the figures of the cutouts of a catalog once and the
+updates sent when a galaxy is hovered: the pixel values (as float32), or
+with image_format the colormapped cutouts of image_cache.py, embedded or as
+URLs served by the app.
+'''
+import plotly.graph_objects as go
+from dash import Patch
+
+from encoding import typed_array
+from image_cache import ImageCache
+
+
+class ImagePanels:
+    '''
+    The image plots of a catalog.
+
+    Input
+    -----
+
+    images, image_labels, cmap_images, image_format, image_size,
+    image_cache_dir: The arguments of dash_plot_images with the same names.
+    '''
+
+    def __init__(self, images, image_labels, cmap_images='inferno', image_format=None,
+                 image_size=None, image_cache_dir=None):
+        self.images = images
+        self.graph_ids = list(image_labels)
+        self.cmap_images = cmap_images
+        self.image_format = image_format
+        self.image_cache = None
+        self.url_prefix = None
+        if image_format is not None:
+            self.image_cache = ImageCache(images, cmap_images, image_format, cache_dir=image_cache_dir)
+            self.levels = [self.image_cache.level_for(i, image_size) for i in range(len(images))]
+            self.image_cache.levels = self.levels
+
+    def extend(self, images):
+        '''Use images with rows appended, e.g. from a catalog that grew.'''
+        if self.image_cache is not None:
+            self.image_cache.images = images
+        self.images = images
+
+    def register_route(self, app, known=None):
+        '''
+        Serve the encoded cutouts from app and point the images to their
+        URLs, so the browser caches them (image_format only). known is as
+        in ImageCache.register_route.
+        '''
+        if self.image_cache is not None:
+            self.url_prefix = self.image_cache.register_route(app, known)
+
+    def source(self, i, ind):
+        if self.url_prefix is None:
+            return self.image_cache.data_uri(i, ind, self.levels[i])
+        return self.image_cache.url(self.url_prefix, i, ind, self.levels[i])
+
+    def sources(self):
+        '''
+        (start, end) of the URL of the cutouts of every image, see
+        ImageCache.url_parts. None unless they are served by the app.
+        '''
+        if self.url_prefix is None:
+            return None
+        return [self.image_cache.url_parts(self.url_prefix, i, self.levels[i]) for i in range(len(self.images))]
+
+    def figures(self, ind):
+        # plotly.express takes a while to import and is only needed here.
+        import plotly.express as px
+
+        figs = []
+        for i in range(len(self.images)):
+            if self.image_format is None:
+                fig = px.imshow(self.images[i][ind, :, :], color_continuous_scale=self.cmap_images)
+            else:
+                # Lower resolution levels are stretched back to the size of
+                # the full cutout, so the axes don't depend on the level.
+                level = self.levels[i]
+                fig = go.Figure(go.Image(source=self.source(i, ind), dx=2**level, dy=2**level))
+            figs.append(fig)
+        return figs
+
+    def patches(self, ind):
+        patches = []
+        for i in range(len(self.images)):
+            patch = Patch()
+            if self.image_format is None:
+                patch['data'][0]['z'] = typed_array(self.images[i][ind, :, :])
+            else:
+                patch['data'][0]['source'] = self.source(i, ind)
+            patches.append(patch)
+        return patches
+
+    def arrays(self, ind):
+        '''
+        The pixels of every cutout of galaxy ind for the clientside payload,
+        none when the cutouts are encoded (they are fetched by URL).
+        '''
+        if self.image_format is not None:
+            return []
+        return [self.images[i][ind, :, :] for i in range(len(self.images))]
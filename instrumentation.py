@@ -0,0 +1,110 @@
+'''
+Opt-in timing of the callbacks and data routes of an app.
+
+instrument_app wraps every Dash callback and every binary/image route of an
+app so that each call records its wall time and the size of its response.
+The numbers are logged (logger 'dash_spectra.timing', at INFO level) and
+kept in app.callback_stats for summaries, so slow callbacks or growing
+payloads show up in production logs.
+'''
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from dash.exceptions import PreventUpdate
+
+logger = logging.getLogger('dash_spectra.timing')
+
+
+class CallbackStats:
+    '''
+    The last maxlen (seconds, n_bytes) measurements of every callback.
+    '''
+
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.records = defaultdict(lambda: deque(maxlen=self.maxlen))
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, n_bytes):
+        with self.lock:
+            self.records[name].append((seconds, n_bytes))
+
+    def summary(self):
+        '''
+        Returns {name: {'calls', 'p50_ms', 'p99_ms', 'max_ms', 'mean_bytes'}}.
+        Calls stopped with PreventUpdate count as 0 bytes.
+        '''
+        with self.lock:
+            records = {name: np.array(values, dtype=float) for name, values in self.records.items()}
+        summary = {}
+        for name, values in records.items():
+            p50, p99 = np.percentile(values[:, 0], [50, 99]) * 1e3
+            summary[name] = {'calls': len(values), 'p50_ms': float(p50), 'p99_ms': float(p99),
+                             'max_ms': float(values[:, 0].max() * 1e3),
+                             'mean_bytes': float(values[:, 1].mean())}
+        return summary
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+
+def _timed(func, name, stats, log):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except PreventUpdate:
+            stats.record(name, time.perf_counter() - start, 0)
+            raise
+        seconds = time.perf_counter() - start
+        # Callbacks return JSON strings and routes Flask responses.
+        n_bytes = response.content_length if hasattr(response, 'content_length') else len(response)
+        stats.record(name, seconds, n_bytes or 0)
+        if log:
+            logger.info('%s %.2f ms %d bytes', name, seconds * 1e3, n_bytes or 0)
+        return response
+    return timed
+
+
+def instrument_app(app, log=True, maxlen=10000):
+    '''
+    Time every callback and data route of app, which must have all its
+    callbacks registered already.
+
+    Input
+    -----
+
+    app: Dash app
+
+    log: Boolean. Default=True
+         Log every call. The measurements are kept in app.callback_stats
+         either way.
+
+    maxlen: Integer. Default=10000
+            Number of measurements kept per callback.
+
+    Output
+    ------
+
+    Returns the CallbackStats, also set as app.callback_stats.
+    '''
+    stats = CallbackStats(maxlen)
+    # Dash looks callbacks up in callback_map on every request, so
+    # replacing the entry is enough.
+    for callback in app.callback_map.values():
+        if 'callback' not in callback:
+            # Clientside callbacks run in the browser.
+            continue
+        name = callback['callback'].__name__
+        callback['callback'] = _timed(callback['callback'], name, stats, log)
+    for endpoint, view in list(app.server.view_functions.items()):
+        if endpoint == 'images' or endpoint.startswith('binary_'):
+            app.server.view_functions[endpoint] = _timed(view, endpoint, stats, log)
+    app.callback_stats = stats
+    return stats
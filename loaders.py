@@ -0,0 +1,289 @@
+'''
+Streaming conversion of survey files into the catalog layout of catalog.py.
+
+The loaders read a chunk of objects at a time and write it straight into the
+memory-mapped arrays of the catalog, so the memory they need depends on the
+chunk size and not on the size of the survey. x, y, color_code and
+metadata columns and the spectra are all written in the same pass.
+
+The catalog can then be served with serve.py, or loaded with
+catalog.load_catalog and passed to dash_plot_spectra.
+
+Columns are chosen with dictionaries {label: name}, where label is shown in
+the app and name is the column (or dataset) in the input files, e.g.
+x={'log mass': 'LOGM'}.
+
+Requires astropy (FITS), h5py (HDF5) or pyarrow (Parquet), imported only by
+the loader that needs them.
+'''
+import numpy as np
+
+from catalog import CatalogWriter
+from spectra_store import QUANTIZED_DTYPES
+
+
+def write_catalog(path, n_points, chunks, x, y, color_code=None, spectra=(), wavelength=(),
+                  images=(), metadata=(), app='spectra', spectra_dtype=np.float32, **kwargs):
+    '''
+    Write a catalog from chunks of consecutive objects.
+
+    Input
+    -----
+
+    path: String
+          Directory of the catalog.
+
+    n_points: Integer
+              Total number of objects.
+
+    chunks: Iterable of Python dictionaries
+            {name: array} holding the rows of the next objects for every
+            column, spectrum and image name used below.
+
+    x, y, color_code: Python dictionaries {label: name}
+                      Columns of the 2D plane and of the color coding.
+
+    spectra: List of names
+             2D (N_chunk, N_features) arrays of spectra.
+
+    wavelength: List of 1D arrays
+                Wavelength grid of every element of spectra.
+
+    images: List of names
+            3D (N_chunk, N_pixel, N_pixel) arrays of images (app='images').
+
+    metadata: List of names or dictionary {label: name}
+              Columns stored with the catalog but not shown, e.g. ids. See
+              catalog.load_metadata.
+
+    app: String. Default='spectra'
+         'spectra' or 'images'.
+
+    spectra_dtype: Numpy dtype. Default=np.float32
+                   Type the spectra and images are stored as. np.int16 or
+                   np.float16 quantize the spectra (see
+                   spectra_store.quantize_spectra); images are then stored
+                   as float32.
+
+    **kwargs: Other arguments of the app, stored as they are (e.g. zoom
+              windows or spec_names).
+
+    Output
+    ------
+
+    Returns path.
+    '''
+    if not isinstance(metadata, dict):
+        metadata = {name: name for name in metadata}
+    columns = [('x', x), ('y', y), ('color_code', color_code or {})]
+    images_dtype = np.float32 if np.dtype(spectra_dtype) in QUANTIZED_DTYPES else spectra_dtype
+
+    writer = CatalogWriter(path, n_points, app)
+    outputs = None
+    start = 0
+    for chunk in chunks:
+        if outputs is None:
+            # Shapes and types are taken from the first chunk.
+            outputs = [(writer.column(key, label, np.asarray(chunk[name]).dtype), name)
+                       for key, labels in columns for label, name in labels.items()]
+            outputs += [(writer.metadata_column(label, np.asarray(chunk[name]).dtype), name)
+                        for label, name in metadata.items()]
+            outputs += [(writer.spectra(np.shape(chunk[name])[1], wavelength[i], spectra_dtype), name)
+                        for i, name in enumerate(spectra)]
+            outputs += [(writer.images(np.shape(chunk[name])[1:], images_dtype), name)
+                        for name in images]
+
+        n = len(chunk[outputs[0][1]])
+        if start + n > n_points:
+            raise ValueError(f'More than the expected {n_points} objects')
+        for array, name in outputs:
+            array[start:start + n] = chunk[name]
+        start += n
+
+    if start != n_points:
+        raise ValueError(f'Expected {n_points} objects, got {start}')
+    for key, value in kwargs.items():
+        writer.set(key, value)
+    writer.close()
+    return path
+
+
+def _names(*groups):
+    names = []
+    for group in groups:
+        values = group.values() if isinstance(group, dict) else group
+        names += [name for name in values if name not in names]
+    return names
+
+
+def load_desi_coadds(paths, path, x, y, color_code=None, bands=('B', 'R', 'Z'), metadata=('TARGETID',),
+                     redrock_paths=None, chunk_size=1024, **kwargs):
+    '''
+    Convert DESI coadd FITS files (one per healpix or tile) into a catalog.
+
+    Input
+    -----
+
+    paths: List of strings
+           The coadd files.
+
+    path: String
+          Directory of the catalog.
+
+    x, y, color_code, metadata: See write_catalog. The names are columns of
+                                the FIBERMAP table, or of the REDSHIFTS table
+                                of the matching redrock files.
+
+    bands: Tuple of strings. Default=('B', 'R', 'Z')
+           Spectrograph arms; every arm becomes one spectrum with its own
+           wavelength grid.
+
+    redrock_paths: List of strings. Default=None
+                   Redrock files matching paths (same objects in the same
+                   order), for columns like Z.
+
+    chunk_size: Integer. Default=1024
+                Number of objects read at once.
+
+    **kwargs: Other arguments of dash_plot_spectra, see write_catalog.
+
+    Output
+    ------
+
+    Returns path.
+    '''
+    from astropy.io import fits
+
+    names = _names(x, y, color_code or {}, metadata)
+    n_points = sum(fits.getheader(coadd, 'FIBERMAP')['NAXIS2'] for coadd in paths)
+    wavelength = [fits.getdata(paths[0], f'{band}_WAVELENGTH') for band in bands]
+
+    def chunks():
+        for k, coadd in enumerate(paths):
+            with fits.open(coadd, memmap=True) as hdus:
+                tables = [hdus['FIBERMAP'].data]
+                redrock = None
+                if redrock_paths is not None:
+                    redrock = fits.open(redrock_paths[k], memmap=True)
+                    tables.append(redrock['REDSHIFTS'].data)
+                try:
+                    for start in range(0, len(tables[0]), chunk_size):
+                        stop = start + chunk_size
+                        chunk = {}
+                        for name in names:
+                            table = next(t for t in tables if name in t.columns.names)
+                            chunk[name] = np.asarray(table[name][start:stop])
+                        for band in bands:
+                            # .section only reads the rows of the chunk.
+                            chunk[f'{band}_FLUX'] = hdus[f'{band}_FLUX'].section[start:stop]
+                        yield chunk
+                finally:
+                    if redrock is not None:
+                        redrock.close()
+
+    kwargs.setdefault('spec_names', list(bands))
+    kwargs.setdefault('spec_colors', ['blue', 'red', 'gray'][:len(bands)])
+    return write_catalog(path, n_points, chunks(), x, y, color_code,
+                         spectra=[f'{band}_FLUX' for band in bands], wavelength=wavelength,
+                         metadata=metadata, **kwargs)
+
+
+def load_hdf5(source, path, x, y, color_code=None, spectra=('flux',), wavelength=('wavelength',),
+              metadata=(), chunk_size=4096, **kwargs):
+    '''
+    Convert an HDF5 file with one dataset per column into a catalog.
+
+    Input
+    -----
+
+    source: String
+            The HDF5 file.
+
+    path: String
+          Directory of the catalog.
+
+    x, y, color_code, metadata: See write_catalog. The names are datasets
+                                of length N_points.
+
+    spectra: List of strings. Default=('flux',)
+             Datasets (N_points, N_features) of spectra.
+
+    wavelength: List of strings or 1D arrays. Default=('wavelength',)
+                Datasets (or arrays) of the wavelength grids.
+
+    chunk_size: Integer. Default=4096
+                Number of objects read at once.
+
+    **kwargs: Other arguments of dash_plot_spectra, see write_catalog.
+
+    Output
+    ------
+
+    Returns path.
+    '''
+    import h5py
+
+    names = _names(x, y, color_code or {}, metadata, spectra)
+    with h5py.File(source, 'r') as f:
+        n_points = len(f[names[0]])
+        wavelength = [f[grid][()] if isinstance(grid, str) else grid for grid in wavelength]
+
+        def chunks():
+            for start in range(0, n_points, chunk_size):
+                yield {name: f[name][start:start + chunk_size] for name in names}
+
+        return write_catalog(path, n_points, chunks(), x, y, color_code, spectra=spectra,
+                             wavelength=wavelength, metadata=metadata, **kwargs)
+
+
+def load_parquet(source, path, x, y, color_code=None, spectra=(), wavelength=(), metadata=(),
+                 chunk_size=4096, **kwargs):
+    '''
+    Convert a Parquet file (or dataset directory) into a catalog.
+
+    Input
+    -----
+
+    source: String
+            The Parquet file.
+
+    path: String
+          Directory of the catalog.
+
+    x, y, color_code, metadata: See write_catalog. The names are columns.
+
+    spectra: List of strings. Default=()
+             List columns holding one spectrum per row, all of the same
+             length.
+
+    wavelength: List of 1D arrays. Default=()
+                Wavelength grid of every element of spectra.
+
+    chunk_size: Integer. Default=4096
+                Number of rows read at once.
+
+    **kwargs: Other arguments of dash_plot_spectra, see write_catalog.
+
+    Output
+    ------
+
+    Returns path.
+    '''
+    import pyarrow.parquet as pq
+
+    names = _names(x, y, color_code or {}, metadata, spectra)
+    parquet = pq.ParquetFile(source)
+
+    def chunks():
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=names):
+            chunk = {}
+            for name in names:
+                column = batch.column(name)
+                if name in spectra:
+                    chunk[name] = column.flatten().to_numpy(zero_copy_only=False).reshape(len(column), -1)
+                else:
+                    chunk[name] = column.to_numpy(zero_copy_only=False)
+            yield chunk
+
+    return write_catalog(path, parquet.metadata.num_rows, chunks(), x, y, color_code,
+                         spectra=spectra, wavelength=wavelength, metadata=metadata, **kwargs)
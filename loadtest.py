@@ -0,0 +1,254 @@
+'''
+Load test of a served app with many users hovering at the same time.
+
+Every simulated user sweeps the cursor across the 2D plane along random
+straight lines, hovering over the galaxies on the way one after the other
+(as Plotly sends a hover event whenever the nearest point changes), and
+waits for every update before sending the next one. The hovers are sent
+over HTTP exactly like the browser does: to the hover callback, or in
+clientside mode to the binary data route. The script reports the
+throughput and the latency percentiles over all users.
+
+Against a running server, e.g. serve.py with several workers and a shared
+cache (the catalog is read for the positions of the galaxies):
+
+    python serve.py sdss_catalog --workers 8 --cache redis://localhost:6379/0
+    python loadtest.py --url http://127.0.0.1:8050 --catalog sdss_catalog --users 32
+
+Without --url the app of --catalog (or of a random catalog, see
+benchmark.py) is built and served by this process with one thread per
+request, which measures a single process:
+
+    python loadtest.py --points 100000 --users 8 --duration 20
+'''
+import argparse
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from spatial_index import GridIndex
+
+
+def sweep_paths(x, y, n_paths, steps=200, seed=0):
+    '''
+    Indices of the galaxies hovered along n_paths random straight sweeps
+    across the 2D plane (between the 1st and 99th percentiles of x and y),
+    each sampled at steps positions, without hovering a galaxy twice in a
+    row.
+    '''
+    rng = np.random.default_rng(seed)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x_range = np.percentile(x[finite], [1, 99])
+    y_range = np.percentile(y[finite], [1, 99])
+    index = GridIndex(x, y)
+    paths = []
+    for _ in range(n_paths):
+        start, stop = rng.uniform(size=2), rng.uniform(size=2)
+        t = np.linspace(0, 1, steps)
+        u = x_range[0] + (x_range[1] - x_range[0]) * (start[0] + (stop[0] - start[0]) * t)
+        v = y_range[0] + (y_range[1] - y_range[0]) * (start[1] + (stop[1] - start[1]) * t)
+        hovered = np.asarray(index.nearest_many(u, v))
+        paths.append(hovered[np.r_[True, hovered[1:] != hovered[:-1]]])
+    return paths
+
+
+class HoverClient:
+    '''
+    Sends the hovers of one simulated user to an app, over a persistent
+    HTTP connection.
+
+    The request is found from the callbacks of the app: the hover callback
+    (directly or through the debounced hover-point store, in which case
+    every hover gets the next sequence number of this user's session) or,
+    in clientside mode, the binary data route.
+    '''
+
+    def __init__(self, url, session):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip('/') + '/'
+        self.session = session
+        self.seq = 0
+        self.connection = http.client.HTTPConnection(self.host, timeout=60)
+        self.callback = None
+
+        dependencies = self.get_json('_dash-dependencies')
+        for callback in dependencies:
+            inputs = [f"{i['id']}.{i['property']}" for i in callback['inputs']]
+            if not callback.get('clientside_function') and (
+                    '2d-scatter.hoverData' in inputs or 'hover-point.data' in inputs):
+                self.callback = callback
+                self.hover_input = inputs[0]
+        if self.callback is not None:
+            # Every other input and state keeps its initial value.
+            self.initial = {}
+            stack = [self.get_json('_dash-layout')]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, list):
+                    stack.extend(node)
+                elif isinstance(node, dict) and 'props' in node:
+                    props = node['props']
+                    for prop in ('value', 'data'):
+                        if isinstance(props.get('id'), str) and prop in props:
+                            self.initial[f"{props['id']}.{prop}"] = props[prop]
+                    stack.append(props.get('children'))
+
+    def request(self, method, path, body=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, self.prefix + path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.status not in (200, 204):
+            raise RuntimeError(f'{method} {path} failed with status {response.status}')
+        return data
+
+    def get_json(self, path):
+        return json.loads(self.request('GET', path))
+
+    def hover(self, ind):
+        '''Send the hover of galaxy ind and wait for the response.'''
+        if self.callback is None:
+            return self.request('GET', f'_binary/panels/{int(ind)}')
+
+        # customdata points to the galaxy in every kind of plane.
+        point = {'curveNumber': 0, 'pointIndex': int(ind), 'pointNumber': int(ind),
+                 'customdata': int(ind)}
+        value = {'points': [point]}
+        if self.hover_input == 'hover-point.data':
+            self.seq += 1
+            value = {'hoverData': value, 'seq': self.seq, 'session': self.session}
+        values = dict(self.initial, **{self.hover_input: value})
+        callback = self.callback
+        outputs = [dict(zip(('id', 'property'), output.rsplit('.', 1)))
+                   for output in callback['output'].strip('.').split('...')]
+        body = {'output': callback['output'], 'outputs': outputs if len(outputs) > 1 else outputs[0],
+                'changedPropIds': [self.hover_input],
+                'inputs': [dict(i, value=values.get(f"{i['id']}.{i['property']}")) for i in callback['inputs']],
+                'state': [dict(i, value=values.get(f"{i['id']}.{i['property']}")) for i in callback['state']]}
+        return self.request('POST', '_dash-update-component', json.dumps(body))
+
+
+def load_test(url, paths, users=8, duration=30., interval=0.):
+    '''
+    Hover along paths with users concurrent users for duration seconds.
+
+    Every user starts on a different path and moves on to the next one at
+    the end of each. interval is the time in seconds a user waits between
+    receiving an update and hovering the next galaxy (0 hovers as fast as
+    the server answers).
+
+    Output
+    ------
+
+    Returns a Python dictionary with the number of 'hovers', 'errors', the
+    'throughput' (hovers per second), the latency percentiles 'p50_ms',
+    'p95_ms', 'p99_ms' and 'max_ms', and the mean response 'bytes'.
+    '''
+    latencies, sizes, errors = [], [], []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def user(k):
+        client = HoverClient(url, session=f'loadtest-{k}')
+        times, sent, failed = [], [], 0
+        path = k
+        while time.perf_counter() - start < duration:
+            for ind in paths[path % len(paths)]:
+                if time.perf_counter() - start >= duration:
+                    break
+                began = time.perf_counter()
+                try:
+                    sent.append(len(client.hover(ind)))
+                    times.append(time.perf_counter() - began)
+                except (OSError, RuntimeError, http.client.HTTPException):
+                    failed += 1
+                    client.connection.close()
+                if interval:
+                    time.sleep(interval)
+            path += users
+        with lock:
+            latencies.extend(times)
+            sizes.extend(sent)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=user, args=(k,)) for k in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1e3
+    p50, p95, p99, peak = np.percentile(latencies, [50, 95, 99, 100]) if len(latencies) else [np.nan] * 4
+    return {'hovers': len(latencies), 'errors': sum(errors), 'throughput': len(latencies) / elapsed,
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(peak),
+            'bytes': float(np.mean(sizes)) if sizes else 0.}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of a served app with concurrent hovering users.')
+    parser.add_argument('--url', default=None, help='running app; by default one is served by this process')
+    parser.add_argument('--catalog', default=None, help='directory saved with catalog.save_catalog')
+    parser.add_argument('--points', type=int, default=100000, help='galaxies of the random catalog')
+    parser.add_argument('--features', type=int, default=4000, help='wavelength points of the random catalog')
+    parser.add_argument('--clientside', action='store_true', help='random catalog in clientside mode')
+    parser.add_argument('--cache', default=None, help='shared cache of the app served by this process')
+    parser.add_argument('--users', type=int, nargs='+', default=[8])
+    parser.add_argument('--duration', type=float, default=30., help='seconds per number of users')
+    parser.add_argument('--interval', type=float, default=0., help='ms between the hovers of a user')
+    parser.add_argument('--paths', type=int, default=64)
+    args = parser.parse_args()
+
+    if args.catalog is not None:
+        from catalog import load_catalog
+
+        _, kwargs = load_catalog(args.catalog)
+    else:
+        from benchmark import synthetic_spectra
+
+        kwargs = synthetic_spectra(args.points, args.features)
+    x, y = [np.asarray(next(iter(kwargs[axis].values()))) for axis in ('x', 'y')]
+    paths = sweep_paths(x, y, args.paths)
+
+    app, server = None, None
+    url = args.url
+    if url is None:
+        import logging
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        if args.catalog is not None:
+            from serve import create_app
+
+            app = create_app(args.catalog, cache=args.cache)
+        else:
+            from dash_script import dash_plot_spectra
+
+            app = dash_plot_spectra(**kwargs, clientside=args.clientside, cache=args.cache)
+        server = make_server('127.0.0.1', 0, app.server, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/'
+
+    print(f"{'users':>6}{'hovers':>10}{'errors':>8}{'hovers/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'bytes':>10}")
+    for users in args.users:
+        result = load_test(url, paths, users, args.duration, args.interval / 1e3)
+        print(f"{users:>6}{result['hovers']:>10}{result['errors']:>8}{result['throughput']:>10.1f}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['max_ms']:>10.2f}{result['bytes']:>10.0f}")
+    if app is not None and hasattr(app, 'figure_cache'):
+        print('figure cache:', app.figure_cache.info())
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
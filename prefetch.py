@@ -0,0 +1,85 @@
+'''
+Background prefetching for the hover callbacks.
+
+The cursor moves continuously over the 2D plane, so the next hovered galaxy
+is almost always a close neighbour of the current one. After a hover,
+Prefetcher builds (and caches) the updates of the nearest neighbours of
+the hovered galaxy in a thread pool, so that the next hover is served from
+the cache instead of reading spectra and building figures.
+
+Every browser window hovers on its own, so the latest hover is kept per
+session (as in throttle.HoverCoalescer): prefetching for one user only
+stops when that user moves on, not when someone else hovers.
+'''
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    '''
+    Warm a cache for the neighbours of hovered points in background threads.
+
+    Input
+    -----
+
+    warm: Function warm(ind)
+          Builds and caches everything a hover of galaxy ind needs. Should
+          return quickly if it is cached already.
+
+    neighbours: Function neighbours(ind, *args)
+                Indices of the galaxies to prefetch after a hover of ind,
+                closest first. args are those passed to after.
+
+    workers: Integer. Default=2
+             Number of prefetching threads.
+
+    max_sessions: Integer. Default=10000
+                  Number of sessions whose latest hover is remembered; the
+                  least recently active ones are forgotten first.
+    '''
+
+    def __init__(self, warm, neighbours, workers=2, max_sessions=10000):
+        self.warm = warm
+        self.neighbours = neighbours
+        self.max_sessions = max_sessions
+        self.latest = OrderedDict()
+        self.lock = threading.Lock()
+        # Threads are only started on the first hover, so an app built
+        # before the server forks its workers is safe to share.
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='prefetch')
+
+    def after(self, ind, *args, session=None):
+        '''
+        Prefetch the neighbours of ind, which has just been hovered in
+        session (e.g. the session id of a browser window; hovers without
+        one share a session). args are passed on to neighbours (e.g. the
+        plane that was hovered).
+        '''
+        with self.lock:
+            if session in self.latest and self.latest[session] == ind:
+                return
+            self.latest[session] = ind
+            self.latest.move_to_end(session)
+            if len(self.latest) > self.max_sessions:
+                self.latest.popitem(last=False)
+        self.executor.submit(self._prefetch, ind, args, session)
+
+    def _prefetch(self, ind, args, session):
+        try:
+            for neighbour in self.neighbours(ind, *args):
+                # Stop once the cursor of the session has moved on (or the
+                # session was forgotten), the neighbours of the new point
+                # are more useful.
+                if self.latest.get(session) != ind:
+                    return
+                if neighbour != ind:
+                    self.warm(int(neighbour))
+        except Exception:
+            logger.exception('Prefetching the neighbours of %d failed', ind)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
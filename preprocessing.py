@@ -0,0 +1,76 @@
+'''
+Per-object quantities that dash_plot_spectra would otherwise compute on
+every hover, precomputed for the whole catalog in vectorized passes.
+'''
+import warnings
+
+import numpy as np
+
+from spectra_store import as_spectra_store
+
+
+def flux_ranges(spectra, percentiles=(0.5, 99.5), padding=0.05, wavelength=None,
+                centers=None, windows=None, chunk_size=4096):
+    '''
+    Robust y-axis range of every spectrum, from percentiles of its flux so
+    that single bad pixels or sky residuals don't squash the plot.
+
+    Input
+    -----
+
+    spectra: 2D array (N_points, N_features), SpectraStore or path
+             The spectra (see spectra_store.py).
+
+    percentiles: tuple (low, high). Default=(0.5, 99.5)
+                 Percentiles of the flux used as the bottom and top of the
+                 range.
+
+    padding: Float. Default=0.05
+             Fraction of the range added below and above it.
+
+    wavelength: 1D array (N_features). Default=None
+    centers: 1D array (N_points). Default=None
+    windows: Float. Default=None
+             If all three are given, only the flux with
+             |wavelength - centers[ind]| <= windows is used for object ind,
+             i.e. the range of a zoom plot.
+
+    chunk_size: Integer. Default=4096
+                Number of spectra processed at once.
+
+    Output
+    ------
+
+    Returns (y_min, y_max), two 1D float32 arrays (N_points). Objects
+    without any finite flux get NaN.
+    '''
+    spectra = as_spectra_store(spectra)
+    y_min = np.empty(len(spectra), dtype=np.float32)
+    y_max = np.empty(len(spectra), dtype=np.float32)
+    if centers is not None:
+        wavelength = np.asarray(wavelength, dtype=float)
+        centers = np.asarray(centers, dtype=float)
+
+    for start, block in spectra.iter_chunks(chunk_size):
+        block = np.array(block, dtype=np.float32)
+        if centers is not None:
+            outside = np.abs(wavelength - centers[start:start + len(block), None]) > windows
+            block[outside] = np.nan
+        with warnings.catch_warnings():
+            # All-NaN rows give NaN, the warning about them isn't useful here.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, high = np.nanpercentile(block, percentiles, axis=1)
+        pad = padding * (high - low)
+        y_min[start:start + len(block)] = low - pad
+        y_max[start:start + len(block)] = high + pad
+
+    return y_min, y_max
+
+
+def format_zoom_title(zoom_extras, ind, fmt='%.2f'):
+    '''
+    Title of a zoom plot for object ind: "<key> <value> <br>" for every key
+    of zoom_extras (one element of the zoom_extras argument of
+    dash_plot_spectra). Cheap enough to format on every hover.
+    '''
+    return ''.join(f'{key} {fmt % values[ind]} <br>' for key, values in zoom_extras.items())
@@ -0,0 +1,126 @@
+'''
+The galaxy properties that can be shown on the axes and in the color coding
+of the 2D plane.
+
+Properties come from the x, y and color_code dictionaries of the apps and
+from an optional columnar table (a dictionary of arrays, a pandas DataFrame
+or a pyarrow Table). Every column is encoded for the browser once, the
+first time it is shown, so switching between properties only sends the
+one column that changed (see encoding.py).
+'''
+import threading
+
+import numpy as np
+from dash import dcc, html
+
+from encoding import typed_array
+
+
+def table_columns(table):
+    '''
+    The numeric columns of a dictionary of arrays, pandas DataFrame or
+    pyarrow Table, as a dictionary {name: 1D array}.
+    '''
+    if table is None:
+        return {}
+    if hasattr(table, 'column_names'):
+        # pyarrow Table
+        columns = {name: table.column(name).to_numpy() for name in table.column_names}
+    elif hasattr(table, 'items'):
+        # Dictionary or pandas DataFrame
+        columns = {str(name): np.asarray(values) for name, values in table.items()}
+    else:
+        raise TypeError(f'Unsupported property table: {type(table)}')
+    return {name: values for name, values in columns.items()
+            if values.ndim == 1 and (np.issubdtype(values.dtype, np.number) or values.dtype == bool)}
+
+
+def _columns(x, y, color_code, extra):
+    columns = {}
+    for group in (x, y, color_code or {}, extra):
+        for label, values in group.items():
+            columns.setdefault(label, np.asarray(values))
+    return columns
+
+
+class PropertyTable:
+    '''
+    Columns that can be shown on the axes and in the color coding.
+
+    Input
+    -----
+
+    x, y, color_code: Python dictionaries
+                      As in dash_plot_spectra. Their keys are the choices
+                      for the x axis, the y axis and the color coding.
+
+    properties: Dictionary of arrays, pandas DataFrame or pyarrow Table.
+                Default=None
+                Further columns, offered for all three.
+    '''
+
+    def __init__(self, x, y, color_code=None, properties=None):
+        extra = table_columns(properties)
+        self.columns = _columns(x, y, color_code, extra)
+        self.x_labels = list(x) + [label for label in extra if label not in x]
+        self.y_labels = list(y) + [label for label in extra if label not in y]
+        color_code = color_code or {}
+        self.color_labels = list(color_code) + [label for label in extra if label not in color_code]
+        if not self.color_labels:
+            self.columns['same for all'] = np.ones(len(self.columns[self.x_labels[0]]))
+            self.color_labels = ['same for all']
+        self.encoded_columns = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, label):
+        return self.columns[label]
+
+    def __len__(self):
+        return len(self.columns[self.x_labels[0]])
+
+    def extend(self, x, y, color_code=None, properties=None):
+        '''
+        Use the columns of x, y, color_code and properties with rows appended,
+        e.g. from a catalog that grew (see catalog.append_catalog). They have
+        to hold the current columns, with their rows unchanged; encoded
+        columns are encoded again when next shown.
+        '''
+        columns = _columns(x, y, color_code, table_columns(properties))
+        if 'same for all' in self.color_labels:
+            columns.setdefault('same for all', np.ones(len(columns[self.x_labels[0]])))
+        missing = [label for label in self.columns if label not in columns]
+        if missing:
+            raise ValueError(f'The extended table is missing the columns {missing}')
+        with self.lock:
+            self.columns = {label: columns[label] for label in self.columns}
+            self.encoded_columns = {}
+
+    def encoded(self, label):
+        '''The column as a float32 typed array spec, encoded once.'''
+        with self.lock:
+            if label not in self.encoded_columns:
+                self.encoded_columns[label] = typed_array(self.columns[label])
+            return self.encoded_columns[label]
+
+    def dropdowns(self, x_label=None, y_label=None, color_label=None, shown=()):
+        '''
+        Dropdown menus for the x axis ('x axis'), the y axis ('y axis') and
+        the color coding ('color coding'). Menus with a single choice are
+        hidden, unless their id is in shown.
+        '''
+        menus = []
+        for menu_id, labels, value in [('x axis', self.x_labels, x_label),
+                                       ('y axis', self.y_labels, y_label),
+                                       ('color coding', self.color_labels, color_label)]:
+            style = {'width': '30%', 'display': 'inline-block', 'backgroundColor': '#2a2a2a'}
+            if len(labels) < 2 and menu_id not in shown:
+                style['display'] = 'none'
+            menus.append(dcc.Dropdown(
+                options=[{'label': html.Span(label, style={'color': 'white'}), 'value': label}
+                         for label in labels],
+                value=value or labels[0],
+                id=menu_id,
+                clearable=False,
+                style=style
+            ))
+        return html.Div(menus)
@@ -0,0 +1,153 @@
+'''
+Production server for a catalog saved with catalog.save_catalog.
+
+The catalog is memory-mapped and the app is built once, in the master
+process; the worker processes are forked from it and share its memory,
+including the arrays of the catalog, so adding workers doesn't add copies
+of the data.
+
+From the command line (runs gunicorn if it is installed):
+
+    python serve.py sdss_catalog --workers 4 --port 8050 --shm
+
+Or with any WSGI server, as long as the app is loaded before forking:
+
+    DASH_SPECTRA_CATALOG=sdss_catalog gunicorn --preload -w 4 "serve:create_server()"
+
+With --figure-store (DASH_SPECTRA_FIGURE_STORE) the hover updates are read
+from a store precomputed with figure_store.py. With --cache
+(DASH_SPECTRA_CACHE), a directory or a redis:// URL, they are shared by all
+the workers as they are built, see cache_backends.py.
+
+With --refresh SECONDS (DASH_SPECTRA_REFRESH) galaxies appended to the
+catalog with catalog.append_catalog are shown without a restart: every
+worker checks for them when an open page asks, at most every SECONDS.
+'''
+import argparse
+import os
+import warnings
+
+from catalog import CatalogWatcher, load_catalog, share_catalog
+
+
+def create_app(path, shm=False, figure_store=None, cache=None, refresh=None):
+    '''
+    Build the Dash app of a catalog directory.
+
+    Input
+    -----
+
+    path: String
+          Directory saved with catalog.save_catalog.
+
+    shm: Bool. Default=False
+         Copy the catalog to /dev/shm first, see catalog.share_catalog.
+
+    figure_store: String. Default=None
+                  SQLite file precomputed for this catalog with
+                  figure_store.py (catalogs with spectra only).
+
+    cache: String. Default=None
+           Directory or redis:// URL of a cache shared by the server
+           processes (catalogs with spectra only). Entries are kept apart
+           per version of the catalog.
+
+    refresh: Float. Default=None
+             Seconds between the checks of open pages for galaxies
+             appended to the catalog (see catalog.append_catalog). With
+             shm, rows have to be appended to the copy in shared memory.
+    '''
+    if figure_store is not None:
+        from figure_store import FigureStore, catalog_fingerprint
+
+        figure_store = FigureStore(figure_store)
+        if figure_store.meta('catalog') != catalog_fingerprint(path):
+            raise ValueError(f'{figure_store.path} was not computed for the current version of {path}')
+    cache_namespace = None
+    if cache is not None:
+        from figure_store import catalog_fingerprint
+
+        cache_namespace = catalog_fingerprint(path)[:16]
+    if shm:
+        path = share_catalog(path)
+    # Watching starts before loading, so no append is missed in between.
+    options = {}
+    if refresh is not None:
+        options = dict(refresh=CatalogWatcher(path), refresh_interval=refresh)
+    app_name, kwargs = load_catalog(path)
+    if app_name == 'images':
+        from dash_script_images import dash_plot_images
+        return dash_plot_images(**kwargs, **options)
+    if app_name == 'panels':
+        from dash_app import dash_plot
+        return dash_plot(**kwargs, figure_store=figure_store, cache=cache, cache_namespace=cache_namespace,
+                         **options)
+    from dash_script import dash_plot_spectra
+    return dash_plot_spectra(**kwargs, figure_store=figure_store, cache=cache, cache_namespace=cache_namespace,
+                             **options)
+
+
+def create_server(path=None, shm=None, figure_store=None, cache=None, refresh=None):
+    '''
+    WSGI factory: the Flask server of create_app. The catalog defaults to
+    the DASH_SPECTRA_CATALOG environment variable, shm to
+    DASH_SPECTRA_SHM=1, figure_store to DASH_SPECTRA_FIGURE_STORE, cache
+    to DASH_SPECTRA_CACHE and refresh to DASH_SPECTRA_REFRESH.
+    '''
+    if path is None:
+        path = os.environ['DASH_SPECTRA_CATALOG']
+    if shm is None:
+        shm = os.environ.get('DASH_SPECTRA_SHM') == '1'
+    if figure_store is None:
+        figure_store = os.environ.get('DASH_SPECTRA_FIGURE_STORE')
+    if cache is None:
+        cache = os.environ.get('DASH_SPECTRA_CACHE')
+    if refresh is None and os.environ.get('DASH_SPECTRA_REFRESH'):
+        refresh = float(os.environ['DASH_SPECTRA_REFRESH'])
+    return create_app(path, shm=shm, figure_store=figure_store, cache=cache, refresh=refresh).server
+
+
+def serve(path, host='127.0.0.1', port=8050, workers=None, threads=1, shm=False, figure_store=None,
+          cache=None, refresh=None):
+    '''
+    Serve a catalog with gunicorn and `workers` forked processes (one per
+    core by default). Falls back to the single-process Flask server if
+    gunicorn isn't installed.
+    '''
+    server = create_server(path, shm=shm, figure_store=figure_store, cache=cache, refresh=refresh)
+    workers = workers or os.cpu_count() or 1
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        warnings.warn('gunicorn is not installed, serving with a single process')
+        server.run(host=host, port=port, threaded=True)
+        return
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return server
+
+    Application().run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a catalog saved with catalog.save_catalog.')
+    parser.add_argument('catalog', help='directory saved with catalog.save_catalog')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--workers', type=int, default=None, help='default: number of cores')
+    parser.add_argument('--threads', type=int, default=1, help='threads per worker')
+    parser.add_argument('--shm', action='store_true', help='copy the catalog to /dev/shm first')
+    parser.add_argument('--figure-store', default=None, help='SQLite file written by figure_store.py')
+    parser.add_argument('--cache', default=None, help='directory or redis:// URL shared by the workers')
+    parser.add_argument('--refresh', type=float, default=None,
+                        help='seconds between the checks for galaxies appended to the catalog')
+    args = parser.parse_args()
+    serve(args.catalog, args.host, args.port, args.workers, args.threads, args.shm, args.figure_store,
+          args.cache, args.refresh)
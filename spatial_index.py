@@ -0,0 +1,178 @@
+import copy
+
+import numpy as np
+
+
+class GridIndex:
+    '''
+    Nearest-neighbour lookup of galaxies in a 2D plane.
+
+    The points are bucketed once into a grid of about points_per_cell points
+    per cell. The cell edges are quantiles of x and y, so that dense and
+    sparse parts of the plane get cells of similar occupancy. A query only
+    looks at the cells around the queried position, moving outwards ring by
+    ring until no closer point can exist, which takes a handful of cells for
+    any realistic catalog.
+
+    Distances are measured after scaling both axes to the range of the data,
+    so that "nearest" matches what looks nearest on the plot.
+
+    Input
+    -----
+
+    x, y: 1D arrays (N_points)
+          Coordinates of the points. Points with non-finite coordinates are
+          never returned.
+
+    points_per_cell: Integer. Default=4
+                     Average number of points per grid cell.
+    '''
+
+    def __init__(self, x, y, points_per_cell=4):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        if len(finite) == 0:
+            raise ValueError('GridIndex needs at least one point with finite coordinates')
+
+        self.x0, self.y0 = x[finite].min(), y[finite].min()
+        self.x_span = (x[finite].max() - self.x0) or 1.
+        self.y_span = (y[finite].max() - self.y0) or 1.
+        self.n_cells = max(1, int(np.sqrt(len(finite) / points_per_cell)))
+
+        u, v = self._scale(x[finite], y[finite])
+        quantiles = np.linspace(0, 1, self.n_cells + 1)
+        self.u_edges = np.quantile(u, quantiles)
+        self.v_edges = np.quantile(v, quantiles)
+        cell = self._cell(u, self.u_edges) * self.n_cells + self._cell(v, self.v_edges)
+        order = np.argsort(cell, kind='stable')
+        self.index = finite[order]
+        self.u = u[order]
+        self.v = v[order]
+        self.starts = np.searchsorted(cell[order], np.arange(self.n_cells**2 + 1))
+        self.n_added = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def extended(self, x, y, start):
+        '''
+        Copy of the index with the points x, y added under the indices
+        start, start + 1, ... (e.g. rows appended to a catalog), without
+        recomputing the cells: the new points are inserted into the cells
+        they fall in. Points outside the range the index was built for go
+        to the cells on its border, which stays correct but gets slower as
+        they pile up, so indexes should be rebuilt once n_added (the number
+        of points added since building) is a good fraction of their size.
+
+        The index itself is left alone, so that queries running meanwhile
+        see either the old or the new points.
+        '''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        u, v = self._scale(x[finite], y[finite])
+        cell = self._cell(u, self.u_edges) * self.n_cells + self._cell(v, self.v_edges)
+        order = np.argsort(cell, kind='stable')
+        cell = cell[order]
+        # New points go after the points already in their cell.
+        position = self.starts[cell + 1]
+
+        index = copy.copy(self)
+        index.index = np.insert(self.index, position, finite[order] + start)
+        index.u = np.insert(self.u, position, u[order])
+        index.v = np.insert(self.v, position, v[order])
+        index.starts = self.starts + np.searchsorted(cell, np.arange(self.n_cells**2 + 1))
+        index.n_added = self.n_added + len(finite)
+        return index
+
+    def _scale(self, x, y):
+        return (x - self.x0) / self.x_span, (y - self.y0) / self.y_span
+
+    def _cell(self, u, edges):
+        return np.clip(np.searchsorted(edges, u, side='right') - 1, 0, self.n_cells - 1)
+
+    def _cells(self, x, y):
+        u, v = self._scale(float(x), float(y))
+        return u, v, int(self._cell(u, self.u_edges)), int(self._cell(v, self.v_edges))
+
+    def _bound(self, u, v, cx, cy, r):
+        '''
+        Squared distance from (u, v) beyond which points can only be in
+        cells further than r rings from (cx, cy).
+        '''
+        last = self.n_cells - 1
+        x_low, x_high = max(cx - r, 0), min(cx + r, last)
+        y_low, y_high = max(cy - r, 0), min(cy + r, last)
+        # Any point outside the cells searched so far is further away
+        # than the closest edge of the searched block (edges on the
+        # border of the grid have nothing beyond them).
+        edges = [np.inf if x_low == 0 else u - self.u_edges[x_low],
+                 np.inf if x_high == last else self.u_edges[x_high + 1] - u,
+                 np.inf if y_low == 0 else v - self.v_edges[y_low],
+                 np.inf if y_high == last else self.v_edges[y_high + 1] - v]
+        return max(min(edges), 0)**2
+
+    def _cell_points(self, i, j):
+        return self.starts[i * self.n_cells + j], self.starts[i * self.n_cells + j + 1]
+
+    def nearest(self, x, y):
+        '''Index of the point closest to (x, y).'''
+        u, v, cx, cy = self._cells(x, y)
+        best, best_distance = -1, np.inf
+
+        for r in range(self.n_cells):
+            for i, j in _ring(cx, cy, r, self.n_cells - 1):
+                start, stop = self._cell_points(i, j)
+                if start == stop:
+                    continue
+                distance = (self.u[start:stop] - u)**2 + (self.v[start:stop] - v)**2
+                k = np.argmin(distance)
+                if distance[k] < best_distance:
+                    best, best_distance = self.index[start + k], distance[k]
+            if best >= 0 and best_distance <= self._bound(u, v, cx, cy, r):
+                break
+        return int(best)
+
+    def nearest_k(self, x, y, k):
+        '''Indices of the k points closest to (x, y), closest first.'''
+        u, v, cx, cy = self._cells(x, y)
+        k = min(k, len(self))
+        found, distances = [], []
+
+        for r in range(self.n_cells):
+            for i, j in _ring(cx, cy, r, self.n_cells - 1):
+                start, stop = self._cell_points(i, j)
+                if start == stop:
+                    continue
+                found.append(self.index[start:stop])
+                distances.append((self.u[start:stop] - u)**2 + (self.v[start:stop] - v)**2)
+            if sum(len(d) for d in distances) >= k:
+                distances = [np.concatenate(distances)]
+                found = [np.concatenate(found)]
+                kth = np.partition(distances[0], k - 1)[k - 1]
+                if kth <= self._bound(u, v, cx, cy, r):
+                    break
+
+        distances, found = np.concatenate(distances), np.concatenate(found)
+        closest = np.argsort(distances, kind='stable')[:k]
+        return found[closest]
+
+    def nearest_many(self, x, y):
+        '''Indices of the points closest to every (x[i], y[i]).'''
+        return np.array([self.nearest(a, b) for a, b in zip(np.ravel(x), np.ravel(y))],
+                        dtype=np.int64).reshape(np.shape(x))
+
+
+def _ring(cx, cy, r, last):
+    '''Cells at Chebyshev distance r from (cx, cy) inside the grid.'''
+    if r == 0:
+        return [(cx, cy)]
+    cells = []
+    for i in (cx - r, cx + r):
+        if 0 <= i <= last:
+            cells += [(i, j) for j in range(max(cy - r, 0), min(cy + r, last) + 1)]
+    for j in (cy - r, cy + r):
+        if 0 <= j <= last:
+            cells += [(i, j) for i in range(max(cx - r + 1, 0), min(cx + r - 1, last) + 1)]
+    return cells
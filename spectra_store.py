@@ -0,0 +1,362 @@
+import os
+import zipfile
+
+import numpy as np
+
+
+class SpectraStore:
+    '''
+    Lazily loaded spectra that can be passed to dash_plot_spectra in place
+    of an in-memory (N_points, N_features) array.
+
+    Only the rows that are asked for are read from disk, so the memory used
+    by the app does not grow with the size of the catalog.
+
+    Input
+    -----
+
+    data: array-like (N_points, N_features)
+          Anything that supports data[ind] and data.shape, e.g. a np.memmap,
+          an h5py Dataset or a zarr Array.
+
+    source: Object. Default=None
+            Handle that owns data (e.g. an open h5py File). It is kept alive
+            for as long as the store exists.
+    '''
+
+    def __init__(self, data, source=None):
+        if len(data.shape) != 2:
+            raise ValueError(f'spectra should be 2D (N_points, N_features), got shape {data.shape}')
+        self.data = data
+        self.source = source
+
+    @property
+    def shape(self):
+        return tuple(self.data.shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(self.data.dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, ind):
+        return np.asarray(self.data[ind])
+
+    def iter_chunks(self, chunk_size=4096):
+        '''
+        Iterate over the store in blocks of rows.
+
+        Yields (start, block) where block is a 2D array holding rows
+        start:start+len(block).
+        '''
+        for start in range(0, len(self), chunk_size):
+            yield start, np.asarray(self.data[start:start + chunk_size])
+
+    def __repr__(self):
+        return f'{type(self).__name__}(shape={self.shape}, dtype={self.dtype})'
+
+
+# Codes of quantized spectra: int16 codes map the flux range of a row onto
+# -CODE_MAX..CODE_MAX, with MISSING marking NaNs; float16 codes hold the flux
+# scaled into -1..1 (NaNs stay NaN).
+QUANTIZED_DTYPES = (np.dtype(np.int16), np.dtype(np.float16))
+CODE_MAX = 32766
+MISSING = -32768
+
+
+def quantize_rows(rows, dtype=np.int16):
+    '''
+    Quantize a block of spectra (N_rows, N_features) to 16-bit codes with a
+    scale and an offset per row, such that rows ~ codes * scale + offset.
+    Non-finite values are stored as missing and read back as NaN.
+
+    Output
+    ------
+
+    Returns (codes, scale, offset)
+    '''
+    dtype = np.dtype(dtype)
+    if dtype not in QUANTIZED_DTYPES:
+        raise ValueError(f'dtype should be int16 or float16, got {dtype}')
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+    finite = np.isfinite(rows)
+    with np.errstate(invalid='ignore'):
+        low = np.where(finite, rows, np.inf).min(axis=1)
+        high = np.where(finite, rows, -np.inf).max(axis=1)
+    empty = ~np.isfinite(low)
+    low[empty], high[empty] = 0, 0
+    offset = (low + high) / 2
+    scale = (high - low) / 2
+    if dtype == np.int16:
+        scale /= CODE_MAX
+    # Constant rows are stored as zeros, whatever the scale.
+    normalized = (rows - offset[:, None]) / np.where(scale > 0, scale, 1)[:, None]
+    if dtype == np.int16:
+        codes = np.where(finite, np.rint(normalized), MISSING).astype(np.int16)
+    else:
+        codes = np.where(finite, normalized, np.nan).astype(np.float16)
+    return codes, scale, offset
+
+
+class QuantizedSpectraStore(SpectraStore):
+    '''
+    Spectra stored as 16-bit codes (int16 or float16) with a float64 scale
+    and offset per row, taking a quarter of the memory and disk space of
+    float64 spectra. Only the rows that are read are dequantized, to
+    float32.
+
+    Build one with quantize_spectra, or load one saved in a catalog.
+
+    Input
+    -----
+
+    codes: array-like (N_points, N_features) of int16 or float16
+           E.g. a np.memmap.
+
+    scale, offset: array-like (N_points)
+                   Dequantized rows are codes * scale + offset.
+
+    source: Object. Default=None
+            See SpectraStore.
+    '''
+
+    def __init__(self, codes, scale, offset, source=None):
+        super().__init__(codes, source)
+        if np.dtype(codes.dtype) not in QUANTIZED_DTYPES:
+            raise ValueError(f'codes should be int16 or float16, got {codes.dtype}')
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def code_dtype(self):
+        return np.dtype(self.data.dtype)
+
+    def __getitem__(self, ind):
+        codes = np.asarray(self.data[ind])
+        scale = np.asarray(self.scale[ind], dtype=np.float32)[..., None]
+        offset = np.asarray(self.offset[ind], dtype=np.float32)[..., None]
+        rows = codes.astype(np.float32) * scale + offset
+        if self.code_dtype == np.int16:
+            rows[codes == MISSING] = np.nan
+        return rows
+
+    def __setitem__(self, ind, rows):
+        '''Quantize and store rows, e.g. when writing a catalog (see catalog.py).'''
+        codes, scale, offset = quantize_rows(rows, self.code_dtype)
+        self.data[ind] = codes
+        self.scale[ind] = scale
+        self.offset[ind] = offset
+
+    def iter_chunks(self, chunk_size=4096):
+        for start in range(0, len(self), chunk_size):
+            yield start, self[start:start + chunk_size]
+
+    def error_bound(self, ind=slice(None)):
+        '''
+        Largest absolute error of the dequantized values of rows ind: half a
+        code step (int16) or float16 rounding (2^-11 of the scale), plus the
+        float32 rounding of the dequantization.
+        '''
+        scale = np.abs(np.asarray(self.scale[ind], dtype=np.float64))
+        offset = np.abs(np.asarray(self.offset[ind], dtype=np.float64))
+        if self.code_dtype == np.int16:
+            step, code_max = scale / 2, CODE_MAX
+        else:
+            step, code_max = scale * 2.**-11, 1
+        return step + 2 * np.finfo(np.float32).eps * (offset + scale * code_max)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(shape={self.shape}, codes={self.code_dtype})'
+
+
+def quantize_spectra(spectra, dtype=np.int16, chunk_size=4096, path=None, max_error=None):
+    '''
+    Quantize spectra to 16-bit codes, chunk by chunk, so that catalogs larger
+    than memory can be converted.
+
+    Input
+    -----
+
+    spectra: 2D array (N_points, N_features), SpectraStore or path
+             The spectra.
+
+    dtype: np.int16 or np.float16. Default=np.int16
+           int16 spreads 65533 levels evenly over the flux range of every
+           row; float16 keeps about 3 significant digits of every value
+           instead, which suits rows with a few very bright pixels.
+
+    chunk_size: Integer. Default=4096
+                Number of rows quantized at once.
+
+    path: String. Default=None
+          Directory to write the codes, scales and offsets to as .npy
+          files (see open_quantized). None keeps them in memory.
+
+    max_error: Float. Default=None
+               Largest error allowed, as a fraction of the flux range of a
+               row. The dequantized values are compared to the input and a
+               ValueError is raised for the first row that exceeds it.
+
+    Output
+    ------
+
+    Returns a QuantizedSpectraStore
+    '''
+    spectra = as_spectra_store(spectra)
+    n_points, n_features = spectra.shape
+    if path is None:
+        quantized = QuantizedSpectraStore(np.empty((n_points, n_features), dtype=dtype),
+                                          np.empty(n_points), np.empty(n_points))
+    else:
+        os.makedirs(path, exist_ok=True)
+        quantized = QuantizedSpectraStore(*[
+            np.lib.format.open_memmap(os.path.join(path, name), mode='w+', dtype=array_dtype, shape=shape)
+            for name, array_dtype, shape in [('codes.npy', dtype, (n_points, n_features)),
+                                             ('scale.npy', np.float64, (n_points,)),
+                                             ('offset.npy', np.float64, (n_points,))]])
+
+    for start, block in spectra.iter_chunks(chunk_size):
+        stop = start + len(block)
+        quantized[start:stop] = block
+        if max_error is not None:
+            scale = np.asarray(quantized.scale[start:stop])
+            flux_range = 2 * scale * (CODE_MAX if quantized.code_dtype == np.int16 else 1)
+            error = np.nanmax(np.abs(quantized[start:stop] - block), axis=1, initial=0)
+            bad = np.flatnonzero(error > max_error * flux_range)
+            if len(bad):
+                raise ValueError(f'Quantizing row {start + bad[0]} to {np.dtype(dtype)} has an error of '
+                                 f'{error[bad[0]] / flux_range[bad[0]]:.2g} of its flux range, '
+                                 f'more than max_error={max_error}')
+
+    if path is not None:
+        for array in (quantized.data, quantized.scale, quantized.offset):
+            array.flush()
+    return quantized
+
+
+def open_quantized(path):
+    '''Memory-map quantized spectra written by quantize_spectra(path=...).'''
+    return QuantizedSpectraStore(*[np.load(os.path.join(path, name), mmap_mode='r')
+                                   for name in ('codes.npy', 'scale.npy', 'offset.npy')])
+
+
+def open_npy(path):
+    '''Memory-map a .npy file.'''
+    return SpectraStore(np.load(path, mmap_mode='r'))
+
+
+def open_npz(path, key=None):
+    '''
+    Memory-map one array of a .npz file.
+
+    The archive has to be written with np.savez (not np.savez_compressed),
+    since compressed members can not be memory-mapped.
+    '''
+    with zipfile.ZipFile(path) as archive:
+        names = [name[:-4] for name in archive.namelist() if name.endswith('.npy')]
+        if key is None:
+            if len(names) != 1:
+                raise ValueError(f'{path} contains {names}, choose one with key')
+            key = names[0]
+        info = archive.getinfo(key + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f'{key} in {path} is compressed and can not be memory-mapped. '
+                         'Save it with np.savez instead of np.savez_compressed.')
+
+    with open(path, 'rb') as f:
+        # The local file header is 30 bytes followed by the file name and
+        # an extra field whose lengths are stored at bytes 26-30.
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    data = np.memmap(path, dtype=dtype, mode='r', shape=shape,
+                     order='F' if fortran_order else 'C', offset=offset)
+    return SpectraStore(data)
+
+
+def open_hdf5(path, key=None):
+    '''
+    Open a dataset of an HDF5 file, or its only dataset if key is None.
+    Requires h5py.
+    '''
+    import h5py
+
+    source = h5py.File(path, 'r')
+    if key is None:
+        names = []
+        source.visititems(lambda name, item: names.append(name) if isinstance(item, h5py.Dataset) else None)
+        if len(names) != 1:
+            source.close()
+            raise ValueError(f'{path} contains {names}, choose one with key')
+        key = names[0]
+    return SpectraStore(source[key], source=source)
+
+
+def open_zarr(path, key=None):
+    '''Open a zarr array (or an array inside a zarr group). Requires zarr.'''
+    import zarr
+
+    source = zarr.open(path, mode='r')
+    data = source if key is None else source[key]
+    return SpectraStore(data, source=source)
+
+
+def open_spectra(path, key=None):
+    '''
+    Open spectra stored on disk without loading them into memory.
+
+    Input
+    -----
+
+    path: String
+          .npy, .npz, .h5/.hdf5 or .zarr file, or a directory of quantized
+          spectra written by quantize_spectra.
+
+    key: String. Default=None
+         Name of the array inside .npz, HDF5 or zarr files.
+         Not needed if the file only contains one array.
+
+    Output
+    ------
+
+    Returns a SpectraStore
+    '''
+    if os.path.exists(os.path.join(path, 'codes.npy')):
+        return open_quantized(path)
+    extension = os.path.splitext(os.fspath(path).rstrip('/'))[1].lower()
+    if extension == '.npy':
+        return open_npy(path)
+    if extension == '.npz':
+        return open_npz(path, key)
+    if extension in ('.h5', '.hdf5'):
+        return open_hdf5(path, key)
+    if extension == '.zarr':
+        return open_zarr(path, key)
+    raise ValueError(f'Unknown spectra file format: {path}')
+
+
+def as_spectra_store(spectra):
+    '''
+    Return spectra as a SpectraStore. Strings are opened with open_spectra,
+    stores are returned as they are and arrays are wrapped without copying.
+    '''
+    if isinstance(spectra, SpectraStore):
+        return spectra
+    if isinstance(spectra, (str, os.PathLike)):
+        return open_spectra(spectra)
+    if not hasattr(spectra, 'shape'):
+        spectra = np.asarray(spectra)
+    return SpectraStore(spectra)
@@ -0,0 +1,304 @@
+'''
+The spectrum and zoom plots of the apps (see dash_app.py).
+
+SpectrumPanels holds the spectra of the catalog and builds the figures of
+the panels once, the updates sent when a galaxy is hovered (dash.Patch
+objects, or float32 arrays in clientside mode) and the stacked spectra of
+selections.
+'''
+import numpy as np
+import plotly.graph_objects as go
+from dash import Patch
+
+from encoding import typed_array
+from preprocessing import flux_ranges, format_zoom_title
+from spectra_store import QuantizedSpectraStore, as_spectra_store, quantize_rows, quantize_spectra
+
+
+class SpectrumPanels:
+    '''
+    The spectrum plot and the zoom plots of a catalog.
+
+    Input
+    -----
+
+    spectra, wavelength, spec_colors, spec_names, y_max, y_min, zoom,
+    zoom_windows, zoom_extras, downsample, downsample_points,
+    y_range_percentiles, quantize, stack, stack_percentiles, stack_sample:
+    The arguments of dash_plot_spectra with the same names.
+    '''
+
+    def __init__(self, spectra, wavelength, spec_colors, spec_names, y_max=None, y_min=None,
+                 zoom=None, zoom_windows=None, zoom_extras=None, downsample=None,
+                 downsample_points=2000, y_range_percentiles=None, quantize=None,
+                 stack=False, stack_percentiles=(16, 84), stack_sample=1000):
+        spectra = [as_spectra_store(spectrum) for spectrum in spectra]
+        if quantize is not None:
+            spectra = [spectrum if isinstance(spectrum, QuantizedSpectraStore) else quantize_spectra(spectrum, quantize)
+                       for spectrum in spectra]
+        self.spectra = spectra
+        self.quantize = quantize
+        self.wavelength = [np.asarray(wavelength[i]) for i in range(len(spectra))]
+        self.spec_colors = spec_colors
+        self.spec_names = spec_names
+
+        # Only kept when the ranges are computed here, see extend.
+        self.y_range_percentiles = None
+        if y_max is None and y_range_percentiles is not None:
+            self.y_range_percentiles = y_range_percentiles
+            y_min, y_max = self._flux_ranges(spectra)
+        self.y_min, self.y_max = y_min, y_max
+
+        # Everything the hover updates need per zoom plot, so that they only
+        # have to index arrays. Titles are formatted on hover, which takes
+        # microseconds, rather than for the whole catalog up front.
+        self.zoom = zoom
+        self.zoom_labels = [] if zoom is None else list(zoom.keys())
+        self.zoom_centers = [] if zoom is None else [np.asarray(centers) for centers in zoom.values()]
+        self.zoom_windows = zoom_windows
+        self.zoom_titles = None if zoom_extras is None else [
+            {key: np.asarray(values) for key, values in extras.items()} for extras in zoom_extras]
+
+        self.downsample_method = downsample if isinstance(downsample, str) else None
+        if self.downsample_method is not None:
+            downsample = self._downsample(spectra, downsample_points)
+        self.downsample = downsample
+        self.downsample_points = downsample_points
+
+        self.stack_percentiles = stack_percentiles
+        self.stacker = None
+        if stack:
+            from stacking import SpectrumStacker
+            self.stacker = SpectrumStacker(spectra, stack_percentiles, stack_sample)
+
+        self.graph_ids = ['spectrum'] + self.zoom_labels
+
+    def _flux_ranges(self, spectra):
+        ranges = [flux_ranges(spectrum, self.y_range_percentiles) for spectrum in spectra]
+        return np.fmin.reduce([low for low, high in ranges]), np.fmax.reduce([high for low, high in ranges])
+
+    def _downsample(self, spectra, downsample_points):
+        from downsample import downsample_spectra
+        return [downsample_spectra(spectra[i], self.wavelength[i], downsample_points, self.downsample_method)
+                for i in range(len(spectra))]
+
+    def extend(self, spectra, y_max=None, y_min=None, zoom=None, zoom_extras=None, downsample=None):
+        '''
+        Use spectra with rows appended, e.g. from a catalog that grew (see
+        catalog.append_catalog), with the other per-galaxy arguments of
+        dash_plot_spectra for all the rows. The current rows have to be
+        unchanged: what was quantized or computed from the spectra (y ranges,
+        downsampling) is only computed for the new rows.
+        '''
+        computed_y = self.y_range_percentiles is not None
+        computed_downsample = self.downsample_method is not None
+        for name, value, current in [('y_max', y_max, None if computed_y else self.y_max),
+                                     ('zoom', zoom, self.zoom),
+                                     ('zoom_extras', zoom_extras, self.zoom_titles),
+                                     ('downsample', downsample, None if computed_downsample else self.downsample)]:
+            if value is None and current is not None:
+                raise ValueError(f'{name} has to be given for all the rows, as when the panels were built')
+        n = len(self.spectra[0])
+        spectra = [as_spectra_store(spectrum) for spectrum in spectra]
+        if self.quantize is not None:
+            spectra = [spectrum if isinstance(spectrum, QuantizedSpectraStore) else
+                       QuantizedSpectraStore(*[np.concatenate(parts) for parts in zip(
+                           (old.data, old.scale, old.offset), quantize_rows(spectrum[n:], self.quantize))])
+                       for spectrum, old in zip(spectra, self.spectra)]
+        if computed_y or computed_downsample:
+            new = [spectrum[n:] for spectrum in spectra]
+
+        if computed_y:
+            y_min, y_max = [np.concatenate(parts) for parts in zip((self.y_min, self.y_max),
+                                                                   self._flux_ranges(new))]
+        if computed_downsample:
+            downsample = [np.concatenate(parts) for parts in zip(
+                self.downsample, self._downsample(new, self.downsample_points))]
+        zoom_centers = self.zoom_centers if zoom is None else [np.asarray(zoom[label])
+                                                               for label in self.zoom_labels]
+        zoom_titles = self.zoom_titles if zoom_extras is None else [
+            {key: np.asarray(values) for key, values in extras.items()} for extras in zoom_extras]
+
+        if self.stacker is not None:
+            self.stacker.extend(spectra)
+        # Hovers running meanwhile only index the current rows, which are
+        # the same in the old and the new arrays.
+        self.y_min, self.y_max = y_min, y_max
+        self.zoom_centers, self.zoom_titles = zoom_centers, zoom_titles
+        self.downsample = downsample
+        self.spectra = spectra
+
+    def overview(self, i, ind, row):
+        '''Wavelength and flux of spectrum i shown in the main spectrum plot.'''
+        if self.downsample is None:
+            return self.wavelength[i], row
+        index = np.asarray(self.downsample[i][ind])
+        return self.wavelength[i][index], row[index]
+
+    def zoom_window(self, i, l, center):
+        '''Slice of spectrum i inside zoom window l, one point wider on each side.'''
+        start, stop = np.searchsorted(self.wavelength[i],
+                                      [center-self.zoom_windows[l], center+self.zoom_windows[l]])
+        return slice(max(start-1, 0), stop+1)
+
+    def zoom_title(self, l, ind):
+        if self.zoom_titles is None:
+            return self.zoom_labels[l]
+        return format_zoom_title(self.zoom_titles[l], ind)
+
+    def y_range(self, ind):
+        # None without finite bounds (e.g. no finite flux), leaving the range
+        # as it is: NaN isn't valid JSON for the clientside payloads.
+        if self.y_max is None:
+            return None
+        y_range = [float(self.y_min[ind]), float(self.y_max[ind])]
+        return y_range if np.all(np.isfinite(y_range)) else None
+
+    def rows(self, ind):
+        return [spectrum[ind] for spectrum in self.spectra]
+
+    def _add_stack_traces(self, fig, showlegend=True):
+        # Empty until galaxies are selected. They come after the hovered
+        # spectra, so the hover updates keep their trace numbers.
+        band = f'{self.stack_percentiles[0]}-{self.stack_percentiles[1]}%'
+        for i in range(len(self.spectra)):
+            color, name = self.spec_colors[i], self.spec_names[i]
+            line = dict(color=color, width=0)
+            fig.add_trace(go.Scatter(x=[], y=[], mode='lines', line=line, hoverinfo='skip',
+                                     showlegend=False))
+            fig.add_trace(go.Scatter(x=[], y=[], mode='lines', line=line, fill='tonexty',
+                                     opacity=0.3, name=f'{name} {band}', showlegend=showlegend))
+            fig.add_trace(go.Scatter(x=[], y=[], mode='lines', line=dict(color=color, dash='dash'),
+                                     name=f'{name} mean', showlegend=showlegend))
+            fig.add_trace(go.Scatter(x=[], y=[], mode='lines', line=dict(color=color, dash='dot'),
+                                     name=f'{name} median', showlegend=showlegend))
+
+    def spectrum_figure(self, ind):
+        fig = go.Figure()
+        for i, row in enumerate(self.rows(ind)):
+            wl, flux = self.overview(i, ind, row)
+            fig.add_trace(go.Scatter(x=wl, y=flux, mode='lines',
+                                     marker=dict(color=self.spec_colors[i]), name=self.spec_names[i]))
+        if self.stacker is not None:
+            self._add_stack_traces(fig)
+
+        fig.update_xaxes(title='Rest-Frame Wavelength (A)')
+        fig.update_yaxes(title='flux')
+        fig.update_layout(width=2000, height=650, font=dict(size=30))
+        fig.update_layout(title='Spectrum vs Wavelength', title_x=0.5)
+        if self.y_range(ind) is not None:
+            fig.update_layout(yaxis_range=self.y_range(ind))
+        return fig
+
+    def zoom_figures(self, ind):
+        rows = self.rows(ind)
+        figs = []
+        for l in range(len(self.zoom_labels)):
+            center = self.zoom_centers[l][ind]
+            window_range = [center-self.zoom_windows[l], center+self.zoom_windows[l]]
+            fig = go.Figure()
+            for i in range(len(self.spectra)):
+                window = self.zoom_window(i, l, center)
+                fig.add_trace(go.Scatter(x=self.wavelength[i][window], y=rows[i][window], mode='lines',
+                                         marker=dict(color=self.spec_colors[i]), name=self.spec_names[i]))
+            if self.stacker is not None:
+                self._add_stack_traces(fig, showlegend=False)
+            fig.update_xaxes(title='Wavelength (A)', range=window_range)
+            fig.update_yaxes(title='flux')
+            fig.update_layout(width=687.5, height=650, font=dict(size=30), showlegend=False)
+            fig.add_vline(x=center)
+            fig.update_layout(title=self.zoom_title(l, ind), title_x=0.5)
+            figs.append(fig)
+        return figs
+
+    # Patches carry the trace data as base64 float32 (Plotly typed arrays)
+    # rather than as decimal text, see encoding.py.
+    def spectrum_patch(self, ind):
+        patch = Patch()
+        for i, row in enumerate(self.rows(ind)):
+            wl, flux = self.overview(i, ind, row)
+            if self.downsample is not None:
+                patch['data'][i]['x'] = typed_array(wl)
+            patch['data'][i]['y'] = typed_array(flux)
+        if self.y_range(ind) is not None:
+            patch['layout']['yaxis']['range'] = self.y_range(ind)
+        return patch
+
+    def zoom_patches(self, ind):
+        rows = self.rows(ind)
+        patches = []
+        for l in range(len(self.zoom_labels)):
+            center = self.zoom_centers[l][ind]
+            patch = Patch()
+            for i in range(len(self.spectra)):
+                window = self.zoom_window(i, l, center)
+                patch['data'][i]['x'] = typed_array(self.wavelength[i][window])
+                patch['data'][i]['y'] = typed_array(rows[i][window])
+            patch['layout']['xaxis']['range'] = [center-self.zoom_windows[l], center+self.zoom_windows[l]]
+            patch['layout']['shapes'][0]['x0'] = center
+            patch['layout']['shapes'][0]['x1'] = center
+            patch['layout']['title']['text'] = self.zoom_title(l, ind)
+            patches.append(patch)
+        return patches
+
+    def arrays(self, ind):
+        '''
+        Header and arrays of the clientside payload of galaxy ind (see
+        clientside.panels_hover_js): the flux of every spectrum in the main
+        plot, preceded by its wavelengths only when downsampled (otherwise
+        the grid of the figure stays), then the flux in every zoom plot,
+        whose wavelengths the browser slices from the grid.
+        '''
+        rows = self.rows(ind)
+        header = {'n_spectra': len(self.spectra), 'overview_x': self.downsample is not None}
+        arrays = []
+        for i in range(len(self.spectra)):
+            wl, flux = self.overview(i, ind, rows[i])
+            arrays += [wl, flux] if self.downsample is not None else [flux]
+        if self.y_range(ind) is not None:
+            header['y_range'] = self.y_range(ind)
+        if self.zoom_labels:
+            header['zoom_centers'] = [float(centers[ind]) for centers in self.zoom_centers]
+            header['zoom_titles'] = [self.zoom_title(l, ind) for l in range(len(self.zoom_labels))]
+            header['zoom_starts'] = []
+            for l, center in enumerate(header['zoom_centers']):
+                windows = [self.zoom_window(i, l, center) for i in range(len(self.spectra))]
+                header['zoom_starts'].append([int(window.start) for window in windows])
+                arrays += [rows[i][window] for i, window in enumerate(windows)]
+        return header, arrays
+
+    def stack_panels(self, ind):
+        '''
+        Data of the stack traces of the spectrum plot and of every zoom plot
+        for the selected galaxies ind, empty when nothing is selected.
+        '''
+        stacked = self.stacker.stack(ind)
+        curves = ['low', 'high', 'mean', 'median']
+        n_spectra = len(self.spectra)
+        traces = list(range(n_spectra, n_spectra * (1 + len(curves))))
+        panels = [dict(traces=traces, x=[], y=[]) for _ in self.graph_ids]
+        panels[0]['title'] = 'Spectrum vs Wavelength'
+        if stacked is None:
+            for panel in panels:
+                panel['x'] = panel['y'] = [[] for _ in traces]
+            return panels
+
+        panels[0]['title'] += f' ({stacked["n"]} selected)'
+        for i in range(n_spectra):
+            keep = slice(None)
+            if self.downsample is not None:
+                from downsample import lttb_indices
+                keep = lttb_indices(self.wavelength[i], np.nan_to_num(stacked['mean'][i]),
+                                    self.downsample_points)[0]
+            windows = [keep]
+            # Wide enough for the zoom windows of every selected galaxy.
+            for l in range(len(self.zoom_labels)):
+                centers = self.zoom_centers[l][ind]
+                start = self.zoom_window(i, l, centers.min()).start
+                stop = self.zoom_window(i, l, centers.max()).stop
+                windows.append(slice(start, stop))
+            for panel, window in zip(panels, windows):
+                for curve in curves:
+                    panel['x'].append(typed_array(self.wavelength[i][window]))
+                    panel['y'].append(typed_array(stacked[curve][i][window]))
+        return panels
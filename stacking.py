@@ -0,0 +1,181 @@
+'''
+Stacked spectra of a selection of galaxies.
+
+Selecting galaxies in the 2D plane (box or lasso) shows the mean, the median
+and a percentile band of their spectra. Selections can hold a large part of
+the catalog, so the stack is computed in one chunked pass over the rows of
+the selection, reading them from memory-mapped or lazily loaded spectra (see
+spectra_store.py) a chunk at a time.
+
+The mean is computed from per-wavelength sums and counts, which are kept for
+the last few selections. A selection that differs from one of them by only a
+few galaxies, e.g. when a box is dragged a little or a lasso redrawn around
+the same group, only adds and subtracts the rows of the galaxies that
+changed.
+
+Medians and percentiles can't be updated that way, so they are computed
+from a subsample of at most sample_size galaxies of the selection. The
+subsample is the selected galaxies with the lowest of a random priority
+drawn once per galaxy, so that it changes little when the selection does.
+Selections smaller than sample_size are used whole.
+'''
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def nan_percentiles(rows, percentiles):
+    '''
+    Percentiles along the first axis of rows, ignoring NaNs, with the linear
+    interpolation of np.nanpercentile but a single sort for all of them.
+
+    Output
+    ------
+
+    Returns a 2D array (len(percentiles), N_features).
+    '''
+    rows = np.sort(rows, axis=0)  # NaNs are sorted last
+    n = np.isfinite(rows).sum(axis=0)
+    last = np.maximum(n - 1, 0)
+    out = np.empty((len(percentiles), rows.shape[1]))
+    for k, q in enumerate(percentiles):
+        position = q / 100 * last
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        a = np.take_along_axis(rows, low[None], axis=0)[0]
+        b = np.take_along_axis(rows, high[None], axis=0)[0]
+        out[k] = a + (b - a) * (position - low)
+    out[:, n == 0] = np.nan
+    return out
+
+
+class SpectrumStacker:
+    '''
+    Mean, median and percentile band of the spectra of selected galaxies.
+
+    Input
+    -----
+
+    spectra: List of 2D arrays or SpectraStores (N_points, N_features)
+             The spectra of dash_plot_spectra.
+
+    percentiles: tuple (low, high). Default=(16, 84)
+                 Percentiles of the band.
+
+    sample_size: Integer. Default=1000
+                 Maximum number of galaxies the median and the band are
+                 computed from.
+
+    chunk_size: Integer. Default=4096
+                Number of rows read at once.
+
+    n_partial: Integer. Default=8
+               Number of recent selections whose sums are kept for
+               incremental updates.
+
+    seed: Integer. Default=0
+          Seed of the subsampling priorities.
+    '''
+
+    def __init__(self, spectra, percentiles=(16, 84), sample_size=1000, chunk_size=4096,
+                 n_partial=8, seed=0):
+        self.spectra = spectra
+        self.percentiles = tuple(percentiles)
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.priority = self.rng.random(len(spectra[0]))
+        self.partial = deque(maxlen=n_partial)
+        self.lock = threading.Lock()
+
+    def extend(self, spectra):
+        '''
+        Use spectra with rows appended (the current rows unchanged), giving
+        the new galaxies priorities too. Recent sums stay valid.
+        '''
+        n_new = len(spectra[0]) - len(self.priority)
+        self.priority = np.concatenate([self.priority, self.rng.random(n_new)])
+        self.spectra = spectra
+
+    def _sums(self, ind, sign=1, sums=None):
+        '''Add (sign=1) or subtract (sign=-1) the sums and counts of rows ind.'''
+        if sums is None:
+            sums = [(np.zeros(spectrum.shape[1]), np.zeros(spectrum.shape[1], dtype=np.int64))
+                    for spectrum in self.spectra]
+        for start in range(0, len(ind), self.chunk_size):
+            chunk = ind[start:start + self.chunk_size]
+            for spectrum, (total, count) in zip(self.spectra, sums):
+                rows = spectrum[chunk]
+                chunk_total = rows.sum(axis=0, dtype=np.float64)
+                chunk_count = np.full(rows.shape[1], len(rows))
+                if not np.isfinite(chunk_total).all():
+                    # Only chunks with missing values pay for the mask.
+                    missing = ~np.isfinite(rows)
+                    np.copyto(rows, 0, where=missing)
+                    chunk_total = rows.sum(axis=0, dtype=np.float64)
+                    chunk_count -= missing.sum(axis=0)
+                total += sign * chunk_total
+                count += sign * chunk_count
+        return sums
+
+    def sums(self, ind):
+        '''
+        Per-wavelength sums and counts of the finite values of the spectra of
+        galaxies ind (sorted, unique), as a list of (sums, counts), one per
+        spectrum. Starts from the closest recent selection when that's less
+        work.
+        '''
+        with self.lock:
+            partial = list(self.partial)
+        best = None
+        for previous, sums in partial:
+            added = np.setdiff1d(ind, previous, assume_unique=True)
+            removed = np.setdiff1d(previous, ind, assume_unique=True)
+            if len(added) + len(removed) < (len(ind) if best is None else best[0]):
+                best = len(added) + len(removed), added, removed, sums
+
+        if best is None:
+            sums = self._sums(ind)
+        else:
+            _, added, removed, previous_sums = best
+            sums = [(total.copy(), count.copy()) for total, count in previous_sums]
+            self._sums(added, 1, sums)
+            self._sums(removed, -1, sums)
+        with self.lock:
+            self.partial.append((ind, sums))
+        return sums
+
+    def sample(self, ind):
+        '''The galaxies of ind the median and band are computed from, sorted.'''
+        if len(ind) <= self.sample_size:
+            return ind
+        lowest = np.argpartition(self.priority[ind], self.sample_size)[:self.sample_size]
+        return np.sort(ind[lowest])
+
+    def stack(self, ind):
+        '''
+        Stacked spectra of galaxies ind.
+
+        Output
+        ------
+
+        Returns a Python dictionary with the number of galaxies ('n') and
+        lists (one 1D array per spectrum) of the 'mean', the 'median' and the
+        'low' and 'high' percentiles. None if ind is empty.
+        '''
+        ind = np.unique(np.asarray(ind, dtype=np.int64))
+        if len(ind) == 0:
+            return None
+        sums = self.sums(ind)
+        sample = self.sample(ind)
+        stacked = {'n': len(ind), 'mean': [], 'median': [], 'low': [], 'high': []}
+        for spectrum, (total, count) in zip(self.spectra, sums):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stacked['mean'].append(np.where(count > 0, total / count, np.nan))
+            low, median, high = nan_percentiles(
+                spectrum[sample], (self.percentiles[0], 50, self.percentiles[1]))
+            stacked['median'].append(median)
+            stacked['low'].append(low)
+            stacked['high'].append(high)
+        return stacked
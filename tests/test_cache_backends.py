@@ -0,0 +1,149 @@
+import fnmatch
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from cache_backends import FileCache, RedisCache, fingerprint, open_cache
+
+
+class FakeRedis:
+    '''The part of redis.Redis used by RedisCache, in a dictionary.'''
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None):
+        self.data[name] = value.encode() if isinstance(value, str) else value
+
+    def exists(self, name):
+        return int(name in self.data)
+
+    def scan_iter(self, match):
+        return [name for name in list(self.data) if fnmatch.fnmatch(name, match)]
+
+    def delete(self, name):
+        self.data.pop(name, None)
+
+
+class DownRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('Redis is down')
+        return fail
+
+
+@pytest.fixture(params=['file', 'redis'])
+def cache(request, tmp_path):
+    if request.param == 'file':
+        return FileCache(str(tmp_path / 'cache'))
+    return RedisCache(FakeRedis())
+
+
+def test_round_trip(cache):
+    cache.put(('spectrum', 3), '{"data": 1}')
+    cache.put(('binary', 3), b'\x00\x01')
+    assert cache.get(('spectrum', 3)) == b'{"data": 1}'
+    assert cache.get(('binary', 3)) == b'\x00\x01'
+    assert ('spectrum', 3) in cache
+
+
+def test_miss(cache):
+    assert cache.get(('spectrum', 4)) is None
+    assert cache.get(('spectrum', 4), 'default') == 'default'
+    assert ('spectrum', 4) not in cache
+
+
+def test_namespaces_are_separate(cache):
+    first, second = cache.namespaced('a'), cache.namespaced('b')
+    first.put(('spectrum', 0), b'first')
+    assert second.get(('spectrum', 0)) is None
+    second.put(('spectrum', 0), b'second')
+    assert first.get(('spectrum', 0)) == b'first'
+    assert cache.get(('spectrum', 0)) is None
+
+
+def test_clear(cache):
+    cache.put(('spectrum', 0), b'value')
+    cache.clear()
+    assert cache.get(('spectrum', 0)) is None
+
+
+def test_redis_errors_are_misses():
+    cache = RedisCache(DownRedis())
+    cache.put(('spectrum', 0), b'value')
+    assert cache.get(('spectrum', 0)) is None
+    assert ('spectrum', 0) not in cache
+
+
+def test_threads_writing_the_same_file(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'))
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: cache.put(('spectrum', 0), b'value' * 1000), range(200)))
+    assert cache.get(('spectrum', 0)) == b'value' * 1000
+    assert len(os.listdir(os.path.dirname(cache._path(('spectrum', 0))))) == 1
+
+
+def test_file_errors_are_skipped(tmp_path, caplog):
+    cache = FileCache(str(tmp_path / 'cache'))
+    (tmp_path / 'cache').rmdir()
+    (tmp_path / 'cache').write_text('not a directory')
+    cache.put(('spectrum', 0), b'value')
+    assert ('spectrum', 0) not in cache
+    assert 'failed' in caplog.text
+
+
+def test_open_cache(tmp_path):
+    assert open_cache(None) is None
+    cache = open_cache(str(tmp_path), namespace='ns')
+    assert isinstance(cache, FileCache) and cache.directory == str(tmp_path / 'ns')
+    redis = open_cache(RedisCache(FakeRedis()), namespace='ns')
+    assert redis.prefix == 'dash_spectra:ns:'
+
+
+def test_fingerprint():
+    spectra = np.ones((100, 50))
+    assert fingerprint({'spectra': spectra}) == fingerprint({'spectra': spectra.copy()})
+    assert fingerprint({'spectra': spectra}) != fingerprint({'spectra': spectra * 7})
+    assert fingerprint({'spectra': spectra}) != fingerprint({'spectra': np.ones((100, 60))})
+    assert fingerprint({'spectra': spectra, 'zoom_windows': [50]}) != fingerprint(
+        {'spectra': spectra, 'zoom_windows': [60]})
+    # Every row counts, not only a sample of them.
+    changed = np.ones((1000, 50))
+    changed[500, 3] = 2
+    assert fingerprint({'spectra': np.ones((1000, 50))}) != fingerprint({'spectra': changed})
+
+
+def test_fingerprint_of_files(tmp_path):
+    filename = str(tmp_path / 'spectra.npy')
+    np.save(filename, np.arange(5000.).reshape(100, 50))
+    spectra = np.load(filename, mmap_mode='r')
+    before = fingerprint({'spectra': spectra})
+    assert fingerprint({'spectra': np.load(filename, mmap_mode='r')}) == before
+    assert fingerprint({'spectra': spectra[:50]}) != fingerprint({'spectra': spectra[50:]})
+    assert fingerprint(filename) != fingerprint(str(tmp_path / 'other.npy'))
+    named = fingerprint(filename)
+    os.utime(filename, ns=(0, 0))
+    assert fingerprint({'spectra': np.load(filename, mmap_mode='r')}) != before
+    assert fingerprint(filename) != named
+
+
+def test_apps_sharing_a_cache(tmp_path):
+    from dash_script import dash_plot_spectra
+
+    def payload(n_features, value, cache):
+        spectra = np.full((5, n_features), value, dtype=np.float32)
+        app = dash_plot_spectra(x={'x': np.arange(5.)}, y={'y': np.arange(5.)}, spectra=[spectra],
+                                wavelength=[np.linspace(4000., 5000., n_features)], clientside=True,
+                                cache=cache)
+        return app.server.test_client().get('/_binary/panels/0').data
+
+    shared = str(tmp_path / 'shared')
+    first = payload(100, 1., shared)
+    second = payload(300, 7., shared)
+    assert first != second
+    assert second == payload(300, 7., None)
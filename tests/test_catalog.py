@@ -0,0 +1,64 @@
+import struct
+
+import numpy as np
+import pytest
+
+from catalog import _append_npy, _npy_header
+
+
+def save_tight(filename, array):
+    '''Save a C-ordered array as .npy without the spare header space numpy leaves for growing it.'''
+    header = repr({'descr': np.lib.format.dtype_to_descr(array.dtype), 'fortran_order': False,
+                   'shape': array.shape}).encode()
+    header += b' ' * (-(len(header) + 11) % 64) + b'\n'
+    with open(filename, 'wb') as f:
+        f.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header)
+        f.write(np.ascontiguousarray(array).data)
+
+
+@pytest.mark.parametrize('n_points', [9, 99999])
+def test_append_in_place(tmp_path, n_points):
+    filename = str(tmp_path / 'x.npy')
+    array = np.arange(n_points * 2, dtype=np.float32).reshape(n_points, 2)
+    np.save(filename, array)
+    offset = _npy_header(filename)[3]
+    before = np.load(filename, mmap_mode='r')
+
+    rows = -np.arange(6, dtype=np.float32).reshape(3, 2)
+    _append_npy(filename, rows, n_points)
+    # The number of rows gains a digit, which fits in the header.
+    assert _npy_header(filename)[3] == offset
+    assert np.array_equal(np.load(filename), np.concatenate([array, rows]))
+    assert np.array_equal(before, array)
+
+    # Rows left behind by an interrupted append are dropped.
+    _append_npy(filename, rows[:1] * 10, n_points)
+    assert np.array_equal(np.load(filename), np.concatenate([array, rows[:1] * 10]))
+
+
+def test_append_rewrites_headers_that_do_not_fit(tmp_path):
+    filename = str(tmp_path / 'x.npy')
+    # Enough axes for the header to fill its 128 bytes, so that the number
+    # of rows can't gain a digit in place.
+    array = np.arange(27, dtype=np.int16).reshape((9, 3) + (1,) * 16)
+    save_tight(filename, array)
+    assert np.array_equal(np.load(filename), array)
+    assert _npy_header(filename)[3] == 128
+    before = np.load(filename, mmap_mode='r')
+
+    rows = np.full((991,) + array.shape[1:], -1, dtype=np.int16)
+    _append_npy(filename, rows, 9)
+    assert _npy_header(filename)[3] > 128
+    assert np.array_equal(np.load(filename), np.concatenate([array, rows]))
+    # Memory maps of the old file keep reading it.
+    assert np.array_equal(before, array)
+    assert not [path for path in tmp_path.iterdir() if path.name != 'x.npy']
+
+
+def test_append_fortran_order(tmp_path):
+    filename = str(tmp_path / 'x.npy')
+    array = np.asfortranarray(np.arange(12.).reshape(4, 3))
+    np.save(filename, array)
+    rows = np.ones((2, 3))
+    _append_npy(filename, rows, 4)
+    assert np.array_equal(np.load(filename), np.concatenate([array, rows]))
@@ -0,0 +1,71 @@
+import json
+import struct
+
+import numpy as np
+
+from dash_script import dash_plot_spectra
+from dash_script_images import dash_plot_images
+from spatial_index import GridIndex
+from spectrum_panels import SpectrumPanels
+
+N = 500
+
+
+def test_clientside_prefetch_uses_the_axes_shown():
+    rng = np.random.default_rng(0)
+    x = {'a': rng.random(N), 'b': rng.random(N)}
+    y = {'c': rng.random(N)}
+    app = dash_plot_spectra(x=x, y=y, spectra=[rng.normal(size=(N, 20))], wavelength=[np.arange(20.)],
+                            clientside=True, prefetch=5, prefetch_workers=1)
+    client = app.server.test_client()
+
+    def prefetched(query):
+        app.figure_cache.clear()
+        app.prefetcher.latest.clear()
+        assert client.get(f'/_binary/panels/7{query}').status_code == 200
+        app.prefetcher.executor.submit(lambda: None).result()
+        return {key[1] for key, _ in app.figure_cache.items()} - {7}
+
+    def neighbours(label):
+        return set(GridIndex(x[label], y['c']).nearest_k(x[label][7], y['c'][7], 6)) - {7}
+
+    assert prefetched('?x=b&y=c') == neighbours('b')
+    assert prefetched('?x=a&y=c') == prefetched('') == neighbours('a')
+    assert prefetched('?x=d&y=c') == set()
+    app.prefetcher.shutdown()
+
+
+def test_spectra_without_finite_flux_keep_the_y_range():
+    rng = np.random.default_rng(0)
+    spectra = rng.normal(size=(N, 20))
+    spectra[3] = np.nan
+    app = dash_plot_spectra(x={'a': rng.random(N)}, y={'c': rng.random(N)}, spectra=[spectra],
+                            wavelength=[np.arange(20.)], y_range_percentiles=(1, 99), clientside=True)
+    client = app.server.test_client()
+
+    def header(ind):
+        payload = client.get(f'/_binary/panels/{ind}').data
+        # Strict JSON, like JSON.parse in the browser.
+        return json.loads(payload[4:4 + struct.unpack('<I', payload[:4])[0]], parse_constant=ValueError)
+
+    assert 'y_range' in header(2) and 'y_range' not in header(3)
+    panels = SpectrumPanels([spectra], [np.arange(20.)], ['black'], ['coadd'], y_range_percentiles=(1, 99))
+    locations = [operation['location'] for operation in panels.spectrum_patch(3).to_plotly_json()['operations']]
+    assert locations and not [location for location in locations if location[0] == 'layout']
+    assert panels.spectrum_figure(3).layout.yaxis.range is None
+
+
+def menus(app):
+    return {menu.id: menu.style['display'] for menu in app.layout.children[0].children}
+
+
+def test_single_choice_menus():
+    rng = np.random.default_rng(0)
+    x, y, z = {'a': rng.random(N)}, {'c': rng.random(N)}, {'z': rng.random(N)}
+    hidden = {'x axis': 'none', 'y axis': 'none', 'color coding': 'none'}
+    assert menus(dash_plot_spectra(x=x, y=y, color_code=z, spectra=[rng.normal(size=(N, 20))],
+                                   wavelength=[np.arange(20.)])) == hidden
+    # The images app has always shown its color coding menu.
+    for color_code in (z, None):
+        app = dash_plot_images(x=x, y=y, color_code=color_code, images=[rng.random((N, 4, 4))], image_labels=['g'])
+        assert menus(app) == dict(hidden, **{'color coding': 'inline-block'})
@@ -0,0 +1,51 @@
+import numpy as np
+
+from decimation import LevelOfDetail, _cell
+
+
+def points(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    # A dense blob and a few outliers far from it.
+    x, y = rng.normal(size=n), rng.normal(size=n)
+    x[:5], y[:5] = 20 * np.arange(1, 6), -50
+    return x, y
+
+
+def test_all_points_shown_below_max_points():
+    x, y = points(500)
+    lod = LevelOfDetail(x, y, max_points=1000)
+    assert np.array_equal(lod.indices(), np.arange(500))
+
+
+def test_subsample_keeps_every_occupied_cell():
+    x, y = points()
+    lod = LevelOfDetail(x, y, max_points=2000, bins=16)
+    shown = lod.indices()
+    assert len(shown) == 2000
+    assert len(np.unique(shown)) == len(shown)
+    # The outliers have cells of their own.
+    assert set(range(5)) <= set(shown)
+    cells = set(_cell(x, 16) * 16 + _cell(y, 16))
+    assert set(_cell(x, 16)[shown] * 16 + _cell(y, 16)[shown]) == cells
+
+
+def test_view_only_returns_points_inside_it():
+    x, y = points()
+    lod = LevelOfDetail(x, y, max_points=1000)
+    shown = lod.indices((-1, 0.5), (0, 2))
+    assert len(shown) == 1000
+    assert np.all((x[shown] >= -1) & (x[shown] <= 0.5) & (y[shown] >= 0) & (y[shown] <= 2))
+    # Zooming in keeps the points that were already shown there.
+    inside = np.flatnonzero((x >= -0.5) & (x <= 0) & (y >= 0.5) & (y <= 1))
+    zoomed = lod.indices((-0.5, 0), (0.5, 1))
+    assert set(np.intersect1d(shown, inside)) <= set(zoomed)
+
+
+def test_extended_adds_the_new_points():
+    x, y = points(3000)
+    lod = LevelOfDetail(x, y, max_points=10000)
+    x_new, y_new = points(1000, seed=1)
+    extended = lod.extended(x_new, y_new)
+    assert len(lod) == 3000 and len(extended) == 4000
+    assert np.array_equal(extended.indices(), np.arange(4000))
+    assert np.array_equal(extended.x[np.argsort(extended.order)], np.concatenate([x, x_new]))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from downsample import downsample_spectra, lttb_indices, minmax_indices
+
+
+def spectra(n=50, m=3000, seed=0):
+    '''Noisy spectra with an emission line at a different pixel in every row.'''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(3600, 9000, m)
+    flux = rng.normal(size=(n, m))
+    lines = rng.integers(1, m - 1, n)
+    flux[np.arange(n), lines] = 100
+    return wavelength, flux, lines
+
+
+@pytest.mark.parametrize('n_out', [3, 100, 2999])
+def test_lttb_keeps_endpoints_and_lines(n_out):
+    wavelength, flux, lines = spectra()
+    index = lttb_indices(wavelength, flux, n_out)
+    assert index.shape == (len(flux), n_out)
+    assert np.all(index[:, 0] == 0) and np.all(index[:, -1] == flux.shape[1] - 1)
+    assert np.all(np.diff(index, axis=1) > 0)
+    if n_out > 3:
+        assert all(line in row for line, row in zip(lines, index))
+
+
+@pytest.mark.parametrize('n_out, n_kept', [(4, 4), (101, 100), (1000, 1000)])
+def test_minmax_keeps_endpoints_and_extremes(n_out, n_kept):
+    wavelength, flux, lines = spectra()
+    flux[:, 500:510] = np.nan
+    index = minmax_indices(flux, n_out)
+    assert index.shape == (len(flux), n_kept)
+    assert np.all(index[:, 0] == 0) and np.all(index[:, -1] == flux.shape[1] - 1)
+    assert np.all(np.diff(index, axis=1) >= 0)
+    for row, values, line in zip(index, flux, lines):
+        assert line in row
+        assert np.nanmin(values[1:-1]) == values[row[1:-1]].min()
+        assert not np.isnan(values[row]).any()
+
+
+def test_short_spectra_are_kept_whole():
+    wavelength, flux, _ = spectra(m=50)
+    for index in (lttb_indices(wavelength, flux, 100), minmax_indices(flux, 100)):
+        assert np.array_equal(index, np.broadcast_to(np.arange(50), (len(flux), 50)))
+    with pytest.raises(ValueError):
+        lttb_indices(wavelength, flux, 2)
+    with pytest.raises(ValueError):
+        minmax_indices(flux, 3)
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_downsample_spectra_in_chunks(tmp_path, method):
+    wavelength, flux, _ = spectra()
+    direct = lttb_indices(wavelength, flux, 200) if method == 'lttb' else minmax_indices(flux, 200)
+    index = downsample_spectra(flux, wavelength, 200, method, chunk_size=7)
+    assert index.dtype == np.uint16
+    assert np.array_equal(index, direct)
+    on_disk = downsample_spectra(flux, wavelength, 200, method, chunk_size=7, path=str(tmp_path / 'index.npy'))
+    assert np.array_equal(np.load(tmp_path / 'index.npy'), direct)
+    assert np.array_equal(on_disk, direct)
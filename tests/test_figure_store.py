@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from catalog import save_catalog
+from figure_store import FigureStore, precompute_figures
+
+N = 20
+
+
+def test_precompute_figures(tmp_path):
+    rng = np.random.default_rng(0)
+    path, store_path = str(tmp_path / 'catalog'), str(tmp_path / 'figures.sqlite')
+    save_catalog(path, x={'a': rng.random(N)}, y={'b': rng.random(N)},
+                 spectra=[rng.normal(size=(N, 30))], wavelength=[np.arange(30.)])
+    assert precompute_figures(path, store_path, workers=1, chunk_size=8) == N
+    assert len(FigureStore(store_path)) == N
+    # Resumed runs only build what is missing.
+    assert precompute_figures(path, store_path, workers=1) == 0
+
+
+def test_precompute_figures_needs_spectra(tmp_path):
+    rng = np.random.default_rng(0)
+    path, store_path = str(tmp_path / 'catalog'), tmp_path / 'figures.sqlite'
+    save_catalog(path, app='images', x={'a': rng.random(N)}, y={'b': rng.random(N)},
+                 images=[rng.random((N, 8, 8))])
+    with pytest.raises(ValueError, match='no spectra'):
+        precompute_figures(path, str(store_path), workers=1)
+    assert not store_path.exists()
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from image_cache import ImageCache
+
+
+def test_route_rejects_unknown_cutouts(tmp_path):
+    from dash_script_images import dash_plot_images
+
+    images = [np.random.default_rng(0).random((20, 256, 256), dtype=np.float32)]
+    app = dash_plot_images(x={'x': np.arange(20.)}, y={'y': np.arange(20.)}, images=images,
+                           image_labels=['g'], image_format='png', image_size=100, image_urls=True,
+                           image_cache_dir=str(tmp_path))
+    client = app.server.test_client()
+    level = app.image_cache.levels[0]
+    assert client.get(f'/_images/0/{level}/3.png').status_code == 200
+    for url in [f'/_images/1/{level}/3.png', f'/_images/0/{level}/20.png', '/_images/0/40/3.png',
+                f'/_images/0/{level + 1}/3.png']:
+        assert client.get(url).status_code == 404
+    assert os.listdir(app.image_cache.cache_dir) == [f'0_3_{level}.png']
+
+
+def test_only_used_levels_are_written(tmp_path):
+    cache = ImageCache([np.ones((2, 256, 256))], cache_dir=str(tmp_path), levels=[1])
+    cache.get(0, 0, 0)
+    cache.get(0, 0, 1)
+    assert os.listdir(cache.cache_dir) == ['0_0_1.png']
+    assert not cache.has_level(0, 0) and cache.has_level(0, 1)
+    assert ImageCache([np.ones((2, 256, 256))]).has_level(0, 1)
+
+
+def test_cache_dirs_of_other_images_and_colorscales(tmp_path):
+    images = [np.random.default_rng(0).random((2, 64, 64))]
+    cache = ImageCache(images, cache_dir=str(tmp_path))
+    assert ImageCache([images[0].copy()], cache_dir=str(tmp_path)).cache_dir == cache.cache_dir
+    assert ImageCache([images[0] * 2], cache_dir=str(tmp_path)).cache_dir != cache.cache_dir
+    other = ImageCache(images, cmap='viridis', cache_dir=str(tmp_path))
+    assert other.cache_dir != cache.cache_dir
+    assert other.get(0, 1) != cache.get(0, 1)
+    assert other.get(0, 1) == ImageCache(images, cmap='viridis', cache_dir=str(tmp_path)).get(0, 1)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from catalog import load_catalog, load_metadata
+from loaders import load_hdf5, load_parquet, write_catalog
+
+N = 10
+
+
+@pytest.fixture
+def survey():
+    rng = np.random.default_rng(0)
+    return {'RA': rng.random(N), 'DEC': rng.random(N), 'Z': rng.random(N).astype(np.float32),
+            'TARGETID': np.arange(N) + 1000, 'flux': rng.normal(size=(N, 20))}
+
+
+def chunks(survey, size):
+    return ({name: values[start:start + size] for name, values in survey.items()}
+            for start in range(0, N, size))
+
+
+def check_catalog(path, survey, spectra_atol=0.):
+    app, kwargs = load_catalog(str(path))
+    assert app == 'spectra'
+    assert np.array_equal(kwargs['x']['ra'], survey['RA'])
+    assert np.array_equal(kwargs['y']['dec'], survey['DEC'])
+    assert np.array_equal(kwargs['color_code']['z'], survey['Z'])
+    assert np.allclose(kwargs['spectra'][0][:], survey['flux'], rtol=1e-6, atol=spectra_atol)
+    assert np.array_equal(kwargs['wavelength'][0], np.arange(20.))
+    assert np.array_equal(load_metadata(str(path))['id'], survey['TARGETID'])
+    return kwargs
+
+
+@pytest.mark.parametrize('chunk_size', [3, N])
+def test_write_catalog_from_chunks(tmp_path, survey, chunk_size):
+    write_catalog(str(tmp_path), N, chunks(survey, chunk_size), {'ra': 'RA'}, {'dec': 'DEC'}, {'z': 'Z'},
+                  spectra=['flux'], wavelength=[np.arange(20.)], metadata={'id': 'TARGETID'},
+                  zoom_windows=[5])
+    kwargs = check_catalog(tmp_path, survey)
+    assert kwargs['zoom_windows'] == [5]
+    assert kwargs['color_code']['z'].dtype == np.float32
+
+
+def test_write_quantized_catalog(tmp_path, survey):
+    write_catalog(str(tmp_path), N, chunks(survey, 4), {'ra': 'RA'}, {'dec': 'DEC'}, {'z': 'Z'},
+                  spectra=['flux'], wavelength=[np.arange(20.)], metadata={'id': 'TARGETID'},
+                  spectra_dtype=np.int16)
+    spectra = check_catalog(tmp_path, survey, spectra_atol=1e-3)['spectra'][0]
+    assert spectra.code_dtype == np.int16
+
+
+@pytest.mark.parametrize('n_points', [N - 1, N + 1])
+def test_write_catalog_checks_the_number_of_objects(tmp_path, survey, n_points):
+    with pytest.raises(ValueError):
+        write_catalog(str(tmp_path), n_points, chunks(survey, 4), {'ra': 'RA'}, {'dec': 'DEC'})
+
+
+def test_load_hdf5(tmp_path, survey):
+    h5py = pytest.importorskip('h5py')
+    with h5py.File(tmp_path / 'survey.h5', 'w') as f:
+        for name, values in survey.items():
+            f[name] = values
+        f['wavelength'] = np.arange(20.)
+    load_hdf5(str(tmp_path / 'survey.h5'), str(tmp_path / 'catalog'), {'ra': 'RA'}, {'dec': 'DEC'},
+              {'z': 'Z'}, metadata={'id': 'TARGETID'}, chunk_size=3)
+    check_catalog(tmp_path / 'catalog', survey)
+
+
+def test_load_parquet(tmp_path, survey):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = pa.table({name: list(values) if name == 'flux' else values for name, values in survey.items()})
+    pq.write_table(table, tmp_path / 'survey.parquet', row_group_size=4)
+    load_parquet(str(tmp_path / 'survey.parquet'), str(tmp_path / 'catalog'), {'ra': 'RA'}, {'dec': 'DEC'},
+                 {'z': 'Z'}, spectra=['flux'], wavelength=[np.arange(20.)], metadata={'id': 'TARGETID'},
+                 chunk_size=3)
+    check_catalog(tmp_path / 'catalog', survey)
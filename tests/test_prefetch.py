@@ -0,0 +1,48 @@
+import threading
+
+from prefetch import Prefetcher
+
+
+def test_sessions_prefetch_on_their_own():
+    started, release, warmed = threading.Event(), threading.Event(), []
+
+    def warm(ind):
+        if ind == 1:
+            started.set()
+            release.wait(5)
+        warmed.append(ind)
+
+    prefetcher = Prefetcher(warm, lambda ind: [ind + 1, ind + 2, ind + 3], workers=2)
+    prefetcher.after(0, session='a')
+    assert started.wait(5)
+    # A hover in another window doesn't stop the prefetching of the first.
+    prefetcher.after(10, session='b')
+    release.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert sorted(warmed) == [1, 2, 3, 11, 12, 13]
+
+
+def test_moving_on_stops_prefetching():
+    started, release, warmed = threading.Event(), threading.Event(), []
+
+    def warm(ind):
+        if ind == 1:
+            started.set()
+            release.wait(5)
+        warmed.append(ind)
+
+    prefetcher = Prefetcher(warm, lambda ind: [ind + 1, ind + 2, ind + 3], workers=2)
+    prefetcher.after(0, session='a')
+    assert started.wait(5)
+    prefetcher.after(10, session='a')
+    release.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert sorted(warmed) == [1, 11, 12, 13]
+
+
+def test_least_recent_sessions_are_forgotten():
+    prefetcher = Prefetcher(lambda ind: None, lambda ind: [], max_sessions=2)
+    for ind, session in enumerate(('a', 'b', 'a', 'c')):
+        prefetcher.after(ind, session=session)
+    assert list(prefetcher.latest) == ['a', 'c']
+    prefetcher.shutdown()
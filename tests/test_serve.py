@@ -0,0 +1,109 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from catalog import append_catalog, load_catalog, save_catalog, share_catalog
+from serve import create_app, create_server
+from spectra_store import SpectraStore
+
+N = 50
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    rng = np.random.default_rng(0)
+    spectra = rng.normal(size=(N, 30)).astype(np.float32)
+    path = str(tmp_path / 'catalog')
+    save_catalog(path, x={'a': rng.random(N), 'b': rng.random(N)}, y={'c': rng.random(N)},
+                 spectra=[SpectraStore(spectra)], wavelength=[np.linspace(4000, 7000, 30)],
+                 spec_names=['coadd'], clientside=True, chunk_size=7)
+    return path, spectra
+
+
+def unpack(payload):
+    length = struct.unpack('<I', payload[:4])[0]
+    header = json.loads(payload[4:4 + length])
+    arrays, offset = [], 4 + length
+    for shape in header['shapes']:
+        size = int(np.prod(shape))
+        arrays.append(np.frombuffer(payload, '<f4', size, offset).reshape(shape))
+        offset += 4 * size
+    return header, arrays
+
+
+def test_save_and_load_catalog(catalog):
+    path, spectra = catalog
+    app, kwargs = load_catalog(path)
+    assert app == 'spectra'
+    assert list(kwargs['x']) == ['a', 'b']
+    assert isinstance(kwargs['x']['a'], np.memmap)
+    assert np.array_equal(kwargs['spectra'][0], spectra)
+    assert kwargs['spec_names'] == ['coadd'] and kwargs['clientside'] is True
+    _, in_memory = load_catalog(path, mmap_mode=None)
+    assert not isinstance(in_memory['x']['a'], np.memmap)
+    with pytest.raises(ValueError):
+        save_catalog(path, app='tables')
+
+
+def test_served_spectra_match_the_catalog(catalog):
+    path, spectra = catalog
+    client = create_app(path).server.test_client()
+    assert client.get('/').status_code == 200
+    for ind in (0, 17, N - 1):
+        header, arrays = unpack(client.get(f'/_binary/panels/{ind}').data)
+        assert header['n_spectra'] == 1
+        assert np.array_equal(arrays[0], spectra[ind])
+    assert client.get(f'/_binary/panels/{N}').status_code == 404
+
+
+def test_create_server_from_the_environment(catalog, monkeypatch):
+    path, _ = catalog
+    monkeypatch.setenv('DASH_SPECTRA_CATALOG', path)
+    assert create_server().test_client().get('/').status_code == 200
+
+
+def test_share_catalog(catalog, tmp_path):
+    path, spectra = catalog
+    shm_dir = tmp_path / 'shm'
+    shm_dir.mkdir()
+    shared = share_catalog(path, str(shm_dir))
+    assert os.path.dirname(shared) == str(shm_dir)
+    assert os.path.basename(shared).startswith('dash_spectra_catalog_')
+    assert np.array_equal(load_catalog(shared)[1]['spectra'][0], spectra)
+    # Copies are made once, and catalogs already in shared memory are used as they are.
+    assert share_catalog(path, str(shm_dir)) == shared
+    assert share_catalog(shared, str(shm_dir)) == shared
+    assert len(list(shm_dir.iterdir())) == 1
+
+
+def test_share_catalogs_with_the_same_name(catalog, tmp_path):
+    path, spectra = catalog
+    shm_dir = tmp_path / 'shm'
+    shm_dir.mkdir()
+    other = str(tmp_path / 'other' / 'catalog')
+    save_catalog(other, x={'a': np.zeros(5)}, y={'c': np.zeros(5)}, spectra=[np.ones((5, 30))],
+                 wavelength=[np.linspace(4000, 7000, 30)])
+    shared, shared_other = share_catalog(path, str(shm_dir)), share_catalog(other, str(shm_dir))
+    assert shared != shared_other
+    assert np.array_equal(load_catalog(shared)[1]['spectra'][0], spectra)
+    assert np.array_equal(load_catalog(shared_other)[1]['spectra'][0], np.ones((5, 30)))
+
+
+def test_share_catalog_saved_again(catalog, tmp_path):
+    path, _ = catalog
+    shm_dir = tmp_path / 'shm'
+    shm_dir.mkdir()
+    shared = share_catalog(path, str(shm_dir))
+    save_catalog(path, x={'a': np.zeros(5)}, y={'c': np.zeros(5)}, spectra=[np.ones((5, 30))],
+                 wavelength=[np.linspace(4000, 7000, 30)])
+    resaved = share_catalog(path, str(shm_dir))
+    assert resaved != shared
+    assert np.array_equal(load_catalog(resaved)[1]['spectra'][0], np.ones((5, 30)))
+    # The old copy is removed.
+    assert [p.name for p in shm_dir.iterdir()] == [os.path.basename(resaved)]
+    append_catalog(path, x={'a': np.ones(2)}, y={'c': np.ones(2)}, spectra=[np.ones((2, 30))])
+    appended = share_catalog(path, str(shm_dir))
+    assert appended != resaved and len(load_catalog(appended)[1]['x']['a']) == 7
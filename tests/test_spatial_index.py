@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex
+
+
+def catalog(n=5000, seed=0):
+    '''Clustered points with some non-finite coordinates, and queries inside and outside their range.'''
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([rng.normal(0, 1, n // 2), rng.normal(8, 0.05, n - n // 2)])
+    y = np.concatenate([rng.normal(0, 3, n // 2), rng.normal(-2, 0.05, n - n // 2)])
+    x[::97], y[::89] = np.nan, np.inf
+    queries = np.column_stack([rng.uniform(-6, 12, 300), rng.uniform(-12, 12, 300)])
+    return x, y, queries
+
+
+def brute_force(index, x, y, qx, qy):
+    '''Squared scaled distances from (qx, qy) to every point, inf for non-finite points.'''
+    u, v = index._scale(x, y)
+    qu, qv = index._scale(qx, qy)
+    distance = (u - qu)**2 + (v - qv)**2
+    return np.where(np.isfinite(distance), distance, np.inf)
+
+
+def test_nearest_matches_brute_force():
+    x, y, queries = catalog()
+    index = GridIndex(x, y)
+    for qx, qy in queries:
+        distance = brute_force(index, x, y, qx, qy)
+        found = index.nearest(qx, qy)
+        assert np.isfinite(x[found]) and np.isfinite(y[found])
+        assert distance[found] == distance.min()
+
+
+@pytest.mark.parametrize('k', [1, 5, 40])
+def test_nearest_k_matches_brute_force(k):
+    x, y, queries = catalog()
+    index = GridIndex(x, y)
+    for qx, qy in queries:
+        distance = brute_force(index, x, y, qx, qy)
+        found = index.nearest_k(qx, qy, k)
+        assert len(found) == k == len(set(found))
+        assert np.all(np.diff(distance[found]) >= 0)
+        assert np.allclose(distance[found], np.sort(distance)[:k])
+
+
+def test_nearest_k_is_capped_by_the_points():
+    index = GridIndex([0., 1., np.nan], [0., 1., 2.])
+    assert sorted(index.nearest_k(0.2, 0.2, 10)) == [0, 1]
+    with pytest.raises(ValueError):
+        GridIndex([np.nan], [0.])
+
+
+def test_extended_matches_brute_force():
+    x, y, queries = catalog(6000)
+    index = GridIndex(x[:4000], y[:4000])
+    # The new points include non-finite ones and some outside the range of the index.
+    x[5000:5100] += 30
+    extended = index.extended(x[4000:5000], y[4000:5000], 4000).extended(x[5000:], y[5000:], 5000)
+    assert len(index) == np.sum(np.isfinite(x[:4000]) & np.isfinite(y[:4000]))
+    assert len(extended) == np.sum(np.isfinite(x) & np.isfinite(y))
+    assert extended.n_added == len(extended) - len(index)
+    for qx, qy in np.concatenate([queries, [[35, 0], [40, -3]]]):
+        distance = brute_force(extended, x, y, qx, qy)
+        assert distance[extended.nearest(qx, qy)] == distance.min()
+        assert np.allclose(distance[extended.nearest_k(qx, qy, 10)], np.sort(distance)[:10])
+        # The original index only knows its own points.
+        assert index.nearest(qx, qy) < 4000
@@ -0,0 +1,135 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+
+from spectra_store import (QuantizedSpectraStore, open_hdf5, open_npy, open_npz, open_quantized, open_spectra,
+                           quantize_rows, quantize_spectra)
+
+
+def rows(seed=0):
+    '''Spectra of very different flux scales, a constant one and some with non-finite pixels.'''
+    rng = np.random.default_rng(seed)
+    flux = rng.normal(size=(8, 500)) * np.logspace(-17, 3, 8)[:, None] + np.linspace(-5, 5, 8)[:, None]
+    flux[2, 40] = 1e4
+    flux[3] = 2.5
+    flux[4, ::7] = np.nan
+    flux[5, 10], flux[5, 20] = np.inf, -np.inf
+    flux[6] = np.nan
+    flux[7, :] = np.inf
+    return flux
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float16])
+def test_quantized_rows_stay_within_error_bound(dtype):
+    flux = rows()
+    store = QuantizedSpectraStore(*quantize_rows(flux, dtype))
+    assert store.data.dtype == dtype
+    restored = store[:]
+    assert restored.dtype == np.float32
+
+    finite = np.isfinite(flux)
+    assert np.array_equal(np.isnan(restored), ~finite)
+    error = np.where(finite, np.abs(restored - flux), 0).max(axis=1)
+    bound = store.error_bound()
+    assert np.all(error <= bound)
+    for ind in range(len(flux)):
+        assert store.error_bound(ind) == bound[ind]
+    # Constant rows are exact, and rows without any finite value get no scale.
+    assert np.all(restored[3] == 2.5)
+    assert store.scale[6] == store.scale[7] == 0
+
+
+def test_quantize_rows_rejects_other_dtypes():
+    with pytest.raises(ValueError):
+        quantize_rows(rows(), np.int8)
+
+
+def test_quantize_spectra_in_chunks(tmp_path):
+    flux = rows()
+    store = quantize_spectra(flux, chunk_size=3, path=str(tmp_path / 'quantized'))
+    expected = QuantizedSpectraStore(*quantize_rows(flux))
+    reopened = open_quantized(str(tmp_path / 'quantized'))
+    for quantized in (store, reopened):
+        assert np.array_equal(quantized[:], expected[:], equal_nan=True)
+        assert np.array_equal(quantized[5], expected[5], equal_nan=True)
+
+
+def test_quantize_spectra_max_error():
+    flux = np.random.default_rng(1).normal(size=(5, 500))
+    assert quantize_spectra(flux, max_error=1e-4).shape == flux.shape
+    with pytest.raises(ValueError, match='row 0'):
+        quantize_spectra(flux, np.float16, max_error=1e-4)
+    # Variations of 1e-14 on an offset of 3.6 are lost to the float32 rows.
+    with pytest.raises(ValueError, match='row 1'):
+        quantize_spectra(rows(), max_error=1e-4)
+
+
+def spectra(dtype=np.float32):
+    return np.arange(60, dtype=dtype).reshape(6, 10)
+
+
+def test_open_npy(tmp_path):
+    np.save(tmp_path / 'flux.npy', spectra())
+    store = open_npy(str(tmp_path / 'flux.npy'))
+    assert isinstance(store.data, np.memmap)
+    assert np.array_equal(store[:], spectra()) and np.array_equal(store[[4, 1]], spectra()[[4, 1]])
+
+
+@pytest.mark.parametrize('array', [spectra(), spectra(np.float64).T.copy(), np.asfortranarray(spectra(np.int16))])
+def test_open_npz(tmp_path, array):
+    np.savez(tmp_path / 'one.npz', flux=array)
+    np.savez(tmp_path / 'two.npz', ivar=np.ones((2, 3)), flux=array)
+    for store in (open_npz(str(tmp_path / 'one.npz')), open_npz(str(tmp_path / 'two.npz'), 'flux')):
+        assert isinstance(store.data, np.memmap)
+        assert store.dtype == array.dtype and np.array_equal(store[:], array)
+    with pytest.raises(ValueError, match='choose one with key'):
+        open_npz(str(tmp_path / 'two.npz'))
+
+
+def test_open_npz_skips_extra_fields(tmp_path):
+    # Members of archives written by other tools may have an extra field in
+    # their local header, which the data starts after.
+    buffer = io.BytesIO()
+    np.save(buffer, spectra())
+    info = zipfile.ZipInfo('flux.npy')
+    info.extra = b'\xca\xfe\x04\x00abcd'
+    with zipfile.ZipFile(tmp_path / 'extra.npz', 'w') as archive:
+        archive.writestr(info, buffer.getvalue())
+    assert np.array_equal(open_npz(str(tmp_path / 'extra.npz'))[:], spectra())
+
+
+def test_open_npz_rejects_compressed_archives(tmp_path):
+    np.savez_compressed(tmp_path / 'flux.npz', flux=spectra())
+    with pytest.raises(ValueError, match='compressed'):
+        open_npz(str(tmp_path / 'flux.npz'))
+
+
+def test_open_spectra(tmp_path):
+    np.save(tmp_path / 'flux.npy', spectra())
+    np.savez(tmp_path / 'flux.npz', flux=spectra())
+    quantize_spectra(spectra(), path=str(tmp_path / 'quantized'))
+    for name in ('flux.npy', 'flux.npz'):
+        assert np.array_equal(open_spectra(str(tmp_path / name))[:], spectra())
+    assert isinstance(open_spectra(str(tmp_path / 'quantized')), QuantizedSpectraStore)
+    with pytest.raises(ValueError, match='Unknown spectra file format'):
+        open_spectra(str(tmp_path / 'flux.fits'))
+
+
+def test_open_hdf5(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    with h5py.File(tmp_path / 'one.h5', 'w') as f:
+        f['survey/flux'] = spectra()
+    with h5py.File(tmp_path / 'two.h5', 'w') as f:
+        f['flux'], f['ivar'] = spectra(), np.ones((6, 10))
+    assert np.array_equal(open_hdf5(str(tmp_path / 'one.h5'))[:], spectra())
+    assert np.array_equal(open_spectra(str(tmp_path / 'two.h5'), 'flux')[:], spectra())
+    with pytest.raises(ValueError, match='choose one with key'):
+        open_hdf5(str(tmp_path / 'two.h5'))
+
+
+def test_open_zarr(tmp_path):
+    zarr = pytest.importorskip('zarr')
+    zarr.save_array(str(tmp_path / 'flux.zarr'), spectra())
+    assert np.array_equal(open_spectra(str(tmp_path / 'flux.zarr'))[:], spectra())
@@ -0,0 +1,72 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from stacking import SpectrumStacker, nan_percentiles
+
+
+def spectra(n=3000, m=40, seed=0):
+    rng = np.random.default_rng(seed)
+    flux = rng.normal(size=(n, m))
+    flux[rng.random((n, m)) < 0.05] = np.nan
+    flux[:, 7] = np.nan
+    return flux
+
+
+def nanpercentile(rows, q):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(rows, q, axis=0)
+
+
+def nanmean(rows):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(rows, axis=0)
+
+
+def test_nan_percentiles_match_numpy():
+    flux = spectra(500)
+    percentiles = (0, 16, 50, 84, 100)
+    assert np.allclose(nan_percentiles(flux, percentiles), nanpercentile(flux, percentiles), equal_nan=True)
+
+
+@pytest.mark.parametrize('sample_size', [100, 10000])
+def test_stack_matches_numpy(sample_size):
+    flux = spectra()
+    stacker = SpectrumStacker([flux, 2 * flux], (10, 90), sample_size=sample_size, chunk_size=64)
+    ind = np.arange(0, 3000, 3)
+    stacked = stacker.stack(ind[::-1])
+    assert stacked['n'] == 1000
+    sample = stacker.sample(ind)
+    assert len(sample) == min(sample_size, 1000) and set(sample) <= set(ind)
+    for i, scale in enumerate((1, 2)):
+        assert np.allclose(stacked['mean'][i], scale * nanmean(flux[ind]), equal_nan=True)
+        low, median, high = nanpercentile(scale * flux[sample], (10, 50, 90))
+        assert np.allclose(stacked['median'][i], median, equal_nan=True)
+        assert np.allclose(stacked['low'][i], low, equal_nan=True)
+        assert np.allclose(stacked['high'][i], high, equal_nan=True)
+    assert stacker.stack([]) is None
+
+
+def test_changed_selections_reuse_recent_sums():
+    flux = spectra()
+    stacker = SpectrumStacker([flux], chunk_size=64)
+    stacker.stack(np.arange(2000))
+    moved = np.arange(50, 2050)
+    incremental = stacker.stack(moved)
+    fresh = SpectrumStacker([flux], chunk_size=64).stack(moved)
+    assert np.allclose(incremental['mean'][0], fresh['mean'][0], equal_nan=True)
+    assert len(stacker.partial) == 2
+
+
+def test_extend_keeps_sums_and_priorities():
+    flux = spectra()
+    stacker = SpectrumStacker([flux[:2000]], sample_size=100)
+    stacker.stack(np.arange(1000))
+    priority = stacker.priority.copy()
+    stacker.extend([flux])
+    assert np.array_equal(stacker.priority[:2000], priority) and len(stacker.priority) == 3000
+    stacked = stacker.stack(np.arange(500, 3000))
+    assert np.allclose(stacked['mean'][0], nanmean(flux[500:]), equal_nan=True)
@@ -0,0 +1,51 @@
+import pytest
+from dash.exceptions import PreventUpdate
+
+from throttle import HoverCoalescer
+
+
+def message(seq, session='a', ind=0):
+    return {'hoverData': {'points': [{'pointIndex': ind}]}, 'seq': seq, 'session': session}
+
+
+def test_plain_hover_data_passes_through():
+    coalescer = HoverCoalescer()
+    hover = {'points': [{'pointIndex': 3}]}
+    assert coalescer.begin(hover) is hover
+    assert coalescer.begin(None) is None
+    coalescer.finish(hover)
+
+
+def test_superseded_hovers_are_dropped():
+    coalescer = HoverCoalescer()
+    assert coalescer.begin(message(1, ind=1)) == {'points': [{'pointIndex': 1}]}
+    assert coalescer.begin(message(3, ind=3)) == {'points': [{'pointIndex': 3}]}
+    # Sequence number 2 arrives late, after 3.
+    with pytest.raises(PreventUpdate):
+        coalescer.begin(message(2))
+    # The same hover again (e.g. a retry) is not superseded by itself.
+    coalescer.begin(message(3))
+    coalescer.finish(message(3))
+
+
+def test_hovers_arriving_while_computing_drop_the_response():
+    coalescer = HoverCoalescer()
+    first = message(1)
+    coalescer.begin(first)
+    coalescer.begin(message(2))
+    with pytest.raises(PreventUpdate):
+        coalescer.finish(first)
+
+
+def test_sessions_are_independent():
+    coalescer = HoverCoalescer(max_sessions=2)
+    coalescer.begin(message(5, 'a'))
+    coalescer.begin(message(1, 'b'))
+    coalescer.finish(message(1, 'b'))
+    with pytest.raises(PreventUpdate):
+        coalescer.begin(message(4, 'a'))
+    # Session c pushes out a, the least recently active one, whose old
+    # sequence numbers then pass again.
+    coalescer.begin(message(1, 'c'))
+    assert list(coalescer.latest) == ['b', 'c']
+    coalescer.begin(message(4, 'a'))
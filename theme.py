@@ -0,0 +1,21 @@
+'''
+The dark Bootstrap theme of the apps.
+
+Loading the matching Plotly template takes a noticeable part of a second,
+so it is done when the first app is built rather than when the modules are
+imported, and only once per process.
+'''
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def dark_theme():
+    '''
+    Make the 'darkly' Plotly template the default and return the URL of the
+    matching Bootstrap stylesheet, for Dash(external_stylesheets=...).
+    '''
+    import dash_bootstrap_components as dbc
+    from dash_bootstrap_templates import load_figure_template
+
+    load_figure_template(['darkly'])
+    return dbc.themes.DARKLY
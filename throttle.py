@@ -0,0 +1,67 @@
+'''
+Server side of the debounced hover mode (hover_debounce) of
+dash_plot_spectra and dash_plot_images.
+
+The browser only passes a hovered point on once the cursor has rested on
+it (see clientside.debounce_hover_js), tagged with a sequence number and a
+session id per browser window. HoverCoalescer remembers the latest sequence
+number of every session, so that requests which have been superseded by a
+newer hover while they were queued or being computed are dropped with
+PreventUpdate instead of rendering and sending a point the user has already
+left.
+
+The sequence numbers are kept per server process; with several worker
+processes a request is only dropped if its worker has seen the newer one.
+'''
+import threading
+from collections import OrderedDict
+
+from dash.exceptions import PreventUpdate
+
+
+class HoverCoalescer:
+    '''
+    Latest hover sequence number of each session.
+
+    Input
+    -----
+
+    max_sessions: Integer. Default=10000
+                  Number of sessions remembered; the least recently active
+                  ones are forgotten first.
+    '''
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self.latest = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _superseded(self, session, seq):
+        with self.lock:
+            latest = self.latest.get(session, seq)
+            if seq >= latest:
+                self.latest[session] = seq
+                self.latest.move_to_end(session)
+                if len(self.latest) > self.max_sessions:
+                    self.latest.popitem(last=False)
+            return seq < latest
+
+    def begin(self, message):
+        '''
+        Start handling a hover message: returns its hoverData, or raises
+        PreventUpdate if a newer hover of the same session has been seen.
+        Plain hoverData (without debouncing) is returned as is.
+        '''
+        if not message or 'seq' not in message:
+            return message
+        if self._superseded(message['session'], message['seq']):
+            raise PreventUpdate
+        return message['hoverData']
+
+    def finish(self, message):
+        '''
+        Raise PreventUpdate if a newer hover of the same session arrived
+        while message was being handled, so its response isn't sent.
+        '''
+        if message and 'seq' in message and self._superseded(message['session'], message['seq']):
+            raise PreventUpdate